@@ -16,11 +16,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
+import io
 import os
 import csv
 import sys
+import queue
 import inspect
 import tempfile
+import threading
 import warnings
 import importlib
 import itertools
@@ -150,6 +153,115 @@ def extend(dset, array, **attrs):
     return newlength
 
 
+def memmap(dset):
+    """
+    :param dset: an h5py dataset
+    :returns: a copy-on-write memory map on the dataset or None if the
+              dataset is chunked, empty or of non-numeric type
+    """
+    if dset.chunks or dset.dtype.kind not in 'biuf':
+        return None
+    offset = dset.id.get_offset()
+    if offset is None:  # storage not allocated
+        return None
+    return numpy.memmap(dset.file.filename, dset.dtype, 'c', offset,
+                        dset.shape)
+
+
+class BufferedWriter(object):
+    """
+    Accumulate the arrays to append to extendable datasets and write them
+    in large chunks from a background thread, when the buffer exceeds
+    `maxbytes`. At most one full buffer waits to be written, so there are
+    at most three buffers in memory (one being written, one waiting and
+    one accumulating), i.e. about 3 * maxbytes. Call .close() to write the
+    remaining data and to reraise the errors in the writer thread, if any,
+    or .abort() to discard the data not written yet.
+
+    :param h5: an open h5py.File
+    :param maxbytes: size of the buffer (if 0 write immediately)
+    :param monitor: if given, used to measure the time spent writing
+    """
+    def __init__(self, h5, maxbytes, monitor=None):
+        self.h5 = h5
+        self.maxbytes = maxbytes
+        self.monitor = monitor
+        self.buffer = general.AccumDict(accum=[])  # key -> arrays
+        self.nbytes = 0
+        self.exc = None
+        self.aborted = False
+        if maxbytes:
+            self.queue = queue.Queue(maxsize=1)
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def append(self, key, array):
+        """
+        Append an array to the dataset `key`, possibly later
+        """
+        if self.exc:
+            raise self.exc
+        if not self.maxbytes:
+            extend(self.h5[key], array)
+            return
+        self.buffer[key].append(array)
+        self.nbytes += array.nbytes
+        if self.nbytes >= self.maxbytes:
+            self.flush()
+
+    def flush(self):
+        """
+        Send the buffer to the writer thread
+        """
+        if self.buffer:
+            self.queue.put(self.buffer)  # blocks if the writer is busy
+            self.buffer = general.AccumDict(accum=[])
+            self.nbytes = 0
+
+    def _write(self, buffer):
+        for key, arrays in buffer.items():
+            extend(self.h5[key],
+                   numpy.concatenate(arrays, dtype=arrays[0].dtype))
+
+    def _loop(self):
+        while True:
+            buffer = self.queue.get()
+            if buffer is None:  # closed
+                break
+            if self.exc is None and not self.aborted:
+                try:
+                    if self.monitor:
+                        with self.monitor:
+                            self._write(buffer)
+                    else:
+                        self._write(buffer)
+                except Exception as exc:
+                    self.exc = exc
+
+    def close(self):
+        """
+        Write the remaining data and stop the writer thread
+        """
+        if self.maxbytes:
+            self.flush()
+            self.queue.put(None)
+            self.thread.join()
+        if self.exc:
+            raise self.exc
+
+    def abort(self):
+        """
+        Discard the data not written yet and stop the writer thread,
+        without raising the errors in the writer thread
+        """
+        self.aborted = True
+        self.buffer = general.AccumDict(accum=[])
+        self.nbytes = 0
+        if self.maxbytes:
+            self.queue.put(None)
+            self.thread.join()
+
+
 def cls2dotname(cls):
     """
     The full Python name (i.e. `pkg.subpkg.mod.cls`) of a class
@@ -395,6 +507,56 @@ class File(h5py.File):
         for k, v in kw.items():
             attrs[k] = v
 
+    def save_df(self, key, df, **kw):
+        """
+        Save a DataFrame as a HDF5 datagroup with a contiguous dataset per
+        column, so that the numeric columns can be memory-mapped
+
+        :param key: name of the datagroup
+        :param df: a DataFrame
+        :param kw: extra attributes to store
+        """
+        for name in df.columns:
+            arr = df[name].to_numpy()
+            if arr.dtype.name == 'object':
+                self.create_dataset(f'{key}/{name}', data=arr, dtype=vstr)
+            else:
+                self.create_dataset(f'{key}/{name}', data=arr)
+        attrs = self[key].attrs
+        attrs['__pdcolumns__'] = ' '.join(df.columns)
+        for k, v in kw.items():
+            attrs[k] = v
+
+    def read_columns(self, key, columns=None, slc=slice(None), index=None):
+        """
+        Read a datagroup stored with .save_df or .create_df. The
+        contiguous numeric columns are memory-mapped and not copied.
+
+        :param key: name of the datagroup
+        :param columns: the columns to read (default all)
+        :param slc: slice object to extract a slice of the rows
+        :param index: name of the column to use as index, if any
+        :returns: pandas DataFrame associated to the datagroup
+        """
+        grp = self[key]
+        if columns is None:
+            columns = grp.attrs['__pdcolumns__'].split()
+        if index and index not in columns:
+            columns = list(columns) + [index]
+        dic = {}
+        for col in columns:
+            dset = grp[col]
+            arr = memmap(dset)
+            if arr is None:  # chunked or string dataset
+                arr = dset[slc]
+                if len(arr) and isinstance(arr[0], bytes):
+                    arr = numpy.array(decode(arr))
+                dic[col] = arr
+            else:  # zero-copy slice
+                dic[col] = arr[slc]
+        idx = dic.pop(index) if index else None
+        return pandas.DataFrame(dic, idx, copy=False)
+
     def read_df(self, key, index=None, sel=(), slc=slice(None), slices=()):
         """
         :param key: name of the structured dataset
@@ -976,8 +1138,33 @@ def sniff(fnames, sep=',', ignore=set()):
 # NB: it would be nice to use numpy.loadtxt(
 #  f, build_dt(dtypedict, header), delimiter=sep, ndmin=1, comments=None)
 # however numpy does not support quoting, and "foo,bar" would be split :-(
+def csv_blocks(fname, blocksize):
+    """
+    Split the data lines of a CSV file in blocks of full lines
+
+    :param fname: a CSV file with an header and possibly comments on top
+    :param blocksize: approximate size of each block in bytes
+    :returns: a list of byte offsets (start, stop)
+    """
+    size = os.path.getsize(fname)
+    with open(fname, 'rb') as f:
+        while True:  # skip the comments and the header
+            line = f.readline()
+            if not line.lstrip(b'\xef\xbb\xbf').startswith(b'#'):
+                break
+        blocks = []
+        start = f.tell()
+        while start < size:
+            f.seek(start + blocksize)
+            f.readline()  # go to the end of the line
+            stop = min(f.tell(), size)
+            blocks.append((start, stop))
+            start = stop
+    return blocks
+
+
 def read_csv(fname, dtypedict={None: float}, renamedict={}, sep=',',
-             index=None, errors=None, usecols=None):
+             index=None, errors=None, usecols=None, block=None):
     """
     :param fname: a CSV file with an header and float fields
     :param dtypedict: a dictionary fieldname -> dtype, None -> default
@@ -986,6 +1173,7 @@ def read_csv(fname, dtypedict={None: float}, renamedict={}, sep=',',
     :param index: if not None, returns a pandas DataFrame
     :param errors: passed to the underlying open function (default None)
     :param usecols: columns to read
+    :param block: if given, byte offsets (start, stop) of the lines to read
     :returns: an ArrayWrapper, unless there is an index
     """
     attrs = {}
@@ -1002,7 +1190,13 @@ def read_csv(fname, dtypedict={None: float}, renamedict={}, sep=',',
             header = first.strip().split(sep)
             dt = build_dt(dtypedict, header, fname)
         try:
-            df = _read_csv(fname, dt, usecols, skip)
+            if block:  # read only the lines in the block
+                with open(fname, 'rb') as f:
+                    f.seek(block[0])
+                    data = io.BytesIO(f.read(block[1] - block[0]))
+                df = _read_csv(data, dt, usecols)
+            else:
+                df = _read_csv(fname, dt, usecols, skip)
         except Exception as exc:
             err = find_error(fname, errors, dt)
             if err:
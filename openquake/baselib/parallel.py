@@ -180,6 +180,7 @@ a great deal of work trying to split slow sources in more manageable
 fast sources.
 
 """
+import io
 import os
 import re
 import ast
@@ -209,7 +210,8 @@ from openquake.baselib.performance import (
     Monitor, memory_gb, init_performance)
 from openquake.baselib.general import (
     split_in_blocks, block_splitter, AccumDict, humansize, CallableDict,
-    gettemp, engine_version, shortlist, compress, decompress, mp as mp_context)
+    gettemp, engine_version, shortlist, compress, decompress, socket_ready,
+    mp as mp_context)
 
 sys.setrecursionlimit(2000)  # raised to make pickle happier
 # see https://github.com/gem/oq-engine/issues/5230
@@ -249,7 +251,11 @@ def threadpool_submit(self, func, args, monitor):
 
 @submit.add('zmq', 'slurm')
 def zmq_submit(self, func, args, monitor):
-    idx = self.task_no % len(host_cores)
+    if self.scheduler == 'weight':
+        idx = self.least_loaded_host()
+    else:
+        idx = self.task_no % len(host_cores)
+    self.host_idx[self.task_no] = idx
     host = host_cores[idx].split()[0]
     port = int(config.zworkers.ctrl_port)
     dest = 'tcp://%s:%d' % (host, port)
@@ -269,6 +275,30 @@ def oq_distribute(task=None):
     return dist
 
 
+def get_weight(args):
+    """
+    :returns: the estimated weight of a task, i.e. the weight of args[0]
+    """
+    return getattr(args[0], 'weight', 1.)
+
+
+def get_stragglers(durations, factor=3.):
+    """
+    :param durations: an array of task durations
+    :param factor: tasks slower than factor * mean are stragglers
+    :returns: (number of stragglers, max / mean)
+
+    >>> get_stragglers(numpy.array([1., 1., 1., 1., 1., 1., 1., 10.]))
+    (1, 4.705882352941177)
+    """
+    if len(durations) == 0:
+        return 0, 1.
+    mean = durations.mean()
+    if mean == 0:
+        return 0, 1.
+    return int((durations > factor * mean).sum()), durations.max() / mean
+
+
 def init_workers():
     """Used to initialize the process pool"""
     try:
@@ -279,6 +309,79 @@ def init_workers():
         setproctitle('oq-worker')
 
 
+# ########################### shared memory transport ################## #
+
+# POSIX shared memory segments are visible as files in /dev/shm on linux,
+# which is the only platform where the transport is enabled
+SHM_DIR = '/dev/shm/' if os.path.isdir('/dev/shm') else ''
+
+
+def get_shm_min():
+    """
+    :returns: the minimum size in bytes of the arrays sent via shared memory
+    """
+    min_mb = config.distribution.get('shm_min_mb')
+    if not min_mb or not SHM_DIR:
+        return 0
+    return int(float(min_mb) * MB)
+
+
+def to_shm(array):
+    """
+    Copy an array into a new shared memory segment.
+
+    :returns: the name of the segment
+    """
+    sm = shmem.SharedMemory(create=True, size=int(array.nbytes))
+    numpy.ndarray(array.shape, array.dtype, buffer=sm.buf)[:] = array
+    sm.close()  # the segment is kept alive until it is unlinked
+    return sm.name
+
+
+def shm_unlink(names):
+    """
+    Unlink the shared memory segments with the given names, if they exist
+    """
+    for name in names:
+        try:
+            sm = shmem.SharedMemory(name=name)
+        except FileNotFoundError:  # already unlinked
+            continue
+        sm.close()
+        sm.unlink()
+
+
+class ShmPickler(pickle.Pickler):
+    """
+    A Pickler storing the large numpy arrays in shared memory; only
+    the names of the segments end up in the pickled bytestring
+    """
+    def __init__(self, file, shm_min):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.shm_min = shm_min
+        self.names = []
+
+    def persistent_id(self, obj):
+        if (type(obj) is numpy.ndarray and obj.size and
+                obj.nbytes >= self.shm_min and not obj.dtype.hasobject):
+            name = to_shm(obj)
+            self.names.append(name)
+            return 'shm', name, obj.shape, obj.dtype
+        return None  # pickle as usual
+
+
+class ShmUnpickler(pickle.Unpickler):
+    """
+    An Unpickler mapping the arrays stored in shared memory without
+    copying them; the mapping is copy-on-write, so the arrays can be
+    modified without affecting the other processes
+    """
+    def persistent_load(self, pid):
+        _shm, name, shape, dtype = pid
+        arr = numpy.memmap(SHM_DIR + name, dtype, mode='c', shape=shape)
+        return arr.view(numpy.ndarray)
+
+
 class Pickled(object):
     """
     An utility to manually pickling/unpickling objects. Pickled instances
@@ -286,20 +389,36 @@ class Pickled(object):
     of the pickled bytestring.
 
     :param obj: the object to pickle
+    :param shm_min: if positive, arrays larger than that go in shared memory
     """
     compressed = False
+    shm_names = ()
 
-    def __init__(self, obj):
+    def __init__(self, obj, shm_min=0):
         self.clsname = obj.__class__.__name__
         self.calc_id = str(getattr(obj, 'calc_id', ''))  # for monitors
         try:
-            self.pik = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+            if shm_min:
+                self.pik = self._dumps_shm(obj, shm_min)
+            else:
+                self.pik = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
         except TypeError as exc:  # can't pickle, show the obj in the message
             raise TypeError('%s: %s' % (exc, obj))
         self.compressed = len(self.pik) > MB and config.distribution.compress
         if self.compressed:
             self.pik = compress(self.pik)
 
+    def _dumps_shm(self, obj, shm_min):
+        bio = io.BytesIO()
+        pickler = ShmPickler(bio, shm_min)
+        try:
+            pickler.dump(obj)
+        except Exception:
+            shm_unlink(pickler.names)
+            raise
+        self.shm_names = pickler.names
+        return bio.getvalue()
+
     def __repr__(self):
         """String representation of the pickled object"""
         return '<Pickled %s #%s %s>' % (
@@ -312,6 +431,8 @@ class Pickled(object):
     def unpickle(self):
         """Unpickle the underlying object"""
         pik = decompress(self.pik) if self.compressed else self.pik
+        if self.shm_names:
+            return ShmUnpickler(io.BytesIO(pik)).load()
         return pickle.loads(pik)
 
 
@@ -337,7 +458,7 @@ def get_pickled_sizes(obj):
         sizes, key=lambda pair: pair[1], reverse=True)
 
 
-def pickle_sequence(objects):
+def pickle_sequence(objects, shm_min=0):
     """
     Convert an iterable of objects into a list of pickled objects.
     If the iterable contains copies, the pickling will be done only once.
@@ -345,6 +466,7 @@ def pickle_sequence(objects):
     pickled again.
 
     :param objects: a sequence of objects to pickle
+    :param shm_min: if positive, arrays larger than that go in shared memory
     """
     cache = {}
     out = []
@@ -354,7 +476,7 @@ def pickle_sequence(objects):
             if isinstance(obj, Pickled):  # already pickled
                 cache[obj_id] = obj
             else:  # pickle the object
-                cache[obj_id] = Pickled(obj)
+                cache[obj_id] = Pickled(obj, shm_min)
         out.append(cache[obj_id])
     return out
 
@@ -381,7 +503,7 @@ class Result(object):
 
     def __init__(self, val, mon, tb_str='', msg=''):
         if isinstance(val, dict):
-            self.pik = Pickled(val)
+            self.pik = Pickled(val, getattr(mon, 'shm_min', 0))
             self.nbytes = {k: len(Pickled(v)) for k, v in val.items()}
         elif isinstance(val, tuple) and callable(val[0]):
             self.func = val[0]
@@ -390,9 +512,12 @@ class Result(object):
         elif msg == 'TASK_ENDED':
             self.pik = Pickled(None)
             self.nbytes = {}
-        else:
+        elif isinstance(val, Exception):
             self.pik = Pickled(val)
             self.nbytes = {'tot': len(self.pik)}
+        else:
+            self.pik = Pickled(val, getattr(mon, 'shm_min', 0))
+            self.nbytes = {'tot': len(self.pik)}
         self.mon = mon
         self.tb_str = tb_str
         self.msg = msg
@@ -403,7 +528,11 @@ class Result(object):
         Returns the underlying value or raise the underlying exception
         """
         t0 = time.time()
-        val = self.pik.unpickle()
+        try:
+            val = self.pik.unpickle()
+        finally:
+            # the arrays are mapped, so the segments can be unlinked
+            shm_unlink(getattr(self.pik, 'shm_names', ()))
         self.dt = time.time() - t0
         if self.tb_str:
             etype = val.__class__
@@ -463,6 +592,28 @@ def check_mem_usage(soft_percent=None, hard_percent=None):
         return msg % (used_mem_percent, socket.gethostname())
 
 
+def available_gb():
+    """
+    :returns:
+        the memory available per core in GB; with zmq it is the minimum
+        over the worker nodes, as returned by their control sockets
+    """
+    avail = []
+    if oq_distribute() == 'zmq':
+        port = int(config.zworkers.ctrl_port)
+        for line in host_cores:
+            host, _cores = line.split()
+            if not socket_ready((host, port)):
+                continue
+            addr = 'tcp://%s:%s' % (host, port)
+            with Socket(addr, zmq.REQ, 'connect') as sock:
+                avail.append(sock.send('available_gb'))
+    if not avail:  # local memory
+        avail.append(psutil.virtual_memory().available / Starmap.num_cores
+                     / 1024**3)
+    return min(avail)
+
+
 dummy_mon = Monitor(dbserver_host=config.dbserver.host)
 dummy_mon.backurl = None
 DEBUG = False
@@ -697,6 +848,7 @@ class Starmap(object):
     maxtasksperchild = None  # with 1 it hangs on the EUR calculation!
     num_cores = int(config.distribution.get('num_cores', '0')) or tot_cores
     CT = num_cores * 2
+    scheduler = config.distribution.get('scheduler', 'fifo')
     expected_outputs = 0  # unknown
 
     @classmethod
@@ -797,16 +949,26 @@ class Starmap(object):
         self.monitor = Monitor(self.name, dbserver_host=config.dbserver.host)
         self.monitor.filename = h5.filename
         self.monitor.calc_id = self.calc_id
+        # large arrays are sent via shared memory only on a single machine
+        self.monitor.shm_min = (
+            get_shm_min() if self.distribute == 'processpool' else 0)
+        self.shm_names = {}  # task_no -> shared memory segments of args+results
         self.task_args = task_args
         self.progress = progress
         self.h5 = h5
         self.task_queue = []
+        if self.scheduler not in ('fifo', 'weight'):
+            raise ValueError('Invalid scheduler=%s' % self.scheduler)
+        if self.scheduler == 'weight' and self.distribute != 'no':
+            # the tasks must be known in advance to be sorted by weight
+            self.task_args = list(task_args)
         try:
             self.num_tasks = len(self.task_args)
         except TypeError:  # generators have no len
             self.num_tasks = None
         self.argnames = getargnames(task_func)
         self.sent = AccumDict(accum=AccumDict())  # fname -> argname -> nbytes
+        self.task_sent = {}  # task_no -> nbytes, popped when the task ends
         self.monitor.inject = (self.argnames[-1].startswith('mon') or
                                self.argnames[-1].endswith('mon'))
         self.receiver = 'tcp://0.0.0.0:%s' % config.dbserver.receiver_ports
@@ -820,6 +982,8 @@ class Starmap(object):
         self.task_no = 0
         self._shared = {}
         self.n_out = 0
+        self.host_idx = {}  # task_no -> index in host_cores, used by zmq
+        self.durations = []  # duration of the finished tasks
 
     def log_percent(self):
         """
@@ -871,14 +1035,19 @@ class Starmap(object):
             pickled = isinstance(args[0], Pickled)
             if not pickled:
                 assert not isinstance(args[-1], Monitor)  # sanity check
-                args = pickle_sequence(args)
+                args = pickle_sequence(args, self.monitor.shm_min)
+                names = [n for p in args for n in p.shm_names]
+                if names:  # unlinked when the task ends
+                    self.shm_names[self.task_no] = names
             if func is None:
                 fname = self.task_func.__name__
                 argnames = self.argnames[:-1]
             else:
                 fname = func.__name__
                 argnames = getargnames(func)[:-1]
-            self.sent[fname] += {a: len(p) for a, p in zip(argnames, args)}
+            nbytes = {a: len(p) for a, p in zip(argnames, args)}
+            self.sent[fname] += nbytes
+            self.task_sent[self.task_no] = sum(nbytes.values())
         submit[dist](self, func, args, self.monitor)
         self.tasks.append(self.task_no)
         self.task_no += 1
@@ -902,6 +1071,10 @@ class Starmap(object):
         else:  # build a task queue in advance
             self.task_queue = [(self.task_func, args)
                                for args in self.task_args]
+            if self.scheduler == 'weight':
+                # heavy tasks first, the light ones will fill the holes
+                self.task_queue.sort(key=lambda fa: get_weight(fa[1]),
+                                     reverse=True)
         dist = 'no' if self.num_tasks == 1 else self.distribute
         if dist == 'slurm':
             # submit the tasks via zmq
@@ -926,6 +1099,18 @@ class Starmap(object):
     def __iter__(self):
         return iter(self.submit_all())
 
+    def least_loaded_host(self):
+        """
+        :returns: the index of the host with less running tasks per core
+        """
+        running = numpy.zeros(len(host_cores))
+        for task_no in self.tasks:
+            if task_no in self.host_idx:
+                running[self.host_idx[task_no]] += 1
+        cores = numpy.array([int(line.split()[1]) for line in host_cores])
+        cores[cores <= 0] = 1  # unknown number of cores
+        return int((running / cores).argmin())
+
     def _submit_many(self, howmany):
         for _ in range(howmany):
             if self.task_queue:
@@ -950,8 +1135,33 @@ class Starmap(object):
         for name, shr in self._shared.items():
             logging.debug('Unlinking %s', name)
             shr.unlink()
+        for names in self.shm_names.values():
+            shm_unlink(names)
+        self.shm_names.clear()
+
+    def save_task_sent(self):
+        """
+        Consolidate the information about the data sent to the tasks into
+        the `task_sent` dataset; called only once, when the loop ends,
+        even with an error, since the per-task information is already stored in `task_info`
+        """
+        if not self.sent:
+            return
+        task_sent = ast.literal_eval(decode(self.h5['task_sent'][()]))
+        task_sent.update(self.sent)
+        del self.h5['task_sent']
+        self.h5['task_sent'] = str(task_sent)
 
     def _loop(self):
+        try:
+            yield from self._iloop()
+        finally:
+            # unlink the shared memory segments even if the master raised
+            # an error or some results were never unpickled
+            self.unlink()
+            self.save_task_sent()
+
+    def _iloop(self):
         self.busytime = AccumDict(accum=[])  # pid -> time
         dist = 'no' if self.num_tasks == 1 else self.distribute
         if dist == 'slurm':
@@ -959,8 +1169,12 @@ class Starmap(object):
             #sbatch(self.monitor)
 
         elif self.task_queue:
-            first_args = self.task_queue[:self.CT]
-            self.task_queue[:] = self.task_queue[self.CT:]
+            # with the weight scheduler submit one task per core and keep
+            # the others in the queue, ready to be taken by the first
+            # core becoming free
+            ct = self.CT // 2 if self.scheduler == 'weight' else self.CT
+            first_args = self.task_queue[:ct]
+            self.task_queue[:] = self.task_queue[ct:]
             for func, args in first_args:
                 self.submit(args, func=func)
 
@@ -979,18 +1193,17 @@ class Starmap(object):
             if self.calc_id != res.mon.calc_id:
                 logging.warning('Discarding a result from job %s, since this '
                                 'is job %s', res.mon.calc_id, self.calc_id)
+                shm_unlink(getattr(res.pik, 'shm_names', ()))
             elif res.msg == 'TASK_ENDED':
                 finished.add(res.mon.task_no)
+                shm_unlink(self.shm_names.pop(res.mon.task_no, ()))
                 self.busytime += {res.workerid: res.mon.duration}
+                self.durations.append(res.mon.duration)
                 self.tasks.remove(res.mon.task_no)
                 self._submit_many(1)
                 todo = set(range(self.task_no)) - finished
                 logging.debug('%d tasks todo %s', len(todo),
                               shortlist(sorted(todo)))
-                task_sent = ast.literal_eval(decode(self.h5['task_sent'][()]))
-                task_sent.update(self.sent)
-                del self.h5['task_sent']
-                self.h5['task_sent'] = str(task_sent)
                 name = res.mon.operation[6:]  # strip 'total '
                 n = self.name + ':' + name if name == 'split_task' else name
                 if self.distribute in ('zmq', 'slurm'):
@@ -1009,23 +1222,33 @@ class Starmap(object):
                     mem_gb = memory_gb()
                 else:
                     mem_gb = memory_gb(Starmap.pids)
-                res.mon.save_task_info(self.h5, res, n, mem_gb)
+                sent = self.task_sent.pop(res.mon.task_no, 0)
+                res.mon.save_task_info(self.h5, res, n, mem_gb, sent)
                 res.mon.flush(self.h5)
             elif res.func:  # add subtask
                 self.task_queue.append((res.func, res.pik))
                 self._submit_many(1)
             else:
+                # record the segments of the result, to unlink them
+                # even if the result is never unpickled
+                names = getattr(res.pik, 'shm_names', ())
+                if names:
+                    self.shm_names.setdefault(
+                        res.mon.task_no, []).extend(names)
                 self.n_out += 1
                 yield res
         self.log_percent()
         self.socket.__exit__(None, None, None)
         self.tasks.clear()
-        self.unlink()
         if len(self.busytime) > 1:
             times = numpy.array(list(self.busytime.values()))
             logging.info(
                 'Mean time per core=%ds, std=%.1fs, min=%ds, max=%ds',
                 times.mean(), times.std(), times.min(), times.max())
+            nslow, slowfac = get_stragglers(numpy.array(self.durations))
+            if nslow:
+                logging.info('%d straggler task(s) in %s, max/mean=%.1f',
+                             nslow, self.name, slowfac)
 
 
 def sequential_apply(task, args, concurrent_tasks=Starmap.CT,
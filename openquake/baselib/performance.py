@@ -49,7 +49,8 @@ perf_dt = numpy.dtype([('operation', '<S50'), ('time_sec', float),
 task_info_dt = numpy.dtype(
     [('taskname', '<S50'), ('task_no', numpy.uint32),
      ('weight', numpy.float32), ('duration', numpy.float32),
-     ('received', numpy.int64), ('mem_gb', numpy.float32)])
+     ('received', numpy.int64), ('mem_gb', numpy.float32),
+     ('sent', numpy.int64)])
 
 F16= numpy.float16
 F64= numpy.float64
@@ -311,7 +312,7 @@ class Monitor(object):
         if self.h5:
             self.flush(self.h5)
 
-    def save_task_info(self, h5, res, name, mem_gb=0):
+    def save_task_info(self, h5, res, name, mem_gb=0, sent=0):
         """
         Called by parallel.IterResult.
 
@@ -319,9 +320,10 @@ class Monitor(object):
         :param res: a :class:`Result` object
         :param name: name of the task function
         :param mem_gb: memory consumption at the saving time (optional)
+        :param sent: number of bytes sent to the task (optional)
         """
         t = (name, self.task_no, self.weight, self.duration, len(res.pik),
-             mem_gb)
+             mem_gb, sent)
         data = numpy.array([t], task_info_dt)
         hdf5.extend(h5['task_info'], data)
         h5['task_info'].flush()  # notify the reader
@@ -377,22 +379,24 @@ class Monitor(object):
             if isinstance(obj, numpy.ndarray):
                 f[key] = obj
             elif isinstance(obj, pandas.DataFrame):
-                f.create_df(key, obj)
+                f.save_df(key, obj)
             else:
                 f[key] = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
         return True
 
-    def read(self, key, slc=slice(None)):
+    def read(self, key, slc=slice(None), columns=None, index=None):
         """
         :param key: key in the _tmp.hdf5 file
         :param slc: slice to read (default all)
+        :param columns: for DataFrames, the columns to read (default all)
+        :param index: for DataFrames, the column to use as index (if any)
         :return: unpickled object
         """
         tmp = self.filename[:-5] + '_tmp.hdf5'
         with hdf5.File(tmp, 'r') as f:
             dset = f[key]
-            if '__pdcolumns__' in dset.attrs:
-                return f.read_df(key, slc=slc)
+            if '__pdcolumns__' in dset.attrs:  # memory-mapped columns
+                return f.read_columns(key, columns, slc, index)
             elif dset.shape:
                 return dset[slc]
             return pickle.loads(dset[()])
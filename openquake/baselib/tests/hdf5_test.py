@@ -16,9 +16,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import unittest
 import numpy
-from openquake.baselib.hdf5 import dumps, obj_to_json, json_to_obj
+import pandas
+from openquake.baselib.hdf5 import (
+    File, BufferedWriter, memmap, dumps, obj_to_json, json_to_obj)
 
 
 class DumpsTestCase(unittest.TestCase):
@@ -49,3 +52,71 @@ class ObjToJsonTestCase(unittest.TestCase):
         obj = Obj(1, Obj(1, 2))
         js = obj_to_json(obj)
         print(js)
+
+
+class ReadColumnsTestCase(unittest.TestCase):
+    def test(self):
+        df = pandas.DataFrame(dict(
+            ordinal=numpy.arange(10, dtype=numpy.uint32),
+            site_id=numpy.arange(10) % 3,
+            value=numpy.linspace(0, 1, 10),
+            id=['a%d' % i for i in range(10)]))
+        with File.temporary() as f:
+            f.save_df('assets', df)
+            fname = f.path
+        with File(fname, 'r') as f:
+            self.assertIsNotNone(memmap(f['assets/value']))
+            self.assertIsNone(memmap(f['assets/id']))  # strings
+            adf = f.read_columns('assets', ['site_id', 'value'],
+                                 slice(2, 5), index='ordinal')
+        self.assertEqual(list(adf.columns), ['site_id', 'value'])
+        self.assertEqual(list(adf.index), [2, 3, 4])
+        self.assertIsInstance(adf.value.to_numpy().base, numpy.memmap)
+        numpy.testing.assert_equal(adf.value.to_numpy(), df.value[2:5])
+
+        # copy-on-write: changing the DataFrame does not change the file
+        adf['value'] *= 2
+        with File(fname, 'r') as f:
+            adf = f.read_columns('assets')
+        pandas.testing.assert_frame_equal(adf, df)
+        os.remove(fname)
+
+
+class BufferedWriterTestCase(unittest.TestCase):
+    def test(self):
+        arrays = [numpy.arange(i, i + 100, dtype=numpy.uint32)
+                  for i in range(0, 1000, 100)]
+        with File.temporary() as f:
+            for maxbytes in (0, 1000, 10_000):
+                key = 'data%d' % maxbytes
+                f.create_dataset(key, (0,), numpy.uint32, chunks=True,
+                                 maxshape=(None,))
+                writer = BufferedWriter(f, maxbytes)
+                for arr in arrays:
+                    writer.append(key, arr)
+                writer.close()
+                numpy.testing.assert_equal(f[key][:], numpy.arange(1000))
+            fname = f.path
+        os.remove(fname)
+
+    def test_error(self):
+        with File.temporary() as f:
+            writer = BufferedWriter(f, 1000)
+            writer.append('missing', numpy.zeros(1000))
+            with self.assertRaises(KeyError):
+                writer.close()
+            fname = f.path
+        os.remove(fname)
+
+    def test_abort(self):
+        with File.temporary() as f:
+            f.create_dataset('data', (0,), numpy.uint32, chunks=True,
+                             maxshape=(None,))
+            writer = BufferedWriter(f, 1000)
+            writer.append('data', numpy.arange(100, dtype=numpy.uint32))
+            writer.append('missing', numpy.zeros(10))
+            writer.abort()  # nothing is written and no error is raised
+            self.assertFalse(writer.thread.is_alive())
+            self.assertEqual(len(f['data']), 0)
+            fname = f.path
+        os.remove(fname)
@@ -65,6 +65,17 @@ def supertask(text, monitor):
             yield get_length, k * v
 
 
+def double(arr, monitor):
+    arr *= 2  # the shared memory is mapped copy-on-write
+    return {'arr': arr, 'sum': arr.sum()}
+
+
+def fail_on_o(text, monitor):
+    if 'o' in text:
+        raise ValueError(text)
+    return {'n': len(text)}
+
+
 def countletters(text1, text2, monitor):
     for block in general.block_splitter(text1 + text2, 5):
         yield get_length, ''.join(block)
@@ -144,8 +155,87 @@ class StarmapTestCase(unittest.TestCase):
             dic = dict(general.fast_agg3(info, 'taskname', ['received']))
             self.assertGreater(dic[b'get_length'], 0)
             self.assertGreater(dic[b'supertask'], 0)
+            if parallel.oq_distribute() != 'no':
+                # the bytes sent are stored per task and consolidated
+                # in task_sent at the end of the loop
+                self.assertTrue((info['sent'] > 0).all())
+                task_sent = eval(h5['task_sent'][()])
+                self.assertEqual(list(task_sent), ['supertask', 'get_length'])
+        shutil.rmtree(tmpdir)
+
+    def test_task_sent_on_error(self):
+        tmpdir = tempfile.mkdtemp()
+        tmp = os.path.join(tmpdir, 'calc_1.hdf5')
+        performance.init_performance(tmp)
+        smap = parallel.Starmap(fail_on_o, [('aaa',), ('ooo',)],
+                                h5=hdf5.File(tmp, 'a'))
+        with self.assertRaises(ValueError):
+            smap.reduce()
+        smap.h5.close()
+        if parallel.oq_distribute() != 'no':
+            # task_sent is saved even if a task failed
+            with hdf5.File(tmp, 'r') as h5:
+                task_sent = eval(h5['task_sent'][()])
+            self.assertEqual(list(task_sent), ['fail_on_o'])
         shutil.rmtree(tmpdir)
 
+    def test_weight_scheduler(self):
+        allargs = []
+        for n in (1, 5, 3, 7):
+            lst = parallel.List(range(n))
+            lst.weight = n
+            allargs.append((lst,))
+        with mock.patch.object(parallel.Starmap, 'scheduler', 'weight'):
+            smap = parallel.Starmap(get_length, allargs)
+            iresult = smap.submit_all()
+            weights = [parallel.get_weight(args)
+                       for _func, args in smap.task_queue]
+            self.assertEqual(weights, [7, 5, 3, 1])  # heavy tasks first
+            self.assertEqual(iresult.reduce(), {'n': 16})
+        if parallel.oq_distribute() != 'no':
+            self.assertEqual(len(smap.durations), 4)
+
+    @unittest.skipUnless(parallel.SHM_DIR, 'no /dev/shm')
+    def test_shared_memory_transport(self):
+        arrays = [numpy.arange(100_000, dtype=float) + i for i in range(3)]
+        before = set(os.listdir(parallel.SHM_DIR))
+        with mock.patch.dict(parallel.config.distribution,
+                             {'shm_min_mb': '0.1'}):
+            smap = parallel.Starmap(double, [(arr,) for arr in arrays])
+            res = sorted(smap, key=lambda dic: dic['sum'])
+        if parallel.oq_distribute() == 'processpool':
+            self.assertEqual(smap.monitor.shm_min, int(.1 * parallel.MB))
+        for i, dic in enumerate(res):
+            numpy.testing.assert_equal(dic['arr'], arrays[i] * 2)
+        # the original arrays are untouched
+        numpy.testing.assert_equal(arrays[0], numpy.arange(100_000))
+        # all the segments have been unlinked
+        self.assertEqual(set(os.listdir(parallel.SHM_DIR)), before)
+
+    @unittest.skipUnless(parallel.SHM_DIR, 'no /dev/shm')
+    def test_shm_never_unpickled(self):
+        arrays = [numpy.arange(100_000, dtype=float) + i for i in range(3)]
+        before = set(os.listdir(parallel.SHM_DIR))
+        with mock.patch.dict(parallel.config.distribution,
+                             {'shm_min_mb': '0.1'}):
+            smap = parallel.Starmap(double, [(arr,) for arr in arrays])
+            # consume the results without unpickling them
+            results = list(smap.submit_all().iresults)
+        self.assertEqual(len(results), 3)
+        # all the segments have been unlinked anyway
+        self.assertEqual(set(os.listdir(parallel.SHM_DIR)), before)
+
+    @unittest.skipUnless(parallel.SHM_DIR, 'no /dev/shm')
+    def test_shm_pickled(self):
+        arr = numpy.arange(1000, dtype=numpy.int32)
+        pik = parallel.Pickled({'arr': arr, 'x': 1}, shm_min=100)
+        self.assertEqual(len(pik.shm_names), 1)
+        self.assertLess(len(pik), arr.nbytes)
+        dic = pik.unpickle()
+        numpy.testing.assert_equal(dic['arr'], arr)
+        self.assertEqual(dic['x'], 1)
+        parallel.shm_unlink(pik.shm_names)
+
     def test_countletters(self):
         data = [('hello', 'world'), ('ciao', 'mondo')]
         smap = parallel.Starmap(countletters, data)
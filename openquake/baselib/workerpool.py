@@ -338,6 +338,9 @@ class WorkerPool(object):
                         ctrlsock.send("started %d" % self.job_id)
                     elif cmd == 'memory_gb':
                         ctrlsock.send(performance.memory_gb(pids))
+                    elif cmd == 'available_gb':
+                        avail = psutil.virtual_memory().available
+                        ctrlsock.send(avail / self.num_workers / 1024**3)
                     elif isinstance(cmd, tuple):
                         _func, _args, taskno, mon = cmd
                         self.pool.apply_async(
@@ -24,6 +24,7 @@ import pickle
 import psutil
 import logging
 import operator
+import collections
 import numpy
 import pandas
 from PIL import Image
@@ -36,6 +37,8 @@ from openquake.hazardlib.calc.hazard_curve import classical as hazclassical
 from openquake.hazardlib.calc import disagg
 from openquake.hazardlib.map_array import (
     RateMap, MapArray, rates_dt, check_hmaps)
+from openquake.hazardlib.source_reader import (
+    estimate_task_mb, get_max_task_mb)
 from openquake.commonlib import calc
 from openquake.calculators import base, getters, preclassical, views
 
@@ -45,6 +48,7 @@ U32 = numpy.uint32
 F32 = numpy.float32
 F64 = numpy.float64
 I64 = numpy.int64
+TWO20 = 2 ** 20
 TWO24 = 2 ** 24
 TWO30 = 2 ** 30
 TWO32 = 2 ** 32
@@ -53,6 +57,8 @@ BUFFER = 1.5  # enlarge the pointsource_distance sphere to fix the weight;
 # with BUFFER = 1 we would have lots of apparently light sources
 # collected together in an extra-slow task, as it happens in SHARE
 # with ps_grid_spacing=50
+task_mem_dt = numpy.dtype([('grp_id', U16), ('nsites', U32),
+                           ('predicted_mb', F32), ('actual_mb', F32)])
 
 
 def _store(rates, num_chunks, h5, mon=None, gzip=GZIP):
@@ -93,6 +99,72 @@ class Set(set):
     __iadd__ = set.__ior__
 
 
+class SourceGroupCache(object):
+    """
+    LRU cache of the source groups read from `_csm`, living in the
+    workers and keyed by (calc_id, grp_id, checksum). It avoids
+    decompressing and unpickling the same group again when a worker
+    receives another tile of it. The cache is bounded by `maxbytes`,
+    measured on the size of the uncompressed pickles.
+    """
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.dic = collections.OrderedDict()  # key -> (sources, nbytes)
+
+    def get(self, dstore, grp_id, monitor):
+        """
+        :param dstore: an open DataStore containing the `_csm`
+        :param grp_id: the index of the source group to read
+        :param monitor: used to store the cache hits and misses
+        :returns: the sources of the group
+        """
+        dset = dstore.getitem('_csm')
+        checksums = dset.attrs.get('checksums')
+        if checksums is None:  # datastore generated by an old engine
+            arr = dset[grp_id]
+            key = dstore.calc_id, grp_id, zlib.adler32(arr)
+        else:
+            arr = None
+            key = dstore.calc_id, grp_id, checksums[grp_id]
+        if key in self.dic:
+            with monitor('csm cache hits', measuremem=False):
+                self.dic.move_to_end(key)
+                return self.dic[key][0]
+        with monitor('csm cache misses', measuremem=True):
+            if arr is None:
+                arr = dset[grp_id]
+            data = zlib.decompress(arr.tobytes())
+            sources = pickle.loads(data)
+            self.add(key, sources, len(data))
+        return sources
+
+    def add(self, key, sources, nbytes):
+        """
+        Add the sources to the cache, discarding the least recently used
+        groups if the cache becomes too large
+        """
+        if nbytes > self.maxbytes:  # too large to cache
+            return
+        while self.dic and self.nbytes + nbytes > self.maxbytes:
+            _, (_, nb) = self.dic.popitem(last=False)
+            self.nbytes -= nb
+        self.dic[key] = sources, nbytes
+        self.nbytes += nbytes
+
+    def clear(self):
+        """
+        Empty the cache
+        """
+        self.dic.clear()
+        self.nbytes = 0
+
+
+# global in each worker process
+sg_cache = SourceGroupCache(
+    float(config.memory.get('csm_cache_mb', 1000)) * 1024**2)
+
+
 def get_heavy_gids(source_groups, cmakers):
     """
     :returns: the g-indices associated to the heavy groups
@@ -130,6 +202,16 @@ def store_ctxs(dstore, rupdata_list, grp_id):
                 hdf5.extend(dstore['rup/' + par], numpy.full(nr, numpy.nan))
 
 
+def get_task_mem(cmaker, nsites, nbytes):
+    """
+    :returns: an array with the predicted and actual memory of a tile
+    """
+    pred = estimate_task_mb(nsites, cmaker.imtls.size, len(cmaker.gsims),
+                            len(cmaker.imtls))
+    return numpy.array([(cmaker.grp_id, nsites, pred, nbytes / TWO20)],
+                       task_mem_dt)
+
+
 #  ########################### task functions ############################ #
     
 def save_rates(g, N, jid, num_chunks, mon):
@@ -155,8 +237,7 @@ def classical(sources, tilegetters, cmaker, dstore, monitor):
     cmaker.init_monitoring(monitor)
     with dstore:
         if sources is None:  # read the full group from the datastore
-            arr = dstore.getitem('_csm')[cmaker.grp_id]
-            sources = pickle.loads(zlib.decompress(arr.tobytes()))
+            sources = sg_cache.get(dstore, cmaker.grp_id, monitor)
         sitecol = dstore['sitecol'].complete  # super-fast
 
     if cmaker.disagg_by_src and not cmaker.atomic:
@@ -170,7 +251,10 @@ def classical(sources, tilegetters, cmaker, dstore, monitor):
         return
 
     for tileno, tileget in enumerate(tilegetters):
-        result = hazclassical(sources, tileget(sitecol), cmaker)
+        mem0 = monitor.measure_mem() or 0
+        sites = tileget(sitecol)
+        result = hazclassical(sources, sites, cmaker)
+        mem1 = monitor.measure_mem() or 0
         if tileno:
             # source_data has keys src_id, grp_id, nsites, esites, nrupts,
             # weight, ctimes, taskno
@@ -195,6 +279,9 @@ def classical(sources, tilegetters, cmaker, dstore, monitor):
         elif rmap.size_mb:
             result['rmap'] = rmap
             result['rmap'].gid = cmaker.gid
+        mem2 = monitor.measure_mem() or 0
+        result['task_mem'] = get_task_mem(
+            cmaker, len(sites), max(mem1, mem2) - mem0)
         yield result
 
 
@@ -204,16 +291,22 @@ def tiling(tilegetter, cmaker, dstore, monitor):
     """
     cmaker.init_monitoring(monitor)
     with dstore:
-        arr = dstore.getitem('_csm')[cmaker.grp_id]
-        sources = pickle.loads(zlib.decompress(arr.tobytes()))
+        sources = sg_cache.get(dstore, cmaker.grp_id, monitor)
         sitecol = dstore['sitecol'].complete  # super-fast
-    result = hazclassical(sources, tilegetter(sitecol), cmaker)
+    mem0 = monitor.measure_mem() or 0
+    sites = tilegetter(sitecol)
+    result = hazclassical(sources, sites, cmaker)
+    mem1 = monitor.measure_mem() or 0
     rmap = result.pop('rmap').remove_zeros()
     if config.directory.custom_tmp:
         rates = rmap.to_array(cmaker.gid)
         _store(rates, cmaker.num_chunks, None, monitor)
     else:
         result['rmap'] = rmap.to_array(cmaker.gid)
+    # the actual memory is used to calibrate the model in estimate_task_mb
+    mem2 = monitor.measure_mem() or 0
+    result['task_mem'] = get_task_mem(
+        cmaker, len(sites), max(mem1, mem2) - mem0)
     return result
 
 
@@ -412,6 +505,9 @@ class ClassicalCalculator(base.HazardCalculator):
             self.source_data += sdata
             self.rel_ruptures[grp_id] += sum(sdata['nrupts'])
         self.cfactor += dic.pop('cfactor')
+        task_mem = dic.pop('task_mem', None)
+        if task_mem is not None:
+            self.task_mem.append(task_mem)
 
         # store rup_data if there are few sites
         if self.few_sites and len(dic['rup_data']):
@@ -540,6 +636,7 @@ class ClassicalCalculator(base.HazardCalculator):
             raise InvalidFile('%(job_ini)s: you disabled all statistics',
                               oq.inputs)
         self.source_data = AccumDict(accum=[])
+        self.task_mem = []
         sgs, ds = self._pre_execute()
         if self.tiling:
             self._execute_tiling(sgs, ds)
@@ -562,6 +659,10 @@ class ClassicalCalculator(base.HazardCalculator):
         oq = self.oqparam
         sgs = self.datastore['source_groups']
         self.tiling = sgs.attrs['tiling']
+        # computed once, since it may require querying the workers
+        self.max_task_mb = get_max_task_mb()
+        logging.info('Maximum memory per task: %d MB', self.max_task_mb[0])
+        self.datastore.hdf5.attrs['max_task_mb'] = self.max_task_mb[0]
         if 'sitecol' in self.datastore.parent:
             ds = self.datastore.parent
         else:
@@ -582,7 +683,8 @@ class ClassicalCalculator(base.HazardCalculator):
         n_out = []
         splits = {}
         for cmaker, tilegetters, blocks, nsplits in self.csm.split(
-                self.cmakers, self.sitecol, self.max_weight, self.num_chunks):
+                self.cmakers, self.sitecol, self.max_weight, self.num_chunks,
+                max_task_mb=self.max_task_mb):
             for block in blocks:
                 for tgetters in block_splitter(tilegetters, nsplits):
                     allargs.append((block, tgetters, cmaker, ds))
@@ -613,7 +715,7 @@ class ClassicalCalculator(base.HazardCalculator):
         n_out = []
         for cmaker, tilegetters, blocks, splits in self.csm.split(
                 self.cmakers, self.sitecol, self.max_weight, self.num_chunks,
-                True):
+                True, self.max_task_mb):
             for block in blocks:
                 for tgetter in tilegetters:
                     allargs.append((tgetter, cmaker, ds))
@@ -696,6 +798,13 @@ class ClassicalCalculator(base.HazardCalculator):
         df['impact'] = df.nsites / self.N
         self.datastore.create_df('source_data', df)
         self.source_data.clear()  # save a bit of memory
+        if self.task_mem:
+            # predicted vs actual memory per tile, to calibrate the model
+            task_mem = numpy.concatenate(self.task_mem)
+            self.datastore['task_mem'] = task_mem
+            ratio = task_mem['actual_mb'] / task_mem['predicted_mb']
+            logging.info('Actual/predicted memory per tile: median=%.2f, '
+                         'max=%.2f', numpy.median(ratio), ratio.max())
 
     def collect_hazard(self, acc, pmap_by_kind):
         """
@@ -41,6 +41,8 @@ def classical_damage(riskinputs, param, monitor):
     crmodel = monitor.read('crmodel')
     L = crmodel.oqparam.L
     mon = monitor('getting hazard', measuremem=False)
+    hits = monitor('computing risk [PoE cache hits]', measuremem=False)
+    misses = monitor('computing risk [PoE cache misses]', measuremem=False)
     for ri in riskinputs:
         R = ri.hazard_getter.R
         D = len(crmodel.damage_states)
@@ -54,6 +56,10 @@ def classical_damage(riskinputs, param, monitor):
                 for li, lt in enumerate(crmodel.oqparam.loss_types):
                     for a, frac in zip(assets.ordinal, out[lt]):
                         result[a][rlz, li] += frac
+        # fragility evaluations saved by sharing the PoEs across sites
+        hits.counts += crmodel.ffcache.hits
+        misses.counts += crmodel.ffcache.misses
+        crmodel.ffcache.hits = crmodel.ffcache.misses = 0
         yield result
 
 
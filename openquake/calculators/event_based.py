@@ -33,18 +33,21 @@ from openquake.hazardlib.geo.packager import fiona
 from openquake.hazardlib.map_array import MapArray, get_mean_curve
 from openquake.hazardlib.stats import geom_avg_std, compute_stats
 from openquake.hazardlib.calc.stochastic import sample_ruptures
-from openquake.hazardlib.contexts import ContextMaker, FarAwayRupture
+from openquake.hazardlib.contexts import (
+    ContextMaker, FarAwayRupture, ms_cache)
 from openquake.hazardlib.calc.filters import (
     close_ruptures, magstr, nofilter, getdefault, get_distances, SourceFilter)
 from openquake.hazardlib.calc.gmf import GmfComputer
-from openquake.hazardlib.calc.conditioned_gmfs import ConditionedGmfComputer
+from openquake.hazardlib.calc.conditioned_gmfs import (
+    ConditionedGmfComputer, get_cholesky)
 from openquake.hazardlib.calc.stochastic import get_rup_array, rupture_dt
 from openquake.hazardlib.source.rupture import (
     RuptureProxy, EBRupture, get_ruptures_aw)
 from openquake.commonlib import util, logs, readinput, datastore
 from openquake.commonlib.calc import (
     gmvs_to_poes, make_hmaps, slice_dt, build_slice_by_event, RuptureImporter,
-    SLICE_BY_EVENT_NSITES, get_close_mosaic_models, get_proxies)
+    SLICE_BY_EVENT_NSITES, get_close_mosaic_models, get_proxies,
+    store_gmf_by_site)
 from openquake.risklib.riskinput import str2rsi, rsi2str
 from openquake.calculators import base, views
 from openquake.calculators.getters import sig_eps_dt
@@ -222,9 +225,9 @@ def _event_based(proxies, cmaker, stations, srcfilter, shr,
                 continue
         if stations and stations[0] is not None:  # conditioned GMFs
             assert cmaker.scenario
-            with shr['mea'] as mea, shr['tau'] as tau, shr['phi'] as phi:
+            with shr['mea'] as mea, shr['chol'] as chol:
                 df = computer.compute_all(
-                    [mea, tau, phi], max_iml, mmon, cmon, umon)
+                    [mea, chol], max_iml, mmon, cmon, umon)
         else:  # regular GMFs
             df = computer.compute_all(None, max_iml, mmon, cmon, umon)
             if oq.mea_tau_phi:
@@ -234,6 +237,8 @@ def _event_based(proxies, cmaker, stations, srcfilter, shr,
         dt = time.time() - t0
         times.append((proxy['id'], computer.ctx.rrup.min(), dt))
         alldata.append(df)
+    if cmaker.mean_std_cache:
+        ms_cache.flush()
     times = numpy.array([tup + (fmon.task_no,) for tup in times], rup_dt)
     times.sort(order='rup_id')
     if sum(len(df) for df in alldata) == 0:
@@ -262,6 +267,8 @@ def event_based(proxies, cmaker, sitecol, stations, dstore, monitor):
     cmon = monitor('computing gmfs', measuremem=False)
     umon = monitor('updating gmfs', measuremem=False)
     cmaker.scenario = 'scenario' in oq.calculation_mode
+    if cmaker.mean_std_cache:  # store the cache hits and misses
+        cmaker.init_monitoring(monitor)
     with dstore, rmon:
         srcfilter = SourceFilter(
             sitecol.complete, oq.maximum_distance(cmaker.trt))
@@ -399,6 +406,13 @@ def starmap_from_rups(func, oq, full_lt, sitecol, dstore, save_tmp=None):
                 f'The calculation is too large: {G=}, {M=}, {N=}. '
                 'You must reduce the number of sites i.e. maximum_distance')
         mea, tau, phi = computer.get_mea_tau_phi(dstore.hdf5)
+        if cmaker.truncation_level > 1E-9:
+            # factorize the covariances once instead of in each task
+            logging.info('Computing the Cholesky factors')
+            chol = get_cholesky(tau, phi, oq.correlation_cutoff)
+        else:  # the GMFs are just the means
+            chol = tau
+        del tau, phi
         del proxy.geom  # to reduce data transfer
 
     dstore.swmr_on()
@@ -421,7 +435,7 @@ def starmap_from_rups(func, oq, full_lt, sitecol, dstore, save_tmp=None):
             if parallel.oq_distribute() in ('zmq', 'slurm'):
                 logging.error('Conditioned scenarios are not meant to be run'
                               ' on a cluster')
-            smap.share(mea=mea, tau=tau, phi=phi)
+            smap.share(mea=mea, chol=chol)
         # producing slightly less than concurrent_tasks thanks to the 1.02
         for block in block_splitter(proxies, maxw * 1.02, rup_weight):
             args = block, cmaker, sitecol, (station_data, station_sites), dstore
@@ -641,34 +655,29 @@ class EventBasedCalculator(base.HazardCalculator):
         sav_mon = self.monitor('saving gmfs')
         primary = self.oqparam.get_primary_imtls()
         sec_imts = self.oqparam.sec_imts
+        append = self.gmf_writer.append
         with sav_mon:
-            gmfdata = result.pop('gmfdata')
+            gmfdata = result.pop('gmfdata')  # dictionary of arrays
             if len(gmfdata):
-                df = pandas.DataFrame(gmfdata)
-                dset = self.datastore['gmf_data/sid']
-                times = result.pop('times')
-                hdf5.extend(self.datastore['gmf_data/rup_info'], times)
+                eids = gmfdata['eid']
+                append('gmf_data/rup_info', result.pop('times'))
                 if self.N >= SLICE_BY_EVENT_NSITES:
-                    sbe = build_slice_by_event(
-                        df.eid.to_numpy(), self.offset)
-                    hdf5.extend(self.datastore['gmf_data/slice_by_event'], sbe)
-                hdf5.extend(dset, df.sid.to_numpy())
-                hdf5.extend(self.datastore['gmf_data/eid'], df.eid.to_numpy())
+                    sbe = build_slice_by_event(eids, self.offset)
+                    append('gmf_data/slice_by_event', sbe)
+                append('gmf_data/sid', gmfdata['sid'])
+                append('gmf_data/eid', eids)
                 for imt in primary:
-                    hdf5.extend(self.datastore[f'gmf_data/{imt}'],
-                                df[imt].to_numpy())
+                    append(f'gmf_data/{imt}', gmfdata[imt])
                 for sec_imt in sec_imts:
-                    hdf5.extend(self.datastore[f'gmf_data/{sec_imt}'],
-                                df[sec_imt].to_numpy())
-                sig_eps = result.pop('sig_eps')
-                hdf5.extend(self.datastore['gmf_data/sigma_epsilon'], sig_eps)
-                self.offset += len(df)
+                    append(f'gmf_data/{sec_imt}', gmfdata[sec_imt])
+                append('gmf_data/sigma_epsilon', result.pop('sig_eps'))
+                self.offset += len(eids)
 
             # optionally save mea_tau_phi
             mtp = result.pop('mea_tau_phi', None)
             if mtp:
                 for col, arr in mtp.items():
-                    hdf5.extend(self.datastore[f'mea_tau_phi/{col}'], arr)
+                    append(f'mea_tau_phi/{col}', arr)
         return acc
 
     def _read_scenario_ruptures(self):
@@ -792,7 +801,17 @@ class EventBasedCalculator(base.HazardCalculator):
         else:
             smap = starmap_from_rups(
                 event_based, oq, self.full_lt, self.sitecol, dstore)
-        acc = smap.reduce(self.agg_dicts)
+        # the GMFs are written in large chunks by a background thread
+        maxbytes = int(float(config.memory.gmf_buffer_mb) * 1024 ** 2)
+        self.gmf_writer = hdf5.BufferedWriter(
+            dstore.hdf5, maxbytes, self.monitor('writing gmfs'))
+        try:
+            acc = smap.reduce(self.agg_dicts)
+        except BaseException:
+            # do not write the buffered GMFs, reraise the original error
+            self.gmf_writer.abort()
+            raise
+        self.gmf_writer.close()
         if 'gmf_data' not in dstore:
             return acc
         if oq.ground_motion_fields:
@@ -860,6 +879,11 @@ class EventBasedCalculator(base.HazardCalculator):
             logging.info('Checking stored GMFs')
             msg = views.view('extreme_gmvs', self.datastore)
             logging.info(msg)
+        if oq.gmf_by_site and 'gmf_data' in self.datastore.hdf5:
+            logging.info('Storing the GMFs sorted by site')
+            with self.monitor('storing gmf_by_site', measuremem=True):
+                store_gmf_by_site(self.datastore.hdf5,
+                                  int(config.memory.gmf_data_rows))
         if self.datastore.parent:
             self.datastore.parent.open('r')
         if oq.hazard_curves_from_gmfs:
@@ -80,15 +80,19 @@ def event_based_damage(df, oq, dstore, monitor):
             dstore = datastore.read(oq.hdf5path, parentdir=oq.parentdir)
         else:
             dstore.open('r')
-        assetcol = dstore['assetcol']
         crmodel = monitor.read('crmodel')
         aggids = monitor.read('aggids')
-    dmgcsq = zero_dmgcsq(len(assetcol), oq.R, oq.L, crmodel)
+    with monitor('reading assets'):
+        # memory-mapped columns, only the assets on the GMF sites are read
+        assets = monitor.read('assets', index='ordinal')
+        num_assets = len(assets)
+        assets = assets[assets.site_id.isin(df.sid.unique())]
+    dmgcsq = zero_dmgcsq(num_assets, oq.R, oq.L, crmodel)
     P, _A, R, L, Dc = dmgcsq.shape
     D = len(crmodel.damage_states)
     rlzs = dstore['events']['rlz_id']
     dddict = general.AccumDict(accum=numpy.zeros((L, Dc), F32))  # eid, kid
-    for sid, asset_df in assetcol.to_dframe().groupby('site_id'):
+    for sid, asset_df in assets.groupby('site_id'):
         # working one site at the time
         gmf_df = df[df.sid == sid]
         if len(gmf_df) == 0:
@@ -97,7 +101,8 @@ def event_based_damage(df, oq, dstore, monitor):
         E = len(eids)
         if not oq.float_dmg_dist:
             rng = scientific.MultiEventRNG(
-                oq.master_seed, numpy.unique(eids))
+                oq.master_seed, numpy.unique(eids),
+                counter_based=oq.counter_based_rng)
         else:
             rng = None
         for taxo, adf in asset_df.groupby('taxonomy'):
@@ -187,7 +192,9 @@ class DamageCalculator(EventBasedRiskCalculator):
         smap = calc.starmap_from_gmfs(
             damage_from_gmfs, oq, self.datastore, self._monitor)
         smap.monitor.save('aggids', aggids)
-        smap.monitor.save('assets', self.assetcol.to_dframe('id'))
+        adf = self.assetcol.to_dframe()
+        del adf['id']
+        smap.monitor.save('assets', adf)
         smap.monitor.save('crmodel', self.crmodel)
         return smap.reduce(self.combine)
 
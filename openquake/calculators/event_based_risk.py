@@ -45,19 +45,51 @@ TWO32 = U64(2 ** 32)
 get_n_occ = operator.itemgetter(1)
 
 
-def fast_agg(keys, values, correl, li, acc):
+def check_keys(K, L):
     """
-    :param keys: an array of N uint64 numbers encoding (event_id, agg_id)
+    Make sure that the keys eid * 2**32 + kid * L + li used to aggregate
+    the losses do not overflow, being kid <= K and li < L
+    """
+    if (K + 1) * L > TWO32:
+        raise ValueError(
+            'There are too many aggregation keys: (K+1)*L = %d * %d > 2**32, '
+            'please reduce the aggregate_by tags' % (K + 1, L))
+
+
+def fast_agg(keys, values, correl, acc):
+    """
+    :param keys: an array of N uint64 numbers encoding (event_id, agg_id, li)
     :param values: an array of (N, D) floats
     :param correl: True if there is asset correlation
-    :param li: loss type index
-    :param acc: dictionary unique key -> array(L, D)
+    :param acc: dictionary with keys 'keys' and 'values' -> list of arrays
     """
     ukeys, avalues = general.fast_agg2(keys, values)
     if correl:  # restore the variances
         avalues[:, 0] = avalues[:, 0] ** 2
-    for ukey, avalue in zip(ukeys, avalues):
-        acc[ukey][li] += avalue
+    acc['keys'].append(ukeys)
+    acc['values'].append(avalues)
+
+
+def build_alt(acc, xtypes):
+    """
+    :param acc: dictionary with keys 'keys' and 'values' -> list of arrays
+    :param xtypes: the extended loss types
+    :returns: a DataFrame event_id, agg_id, loss_id, variance, loss
+    """
+    if not acc['keys']:
+        return pandas.DataFrame({})
+    L = U64(len(xtypes))
+    # a single sort-based reduce over all the keys of the task
+    ukeys, avalues = general.fast_agg2(
+        numpy.concatenate(acc['keys']), numpy.concatenate(acc['values']))
+    ok = avalues.any(axis=1)
+    eids, kli = numpy.divmod(ukeys[ok], TWO32)
+    kids, lis = numpy.divmod(kli, L)
+    lossids = numpy.array([LOSSID[xt] for xt in xtypes])
+    dic = dict(event_id=eids, agg_id=kids, loss_id=lossids[lis],
+               variance=avalues[ok, 0], loss=avalues[ok, 1])
+    fix_dtypes(dic)
+    return pandas.DataFrame(dic)
 
 
 def average_losses(ln, alt, rlz_id, AR, collect_rlzs):
@@ -96,7 +128,7 @@ def aggreg(outputs, crmodel, ARK, aggids, rlz_id, ideduc, monitor):
     """
     :returns: (avg_losses, agg_loss_table)
     """
-    mon_agg = monitor('aggregating losses', measuremem=False)
+    mon_agg = monitor('aggregating losses', measuremem=True)
     mon_avg = monitor('averaging losses', measuremem=False)
     oq = crmodel.oqparam
     xtypes = oq.ext_loss_types
@@ -105,7 +137,8 @@ def aggreg(outputs, crmodel, ARK, aggids, rlz_id, ideduc, monitor):
     loss_by_AR = {ln: [] for ln in xtypes}
     correl = int(oq.asset_correlation)
     (A, R, K), L = ARK, len(xtypes)
-    acc = general.AccumDict(accum=numpy.zeros((L, 2)))  # u8idx->array
+    check_keys(K, L)
+    acc = {'keys': [], 'values': []}  # columnar accumulator
     value_cols = ['variance', 'loss']
     for out in outputs:
         for li, ln in enumerate(xtypes):
@@ -123,26 +156,16 @@ def aggreg(outputs, crmodel, ARK, aggids, rlz_id, ideduc, monitor):
                 eids = alt.eid.to_numpy() * TWO32  # U64
                 values = numpy.array([alt[col] for col in value_cols]).T
                 # aggregate all assets
-                fast_agg(eids + U64(K), values, correl, li, acc)
+                fast_agg(eids + U64(K * L + li), values, correl, acc)
                 if len(aggids):
                     # aggregate assets for each tag combination
                     aids = alt.aid.to_numpy()
                     for kids in aggids[:, aids]:
-                        fast_agg(eids + U64(kids), values, correl, li, acc)
-    lis = range(len(xtypes))
+                        fast_agg(eids + U64(kids) * U64(L) + U64(li),
+                                 values, correl, acc)
     with monitor('building event loss table', measuremem=True):
-        dic = general.AccumDict(accum=[])
-        for ukey, arr in acc.items():
-            eid, kid = divmod(ukey, TWO32)
-            for li in lis:
-                if arr[li].any():
-                    dic['event_id'].append(eid)
-                    dic['agg_id'].append(kid)
-                    dic['loss_id'].append(LOSSID[xtypes[li]])
-                    for c, col in enumerate(['variance', 'loss']):
-                        dic[col].append(arr[li, c])
-        fix_dtypes(dic)
-    return loss_by_AR, pandas.DataFrame(dic)
+        df = build_alt(acc, xtypes)
+    return loss_by_AR, df
 
 
 def ebr_from_gmfs(sbe, oqparam, dstore, monitor):
@@ -208,7 +231,8 @@ def event_based_risk(df, oqparam, monitor):
         rng = None
     else:
         rng = MultiEventRNG(oqparam.master_seed, df.eid.unique(),
-                            int(oqparam.asset_correlation))
+                            int(oqparam.asset_correlation),
+                            oqparam.counter_based_rng)
 
     outs = gen_outputs(df, crmodel, rng, monitor)
     avg, alt = aggreg(outs, crmodel, ARK, aggids, rlz_id, ideduc.any(),
@@ -216,6 +240,41 @@ def event_based_risk(df, oqparam, monitor):
     return dict(avg=avg, alt=alt, gmf_bytes=df.memory_usage().sum())
 
 
+class SiteIndex(object):
+    """
+    CSR-style index of the rows of a GMF DataFrame, sorted by site ID,
+    used to extract the rows associated to a set of sites with contiguous
+    slices instead of scanning the full array every time.
+
+    >>> idx = SiteIndex(numpy.array([3, 1, 3, 2, 1, 3]))
+    >>> idx.get_rows([3, 1, 5])
+    array([0, 1, 2, 4, 5])
+    """
+    def __init__(self, sids):
+        self.order = numpy.argsort(sids, kind='stable')
+        self.usids, self.start = numpy.unique(
+            sids[self.order], return_index=True)
+        self.stop = numpy.append(self.start[1:], len(sids))
+
+    def get_rows(self, site_ids):
+        """
+        :param site_ids: an array of distinct site IDs
+        :returns: the sorted indices of the rows associated to the sites
+        """
+        site_ids = numpy.asarray(site_ids)
+        idx = numpy.searchsorted(self.usids, site_ids)
+        ok = idx < len(self.usids)
+        ok[ok] = self.usids[idx[ok]] == site_ids[ok]  # discard missing sites
+        idx = idx[ok]
+        start, stop = self.start[idx], self.stop[idx]
+        lens = stop - start
+        # build the concatenation of the ranges start[i]:stop[i]
+        offsets = numpy.repeat(start - numpy.cumsum(lens) + lens, lens)
+        rows = self.order[offsets + numpy.arange(lens.sum())]
+        rows.sort()  # keep the original order of the GMF rows
+        return rows
+
+
 def gen_outputs(df, crmodel, rng, monitor):
     """
     :param df: GMF dataframe (a slice of events)
@@ -227,10 +286,11 @@ def gen_outputs(df, crmodel, rng, monitor):
     mon_risk = monitor('computing risk', measuremem=False)
     fil_mon = monitor('filtering GMFs', measuremem=False)
     ass_mon = monitor('reading assets', measuremem=False)
-    sids = df.sid.to_numpy()
+    with fil_mon:
+        sidx = SiteIndex(df.sid.to_numpy())
     for s0, s1 in monitor.read('start-stop'):
         with ass_mon:
-            assets = monitor.read('assets', slice(s0, s1)).set_index('ordinal')
+            assets = monitor.read('assets', slice(s0, s1), index='ordinal')
         if 'ID_0' not in assets.columns:
             assets['ID_0'] = 0
         for (id0, taxo), adf in assets.groupby(['ID_0', 'taxonomy']):
@@ -238,7 +298,7 @@ def gen_outputs(df, crmodel, rng, monitor):
             country = crmodel.countries[id0]
             with fil_mon:
                 # *crucial* for the performance of the next step
-                gmf_df = df[numpy.isin(sids, adf.site_id.unique())]
+                gmf_df = df.iloc[sidx.get_rows(adf.site_id.unique())]
             if len(gmf_df) == 0:  # common enough
                 continue
             with mon_risk:
@@ -405,6 +465,7 @@ class EventBasedRiskCalculator(event_based.EventBasedCalculator):
         self.xtypes = oq.ext_loss_types
         if self.assetcol['ideductible'].any():
             self.xtypes.append('claim')
+        check_keys(oq.K, len(self.xtypes))
 
         if oq.avg_losses:
             self.create_avg_losses()
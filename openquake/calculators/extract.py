@@ -1094,8 +1094,22 @@ def extract_gmf_scenario(dstore, what):
 # used by the QGIS plugin for a single eid
 @extract.add('gmf_data')
 def extract_gmf_npz(dstore, what):
-    oq = dstore['oqparam']
+    """
+    Extract the GMFs of a single event, or the GMFs of all the events
+    for the given sites as a DataFrame. Use it as /extract/gmf_data?event_id=0
+    or /extract/gmf_data?site_id=0&site_id=1
+    """
     qdict = parse(what)
+    if 'site_id' in qdict:
+        imt_list = dstore['gmf_data'].attrs['imts'].split()
+        rename_dic = {f'gmv_{i}': imt for i, imt in enumerate(imt_list)}
+        df = calc.read_gmf_by_site(dstore, qdict['site_id'])
+        return df.rename(columns=rename_dic).reset_index(drop=True)
+    return _gmf_by_event(dstore, qdict)
+
+
+def _gmf_by_event(dstore, qdict):
+    oq = dstore['oqparam']
     [eid] = qdict.get('event_id', [0])  # there must be a single event
     rlzi = dstore['events'][eid]['rlz_id']
     try:
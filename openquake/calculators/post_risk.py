@@ -23,7 +23,7 @@ import itertools
 import numpy
 import pandas
 
-from openquake.baselib import general, parallel, python3compat
+from openquake.baselib import general, hdf5, parallel, python3compat
 from openquake.hazardlib.stats import weighted_quantiles
 from openquake.risklib import asset, scientific, reinsurance
 from openquake.commonlib import datastore, logs
@@ -274,18 +274,23 @@ def get_loss_id(ext_loss_types):
     return scientific.LOSSID[ext_loss_types[0]]
 
 
-# launch Starmap building the aggcurves and store them
-def store_aggcurves(oq, agg_ids, rbe_df, builder, loss_cols,
-                    events, num_events, dstore):
-    aggtypes = oq.aggregate_loss_curves_types
-    logging.info('Building aggcurves')
-    units = dstore['exposure'].cost_calculator.get_units(oq.loss_types)
+def get_year(events):
+    """
+    :returns: the year of each event or () if there is a single year
+    """
     try:
         year = events['year']
         if len(numpy.unique(year)) == 1:  # there is a single year
             year = ()
     except ValueError:  # missing in case of GMFs from CSV
         year = ()
+    return year
+
+
+def get_aggcurves_items(agg_ids, rbe_df, loss_cols, year):
+    """
+    :returns: a list of pairs ((agg_id, rlz_id, loss_id), losses)
+    """
     items = []
     for agg_id in agg_ids:
         gb = rbe_df[rbe_df.agg_id == agg_id].groupby(['rlz_id', 'loss_id'])
@@ -294,29 +299,52 @@ def store_aggcurves(oq, agg_ids, rbe_df, builder, loss_cols,
             if len(year):
                 data['year'] = year[df.event_id.to_numpy()]
             items.append([(agg_id, rlz_id, loss_id), data])
+    return items
+
+
+def aggcurves_attrs(oq, dstore):
+    """
+    :returns: the attributes of the aggcurves dataset
+    """
+    suffix = {'ep': '', 'aep': '_aep', 'oep': '_oep'}
+    ep_fields = ['loss' + suffix[a]
+                 for a in oq.aggregate_loss_curves_types.split(', ')]
+    units = dstore['exposure'].cost_calculator.get_units(oq.loss_types)
+    return dict(limit_states=' '.join(oq.limit_states),
+                units=units, ep_fields=ep_fields)
+
+
+# launch Starmap building the aggcurves and store them
+def store_aggcurves(oq, agg_ids, rbe_df, builder, loss_cols,
+                    events, num_events, dstore):
+    aggtypes = oq.aggregate_loss_curves_types
+    logging.info('Building aggcurves')
+    items = get_aggcurves_items(agg_ids, rbe_df, loss_cols, get_year(events))
     dstore.swmr_on()
     dic = parallel.Starmap.apply(
         build_aggcurves, (items, builder, num_events, aggtypes),
         concurrent_tasks=oq.concurrent_tasks,
         h5=dstore.hdf5).reduce()
     fix_dtypes(dic)
-    suffix = {'ep': '', 'aep': '_aep', 'oep': '_oep'}
-    ep_fields = ['loss' + suffix[a] for a in aggtypes.split(', ')]
     dstore.create_df('aggcurves', pandas.DataFrame(dic),
-                     limit_states=' '.join(oq.limit_states),
-                     units=units, ep_fields=ep_fields)
+                     **aggcurves_attrs(oq, dstore))
 
 
-def compute_aggrisk(dstore, oq, rbe_df, num_events, agg_ids):
+def get_time_ratio(oq, weights):
     """
-    Compute the aggrisk DataFrame with columns agg_id, rlz_id, loss_id, loss
+    :returns: the factor to convert the sum of the losses into average
+              losses per unit of risk investigation time
+    """
+    tr = oq.time_ratio  # (risk_invtime / haz_invtime) * num_ses
+    if oq.collect_rlzs:  # reduce the time ratio by the number of rlzs
+        tr /= len(weights)
+    return tr
+
+
+def get_columns_builder(dstore, oq, rbe_df, num_events):
+    """
+    :returns: the loss columns of rbe_df and the associated loss builder
     """
-    L = len(oq.loss_types)
-    weights = dstore['weights'][:]
-    if oq.investigation_time:  # event based
-        tr = oq.time_ratio  # (risk_invtime / haz_invtime) * num_ses
-        if oq.collect_rlzs:  # reduce the time ratio by the number of rlzs
-            tr /= len(weights)
     columns = [col for col in rbe_df.columns if col not in {
         'event_id', 'agg_id', 'rlz_id', 'loss_id', 'variance'}]
     if oq.investigation_time is None or all(
@@ -324,6 +352,18 @@ def compute_aggrisk(dstore, oq, rbe_df, num_events, agg_ids):
         builder = FakeBuilder()
     else:
         builder = get_loss_builder(dstore, oq, num_events=num_events)
+    return columns, builder
+
+
+def compute_aggrisk(dstore, oq, rbe_df, num_events, agg_ids):
+    """
+    Compute the aggrisk DataFrame with columns agg_id, rlz_id, loss_id, loss
+    """
+    L = len(oq.loss_types)
+    weights = dstore['weights'][:]
+    if oq.investigation_time:  # event based
+        tr = get_time_ratio(oq, weights)
+    columns, builder = get_columns_builder(dstore, oq, rbe_df, num_events)
     dmgs = [col for col in columns if col.startswith('dmg_')]
     if dmgs:
         aggnumber = dstore['agg_values']['number']
@@ -372,6 +412,25 @@ def compute_aggrisk(dstore, oq, rbe_df, num_events, agg_ids):
     return aggrisk, aggrisk_quantiles, columns, builder
 
     
+def get_loss_by_event(rbe_df, columns, K, T, rup_id):
+    """
+    :returns: the DataFrames loss_by_event and loss_by_rupture for the
+              total aggregation and the total loss type, or ()
+    """
+    if 'loss' not in columns and 'losses' not in columns:
+        return ()
+    df = rbe_df[(rbe_df.agg_id == K) & (rbe_df.loss_id == T)].copy()
+    if len(df) == 0:
+        return ()
+    df['rup_id'] = rup_id[df.event_id.to_numpy()]
+    if 'losses' in columns:  # for consequences
+        df['loss'] = df['losses']
+    lbe_df = df[['event_id', 'loss']].sort_values('loss',  ascending=False)
+    gb = df[['rup_id', 'loss']].groupby('rup_id')
+    rbr_df = gb.sum().sort_values('loss', ascending=False)
+    return lbe_df, rbr_df.reset_index()
+
+
 # aggcurves are built in parallel, aggrisk sequentially
 def build_store_agg(dstore, oq, rbe_df, num_events):
     """
@@ -401,26 +460,311 @@ def build_store_agg(dstore, oq, rbe_df, num_events):
     if len(aggrisk_quantiles):
         dstore.create_df('aggrisk_quantiles', aggrisk_quantiles)
     loss_cols = [col for col in columns if not col.startswith('dmg_')]
-    for agg_id in agg_ids:
+    if rups:
         # build loss_by_event and loss_by_rupture
-        if agg_id == K and ('loss' in columns or 'losses' in columns) and rups:
-            df = rbe_df[(rbe_df.agg_id == K) & (rbe_df.loss_id == T)].copy()
-            if len(df):
-                df['rup_id'] = rup_id[df.event_id.to_numpy()]
-                if 'losses' in columns:  # for consequences
-                    df['loss'] = df['losses']
-                lbe_df = df[['event_id', 'loss']].sort_values(
-                    'loss',  ascending=False)
-                gb = df[['rup_id', 'loss']].groupby('rup_id')
-                rbr_df = gb.sum().sort_values('loss', ascending=False)
-                dstore.create_df('loss_by_rupture', rbr_df.reset_index())
-                dstore.create_df('loss_by_event', lbe_df)
+        dfs = get_loss_by_event(rbe_df, columns, K, T, rup_id)
+        if dfs:
+            dstore.create_df('loss_by_rupture', dfs[1])
+            dstore.create_df('loss_by_event', dfs[0])
     if oq.investigation_time and loss_cols:
         store_aggcurves(oq, agg_ids, rbe_df, builder, loss_cols, events,
                         num_events, dstore)
     return aggrisk
 
 
+def read_rbe(dstore, agg_ids, idxs=None, slc=None, blocksize=10_000_000):
+    """
+    Read the rows of risk_by_event associated to the given agg_ids
+    block by block, so that the full table is never in memory
+
+    :param dstore: a DataStore instance
+    :param agg_ids: a boolean array with the agg_ids to keep
+    :param idxs: if not None, an array used to reaggregate the agg_ids
+    :param slc: the slice of rows to read (the default is all the rows)
+    :param blocksize: the number of rows to read for each block
+    :returns: a DataFrame with the selected rows
+    """
+    if slc is None:
+        slc = slice(0, len(dstore['risk_by_event/event_id']))
+    dfs = []
+    for block in general.gen_slices(slc.start, slc.stop, blocksize):
+        df = dstore.read_df('risk_by_event', slc=block)
+        if idxs is not None:
+            df['agg_id'] = idxs[df['agg_id'].to_numpy()]
+        dfs.append(df[agg_ids[df.agg_id.to_numpy()]])
+    rbe_df = pandas.concat(dfs, ignore_index=True)
+    if idxs is not None:
+        rbe_df = rbe_df.groupby(
+            ['event_id', 'loss_id', 'agg_id']).sum().reset_index()
+    return rbe_df
+
+
+def add_rlz_id(rbe_df, events, num_events):
+    """
+    Add a column rlz_id to the risk_by_event DataFrame
+    """
+    if len(num_events) > 1:
+        rbe_df['rlz_id'] = events['rlz_id'][rbe_df.event_id.to_numpy()]
+    else:
+        rbe_df['rlz_id'] = 0
+
+
+def aggrisk_by_partition(dstore, oq, agg_ids, num_events, K, idxs,
+                         monitor):
+    """
+    Compute aggrisk, aggcurves, loss_by_event and loss_by_rupture for
+    a partition of the agg_ids, by reading the associated rows of
+    risk_by_event
+
+    :returns: a dictionary name -> DataFrame
+    """
+    with dstore:
+        with monitor('reading risk_by_event', measuremem=True):
+            rbe_df = read_rbe(dstore, agg_ids, idxs)
+        events = dstore['events'][:]
+        add_rlz_id(rbe_df, events, num_events)
+        agg_ids = rbe_df.agg_id.unique()
+        with monitor('computing aggrisk', measuremem=True):
+            aggrisk, aggrisk_quantiles, columns, builder = compute_aggrisk(
+                dstore, oq, rbe_df, num_events, agg_ids)
+        out = dict(aggrisk=aggrisk, aggrisk_quantiles=aggrisk_quantiles)
+        loss_cols = [col for col in columns if not col.startswith('dmg_')]
+        if K in agg_ids and len(dstore['ruptures']):
+            dfs = get_loss_by_event(
+                rbe_df, columns, K, scientific.LOSSID[
+                    oq.total_losses or 'structural'], events['rup_id'])
+            if dfs:
+                out['loss_by_event'], out['loss_by_rupture'] = dfs
+        if oq.investigation_time and loss_cols:
+            items = get_aggcurves_items(
+                agg_ids, rbe_df, loss_cols, get_year(events))
+            dic = build_aggcurves(items, builder, num_events,
+                                  oq.aggregate_loss_curves_types, monitor)
+            fix_dtypes(dic)
+            out['aggcurves'] = pandas.DataFrame(dic)
+    return out
+
+
+def get_num_top(builder):
+    """
+    :returns: the number of largest losses needed to build the loss curves
+              for the return periods of the builder, or 0 if all are needed
+    """
+    rp0 = min(builder.return_periods)
+    if rp0 <= 0:
+        return 0
+    # 2 more losses for the interpolation on the left of rp0
+    return int(numpy.ceil(builder.eff_time / rp0)) + 2
+
+
+def total_by_events(dstore, oq, slc, num_events, K, idxs, monitor):
+    """
+    Compute the partial results of the total aggregation (agg_id=K) for
+    the events in a slice of risk_by_event; since each event appears only
+    once in the total aggregation, the partial results for different slices
+    refer to different events and can be combined by :func:`combine_total`
+
+    :returns: a dictionary with the partial sums, the largest losses, the
+              losses by year and the rows needed for loss_by_event
+    """
+    agg_ids = numpy.zeros(K + 1, bool)
+    agg_ids[K] = True
+    with dstore:
+        with monitor('reading risk_by_event', measuremem=True):
+            rbe_df = read_rbe(dstore, agg_ids, idxs, slc)
+        events = dstore['events'][:]
+        add_rlz_id(rbe_df, events, num_events)
+        columns, builder = get_columns_builder(
+            dstore, oq, rbe_df, num_events)
+        out = dict(sums=rbe_df.groupby(['rlz_id', 'loss_id'])[columns].sum())
+        if 'loss' in columns or 'losses' in columns:
+            T = scientific.LOSSID[oq.total_losses or 'structural']
+            out['lbe'] = rbe_df[rbe_df.loss_id == T]
+        loss_cols = [col for col in columns if not col.startswith('dmg_')]
+        if not (oq.investigation_time and loss_cols):
+            return out
+        with monitor('selecting the largest losses', measuremem=True):
+            ntop = get_num_top(builder)
+            year = get_year(events)
+            tops, years = {}, {}
+            gb = rbe_df.groupby(['rlz_id', 'loss_id'])
+            for (rlz_id, loss_id), df in gb:
+                for col in loss_cols:
+                    losses = df[col].to_numpy()
+                    tops[rlz_id, loss_id, col] = numpy.sort(losses)[-ntop:]
+                    if len(year):
+                        ys = pandas.Series(losses).groupby(
+                            year[df.event_id.to_numpy()])
+                        years[rlz_id, loss_id, col] = ys.sum(), ys.max()
+        out['tops'] = tops
+        out['years'] = years
+    return out
+
+
+def combine_total(dstore, oq, partials, num_events, K):
+    """
+    Combine the partial results returned by :func:`total_by_events`
+
+    :returns: a dictionary name -> DataFrame
+    """
+    L = len(oq.loss_types)
+    weights = dstore['weights'][:]
+    sums = pandas.concat([p['sums'] for p in partials])
+    sums = sums.groupby(level=[0, 1]).sum().sort_index()
+    columns = list(sums.columns)
+    dmgs = [col for col in columns if col.startswith('dmg_')]
+    if dmgs:
+        aggnumber = dstore['agg_values']['number']
+    if oq.investigation_time:
+        tr = get_time_ratio(oq, weights)
+    acc = general.AccumDict(accum=[])
+    for (rlz_id, loss_id), row in sums.iterrows():
+        ne = num_events[rlz_id]
+        acc['agg_id'].append(K)
+        acc['rlz_id'].append(rlz_id)
+        acc['loss_id'].append(loss_id)
+        if dmgs:
+            # infer the number of buildings in nodamage state
+            dmg0 = aggnumber[K] - row[dmgs].sum() / (ne * L)
+            assert dmg0 >= 0, dmg0
+            acc['dmg_0'].append(dmg0)
+        for col in columns:
+            agg = row[col]
+            acc[col].append(agg * tr if oq.investigation_time else agg/ne)
+    fix_dtypes(acc)
+    out = dict(aggrisk=pandas.DataFrame(acc))
+
+    events = dstore['events'][:]
+    lbes = [p['lbe'] for p in partials if 'lbe' in p]
+    if lbes and len(dstore['ruptures']):
+        dfs = get_loss_by_event(
+            pandas.concat(lbes), columns, K,
+            scientific.LOSSID[oq.total_losses or 'structural'],
+            events['rup_id'])
+        if dfs:
+            out['loss_by_event'], out['loss_by_rupture'] = dfs
+
+    tops = general.AccumDict(accum=[])
+    years = general.AccumDict(accum=[])
+    for p in partials:
+        for key, top in p.get('tops', {}).items():
+            tops[key].append(top)
+        for key, pair in p.get('years', {}).items():
+            years[key].append(pair)
+    if not tops:
+        return out
+    builder = get_loss_builder(dstore, oq, num_events=num_events)
+    ntop = get_num_top(builder)
+    aggtypes = oq.aggregate_loss_curves_types.split(', ')
+    dic = general.AccumDict(accum=[])
+    for rlz_id, loss_id in sums.index:
+        ne = num_events[rlz_id]
+        curve = {}
+        for col in columns:
+            if (rlz_id, loss_id, col) not in tops:
+                continue
+            # same names as in LossCurvesMapsBuilder.build_curve
+            name = 'loss' if col == 'losses' else col
+            losses = numpy.sort(numpy.concatenate(
+                tops[rlz_id, loss_id, col]))[-ntop:]
+            curve[col] = {}
+            if 'ep' in aggtypes:
+                curve[col].update(scientific.losses_by_period(
+                    losses, builder.return_periods, ne, builder.eff_time,
+                    name=name, pla_factor=builder.pla_factor))
+            # combine the losses by year of the different events
+            pairs = years.get((rlz_id, loss_id, col), [])
+            for i, (agg, typ) in enumerate([('sum', 'aep'), ('max', 'oep')]):
+                if pairs and typ in aggtypes:
+                    ys = pandas.concat([pair[i] for pair in pairs])
+                    curve[col].update(scientific.losses_by_period(
+                        getattr(ys.groupby(level=0), agg)(),
+                        builder.return_periods, ne, builder.eff_time,
+                        name=name + '_' + typ, pla_factor=builder.pla_factor))
+        for p, period in enumerate(builder.return_periods):
+            dic['agg_id'].append(K)
+            dic['rlz_id'].append(rlz_id)
+            dic['loss_id'].append(loss_id)
+            dic['return_period'].append(period)
+            for col in curve:
+                for k, c in curve[col].items():
+                    dic[k].append(c[p])
+    fix_dtypes(dic)
+    out['aggcurves'] = pandas.DataFrame(dic)
+    return out
+
+
+def extend_df(dstore, key, df, **attrs):
+    """
+    Create the datagroup `key` the first time, then extend it
+    """
+    if key not in dstore.hdf5:
+        dstore.create_df(key, df, **attrs)
+    else:
+        for col in df.columns:
+            hdf5.extend(dstore.hdf5[f'{key}/{col}'], df[col].to_numpy())
+
+
+# the agg_ids < K are split in partitions processed in parallel, while
+# the total aggregation is split by events and the partial results combined
+def build_store_agg_streaming(dstore, oq, num_events, K, idxs=None):
+    """
+    Build the aggrisk and aggcurves tables from the risk_by_event table
+    without reading it all in memory; the results are stored as soon as
+    each partition is processed. Each task reads risk_by_event directly,
+    block by block, keeping only the rows of its partition.
+
+    :returns: the aggrisk DataFrame
+    """
+    size = dstore.getsize('risk_by_event')
+    ct = oq.concurrent_tasks or 1
+    logging.info('Building aggrisk from %s of risk_by_event in '
+                 'streaming mode', general.humansize(size))
+    nrows = len(dstore['risk_by_event/event_id'])
+    allargs = []
+    for arr in numpy.array_split(numpy.arange(K), ct):
+        if len(arr):
+            agg_ids = numpy.zeros(K + 1, bool)
+            agg_ids[arr] = True
+            allargs.append((aggrisk_by_partition, (
+                dstore, oq, agg_ids, num_events, K, idxs)))
+    # the total aggregation is as big as all the others together
+    if oq.quantiles or 'post_loss_amplification' in oq.inputs:
+        # the quantiles and the post loss amplification of the aggrisk
+        # require all the losses of the total aggregation together
+        agg_ids = numpy.zeros(K + 1, bool)
+        agg_ids[K] = True
+        allargs.append((aggrisk_by_partition, (
+            dstore, oq, agg_ids, num_events, K, idxs)))
+    else:
+        for slc in general.gen_slices(0, nrows, numpy.ceil(nrows / ct)):
+            allargs.append((total_by_events, (
+                dstore, oq, slc, num_events, K, idxs)))
+    dstore.swmr_on()
+    smap = parallel.Starmap(aggrisk_by_partition, h5=dstore.hdf5)
+    for func, args in allargs:
+        smap.submit(args, func)
+    attrs = dict(aggrisk=dict(limit_states=' '.join(oq.limit_states)),
+                 aggcurves=aggcurves_attrs(oq, dstore))
+    aggrisks = []
+    partials = []
+    for out in smap:
+        if 'sums' in out:  # partial result for the total aggregation
+            partials.append(out)
+            continue
+        for key, df in out.items():
+            if len(df):
+                extend_df(dstore, key, df, **attrs.get(key, {}))
+        aggrisks.append(out['aggrisk'])
+    if partials:
+        out = combine_total(dstore, oq, partials, num_events, K)
+        for key, df in out.items():
+            if len(df):
+                extend_df(dstore, key, df, **attrs.get(key, {}))
+        aggrisks.append(out['aggrisk'])
+    return pandas.concat(aggrisks, ignore_index=True)
+
+
 def build_reinsurance(dstore, oq, num_events):
     """
     Build and store the tables `reinsurance-avg_policy` and
@@ -590,20 +934,26 @@ class PostRiskCalculator(base.RiskCalculator):
                     self.datastore.set_shape_descr(
                         'src_loss_table/' + loss_type, source=source_ids)
         K = len(self.datastore['agg_keys']) if oq.aggregate_by else 0
-        rbe_df = self.datastore.read_df('risk_by_event')
-        if len(rbe_df) == 0:
+        if len(self.datastore['risk_by_event/event_id']) == 0:
             logging.warning('The risk_by_event table is empty, perhaps the '
                             'hazard is too small?')
             return 0
+        idxs = None
         if self.reaggreate:
             idxs = numpy.concatenate([
                 reagg_idxs(self.num_tags, oq.aggregate_by[0]),
                 numpy.array([K], int)])
-            rbe_df['agg_id'] = idxs[rbe_df['agg_id'].to_numpy()]
-            rbe_df = rbe_df.groupby(
-                ['event_id', 'loss_id', 'agg_id']).sum().reset_index()
-        self.aggrisk = build_store_agg(
-            self.datastore, oq, rbe_df, self.num_events)
+        if oq.stream_risk_by_event:
+            self.aggrisk = build_store_agg_streaming(
+                self.datastore, oq, self.num_events, K, idxs)
+        else:
+            rbe_df = self.datastore.read_df('risk_by_event')
+            if idxs is not None:
+                rbe_df['agg_id'] = idxs[rbe_df['agg_id'].to_numpy()]
+                rbe_df = rbe_df.groupby(
+                    ['event_id', 'loss_id', 'agg_id']).sum().reset_index()
+            self.aggrisk = build_store_agg(
+                self.datastore, oq, rbe_df, self.num_events)
         if 'reinsurance-risk_by_event' in self.datastore:
             build_reinsurance(self.datastore, oq, self.num_events)
         return 1
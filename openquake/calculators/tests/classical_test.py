@@ -229,6 +229,33 @@ class ClassicalTestCase(CalculatorTestCase):
         self.assertEqual(data['tiles'], 1)
         self.assertEqual(data['blocks'], 2)
 
+        # predicted vs actual memory, one record per tile
+        task_mem = self.calc.datastore['task_mem'][:]
+        self.assertEqual(task_mem['nsites'].sum(), self.calc.N)
+        self.assertTrue((task_mem['predicted_mb'] > 0).all())
+        # the memory limit used to determine the tiles is stored
+        self.assertGreater(self.calc.datastore.hdf5.attrs['max_task_mb'], 0)
+
+        # the source groups are read via the SourceGroupCache
+        ops = set(self.calc.datastore['performance_data']['operation'])
+        self.assertIn(b'csm cache misses', ops)
+
+    def test_case_22_float32(self):
+        # QA comparison between float64 and float32 PoEs
+        self.run_calc(case_22.__file__, 'job.ini')
+        curves64 = self.calc.datastore['hcurves-stats'][:]
+        self.run_calc(case_22.__file__, 'job.ini', float32_poes='true')
+        curves32 = self.calc.datastore['hcurves-stats'][:]
+        aac(curves32, curves64, rtol=1E-6)
+
+    def test_case_22_mean_std_cache(self):
+        self.run_calc(case_22.__file__, 'job.ini')
+        curves = self.calc.datastore['hcurves-stats'][:]
+        self.run_calc(case_22.__file__, 'job.ini', mean_std_cache='true')
+        aac(self.calc.datastore['hcurves-stats'][:], curves)
+        ops = set(self.calc.datastore['performance_data']['operation'])
+        self.assertIn(b'mean_std cache misses', ops)
+
     def test_case_23(self):  # filtering away on TRT
         self.assert_curves_ok(['hazard_curve.csv'],
                               case_23.__file__, delta=1e-5)
@@ -81,6 +81,17 @@ class EventBasedDamageTestCase(CalculatorTestCase):
         for f in fnames:
             self.assertEqualFiles('expected/' + strip_calc_id(f), f, delta=1E-5)
 
+    def test_case_12a_counter_based(self):
+        # the damages do not depend on the task splitting
+        dfs = []
+        for ct in ('1', '8'):
+            self.run_calc(case_12.__file__, 'job_a.ini',
+                          counter_based_rng='true', concurrent_tasks=ct)
+            dfs.append(self.calc.datastore.read_df(
+                'risk_by_event', ['event_id', 'agg_id', 'loss_id']
+            ).sort_index())
+        numpy.testing.assert_equal(dfs[0].to_numpy(), dfs[1].to_numpy())
+
     def test_case_12d(self):
         # test event_based_damage, aggregate_by=id
         self.run_calc(case_12.__file__, 'job_d.ini')
@@ -19,18 +19,22 @@ import os
 import sys
 from unittest import mock, SkipTest
 import numpy
+import pandas
 
 from openquake.baselib.general import gettemp
 from openquake.baselib.hdf5 import read_csv
 from openquake.baselib.writers import CsvWriter, FIVEDIGITS
 from openquake.hazardlib import InvalidFile
 from openquake.hazardlib.source.rupture import get_ruptures_aw
+from openquake.risklib import scientific
 from openquake.commonlib import logs, readinput
 from openquake.calculators.views import view, text_table
 from openquake.calculators.tests import CalculatorTestCase, strip_calc_id
 from openquake.calculators.export import export
 from openquake.calculators.extract import extract
-from openquake.calculators.post_risk import PostRiskCalculator
+from openquake.calculators.event_based_risk import check_keys
+from openquake.calculators.post_risk import (
+    PostRiskCalculator, get_num_top)
 from openquake.qa_tests_data.event_based_risk import (
     case_1, case_2, case_3, case_4, case_4a, case_5, case_6c, case_master,
     case_miriam, occupants, case_1f, case_1g, case_7a, case_8, case_9,
@@ -216,6 +220,18 @@ agg_id
         loss2 = view('portfolio_losses', self.calc.datastore)
         self.assertEqual(loss0, loss2)
 
+        # test the vulnerability lookup tables
+        aggrisk = self.calc.datastore.read_df('aggrisk')
+        self.run_calc(case_2.__file__, 'job.ini', concurrent_tasks='2',
+                      vulnerability_lookup_size='10000')
+        vfs = [rf for rm in self.calc.crmodel.values()
+               for dic in rm.risk_functions.values() for rf in dic.values()]
+        self.assertTrue(vfs)
+        for vf in vfs:  # the tables were built
+            self.assertIsNotNone(vf.lut)
+        aac(self.calc.datastore.read_df('aggrisk').loss, aggrisk.loss,
+            rtol=1E-5)
+
         # test the case when all GMFs are filtered out
         with self.assertRaises(RuntimeError) as ctx:
             self.run_calc(case_2.__file__, 'job.ini', minimum_intensity='10.0')
@@ -621,6 +637,26 @@ agg_id
         self.assertEqualFiles('expected/recomputed_losses.csv', fname,
                               delta=1E-5)
 
+        # the same in streaming mode
+        oq.__dict__['stream_risk_by_event'] = True
+        log = logs.init('job', {'calculation_mode': 'post_risk',
+                                'description': 'test recompute streaming'})
+        prc0, prc = prc, PostRiskCalculator(oq, log.calc_id)
+        prc.assetcol = self.calc.assetcol
+        with log:
+            prc.run()
+        [_total, fname] = export(('aggrisk', 'csv'), prc.datastore)
+        self.assertEqualFiles('expected/recomputed_losses.csv', fname,
+                              delta=1E-5)
+        # the total aggregation is computed by combining partial results
+        for name in ('aggcurves', 'loss_by_event', 'loss_by_rupture'):
+            df0 = prc0.datastore.read_df(name)
+            df = prc.datastore.read_df(name)
+            cols = sorted(df0.columns)
+            df0 = df0[cols].sort_values(cols).reset_index(drop=True)
+            df = df[cols].sort_values(cols).reset_index(drop=True)
+            pandas.testing.assert_frame_equal(df, df0, rtol=1E-5)
+
         # test that imported ruptures can be exported
         export(('ruptures', 'csv'), self.calc.datastore)
 
@@ -775,3 +811,21 @@ class ReinsuranceTestCase(CalculatorTestCase):
         [fname] = export(('reinsurance-aggcurves', 'csv'), self.calc.datastore)
         self.assertEqualFiles('expected/reinsurance-aggcurves.csv',
                               fname, delta=.002)  # big diffs on macos, 0.16%
+
+    def test_num_top(self):
+        # the loss curves can be built from the largest losses only
+        periods = numpy.array([5, 10, 50, 100])
+        builder = mock.Mock(return_periods=periods, eff_time=1000.)
+        ntop = get_num_top(builder)
+        self.assertEqual(ntop, 202)
+        losses = numpy.random.default_rng(42).lognormal(size=1000)
+        full = scientific.losses_by_period(losses, periods, 1500, 1000.)
+        top = scientific.losses_by_period(
+            numpy.sort(losses)[-ntop:], periods, 1500, 1000.)
+        numpy.testing.assert_equal(top['curve'], full['curve'])
+
+    def test_check_keys(self):
+        check_keys(2 ** 28, 15)  # fine
+        with self.assertRaises(ValueError) as ctx:
+            check_keys(2 ** 28, 16)  # overflow
+        self.assertIn('too many aggregation keys', str(ctx.exception))
@@ -367,10 +367,19 @@ class EventBasedTestCase(CalculatorTestCase):
 
     def test_case_14(self):
         # sampling of a logic tree of kind `is_source_specific`
-        out = self.run_calc(case_14.__file__, 'job.ini', exports='csv')
+        out = self.run_calc(case_14.__file__, 'job.ini', exports='csv',
+                            gmf_by_site='true')
         [fname, _, _] = out['gmf_data', 'csv']
         self.assertEqualFiles('expected/gmf-data.csv', fname)
 
+        # reading the GMFs of two sites from the copy sorted by site
+        gmf_df = self.calc.datastore.read_df('gmf_data')
+        sids = gmf_df.sid.unique()[:2]
+        df = extract(self.calc.datastore,
+                     'gmf_data?site_id=%d&site_id=%d' % tuple(sids))
+        exp = gmf_df[gmf_df.sid.isin(sids)].sort_values('sid', kind='stable')
+        aac(df.to_numpy(), exp.to_numpy())
+
     def test_case_15(self):
         # an example for Japan testing also the XML rupture exporter
         self.run_calc(case_15.__file__, 'job.ini')
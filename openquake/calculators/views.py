@@ -35,6 +35,7 @@ from openquake.baselib.general import (
     get_array, group_array, fast_agg, sum_records)
 from openquake.baselib.hdf5 import FLOAT, INT, vstr
 from openquake.baselib.performance import performance_view, Monitor
+from openquake.baselib.parallel import get_stragglers
 from openquake.baselib.python3compat import encode, decode
 from openquake.hazardlib import logictree, calc, source, geo
 from openquake.hazardlib.valid import basename
@@ -734,11 +735,12 @@ def view_task_info(token, dstore):
     for task, arr in group_array(task_info[()], 'taskname').items():
         val = discard_small(arr['duration'])
         if len(val):
-            data.append(stats(task, val, val.max() / val.mean()))
+            nslow, slowfac = get_stragglers(val)
+            data.append(stats(task, val, slowfac, nslow))
     if not data:
         return 'Not available'
-    return numpy.array(
-        data, dt('operation-duration counts mean stddev min max slowfac'))
+    return numpy.array(data, dt(
+        'operation-duration counts mean stddev min max slowfac stragglers'))
 
 
 def reduce_srcids(srcids):
@@ -1204,7 +1206,8 @@ def view_calc_risk(token, dstore):
         rng = None
     else:
         rng = ebr.MultiEventRNG(oq.master_seed, gmf_df.eid.unique(),
-                                int(oq.asset_correlation))
+                                int(oq.asset_correlation),
+                                oq.counter_based_rng)
 
     mon = Monitor()
     outs = []  # ebr.gen_outputs(gmf_df, crmodel, rng, mon)
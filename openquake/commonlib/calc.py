@@ -20,6 +20,7 @@ import logging
 import operator
 import functools
 import numpy
+import pandas
 from shapely.geometry import Point
 
 from openquake.baselib import performance, parallel, hdf5, general
@@ -428,6 +429,101 @@ def get_slices(sbe, data, num_assets):
     return out
 
 
+###################################################################
+# logic for storing the GMFs sorted by site and reading them back #
+###################################################################
+
+slice_by_site_dt = numpy.dtype([('sid', U32), ('start', I64), ('stop', I64)])
+
+
+def store_gmf_by_site(h5, maxrows):
+    """
+    Store a copy of gmf_data sorted by site ID in the group gmf_by_site,
+    plus a dataset gmf_by_site/slice_by_site with the rows of each site.
+    The rows of a site keep the order they have in gmf_data. The data are
+    read in chunks of `maxrows` rows and the sites are grouped in blocks
+    of about `maxrows` rows, so the memory occupation does not depend on
+    the size of gmf_data.
+
+    :param h5: a hdf5.File containing the group gmf_data
+    :param maxrows: number of rows to keep in memory
+    :returns: the slice_by_site array
+    """
+    data = h5['gmf_data']
+    cols = data.attrs['__pdcolumns__'].split()
+    size = len(data['sid'])
+    chunks = list(general.gen_slices(0, size, maxrows))
+
+    # first pass: count the rows per site
+    counts = numpy.zeros(0, I64)
+    for slc in chunks:
+        cnt = numpy.bincount(data['sid'][slc])
+        if len(cnt) > len(counts):
+            counts = numpy.pad(counts, (0, len(cnt) - len(counts)))
+        counts[:len(cnt)] += cnt
+    stop = numpy.cumsum(counts)
+    start = stop - counts
+    blk = start // maxrows
+    ublk, first = numpy.unique(blk, return_index=True)
+    site_blk = numpy.searchsorted(ublk, blk)  # block index of each site
+    bstart = start[first]
+    bstop = numpy.append(bstart[1:], size)
+    for col in cols:
+        hdf5.create(h5, f'gmf_by_site/{col}', data[col].dtype, (size,))
+    out = h5['gmf_by_site']
+    out.attrs['__pdcolumns__'] = ' '.join(cols)
+
+    # second pass: copy the rows of each chunk in the region of their block
+    cursor = bstart.copy()
+    for slc in chunks:
+        blks = site_blk[data['sid'][slc]]
+        order = numpy.argsort(blks, kind='stable')
+        bcounts = numpy.bincount(blks, minlength=len(ublk))
+        nonzero, = numpy.where(bcounts)
+        for col in cols:
+            arr = data[col][slc][order]
+            idx = 0
+            for b in nonzero:
+                n = bcounts[b]
+                out[col][cursor[b]:cursor[b] + n] = arr[idx:idx + n]
+                idx += n
+        cursor += bcounts
+
+    # third pass: sort each block by site ID
+    for s0, s1 in zip(bstart, bstop):
+        order = numpy.argsort(out['sid'][s0:s1], kind='stable')
+        for col in cols:
+            out[col][s0:s1] = out[col][s0:s1][order]
+
+    ok = counts > 0
+    sbs = numpy.zeros(ok.sum(), slice_by_site_dt)
+    sbs['sid'], = numpy.where(ok)
+    sbs['start'] = start[ok]
+    sbs['stop'] = stop[ok]
+    h5['gmf_by_site/slice_by_site'] = sbs
+    return sbs
+
+
+def read_gmf_by_site(h5, sids):
+    """
+    :param h5: a hdf5.File containing gmf_data and possibly gmf_by_site
+    :param sids: site IDs
+    :returns: a DataFrame with the GMFs of the given sites
+    """
+    sids = numpy.unique(sids)
+    if 'gmf_by_site' not in h5:  # scan the full table
+        df = h5.read_df('gmf_data')
+        return df[numpy.isin(df.sid.to_numpy(), sids)]
+    sbs = h5['gmf_by_site/slice_by_site'][:]
+    sbs = sbs[numpy.isin(sbs['sid'], sids)]
+    if len(sbs) == 0:
+        cols = h5['gmf_by_site'].attrs['__pdcolumns__'].split()
+        return pandas.DataFrame(
+            {col: h5[f'gmf_by_site/{col}'][:0] for col in cols})
+    slices = list(zip(sbs['start'], sbs['stop']))  # contiguous reads
+    return h5.read_df('gmf_by_site', slices=slices)
+
+
 def starmap_from_gmfs(task_func, oq, dstore, mon):
     """
     :param task_func: function or generator with signature (gmf_df, oq, dstore)
@@ -437,18 +437,19 @@ class DataStore(collections.abc.MutableMapping):
         data = bytes(numpy.asarray(self[key][()]))
         return io.BytesIO(gzip.decompress(data))
 
-    def read_df(self, key, index=None, sel=(), slc=slice(None)):
+    def read_df(self, key, index=None, sel=(), slc=slice(None), slices=()):
         """
         :param key: name of the structured dataset
         :param index: pandas index (or multi-index), possibly None
         :param sel: dictionary used to select subsets of the dataset
         :param slc: slice object to extract a slice of the dataset
+        :param slices: an array of shape (N, 2) with start,stop indices
         :returns: pandas DataFrame associated to the dataset
         """
         if key in self.hdf5:
-            return self.hdf5.read_df(key, index, sel, slc)
+            return self.hdf5.read_df(key, index, sel, slc, slices)
         if self.parent:
-            return self.parent.read_df(key, index, sel, slc)
+            return self.parent.read_df(key, index, sel, slc, slices)
         raise KeyError(key)
 
     def read_unique(self, key, field):
@@ -121,6 +121,12 @@ asset_life_expectancy:
 assets_per_site_limit:
   INTERNAL
 
+gmf_by_site:
+  If true, store also a copy of the GMFs sorted by site ID, to read
+  efficiently the GMFs of a few sites.
+  Example: *gmf_by_site = true*
+  Default: False
+
 gmf_max_gb:
   If the size (in GB) of the GMFs is below this value, then compute avg_gmf
   Example: *gmf_max_gb = 1.*
@@ -212,6 +218,14 @@ countries:
   Example: *countries = ITA*.
   Default: ()
 
+counter_based_rng:
+  Used in event based risk and damage calculations. If set, the random
+  numbers are generated with a stateless counter-based generator keyed
+  by master_seed, event ID and asset ID, which is vectorized and
+  independent from the task splitting, instead of one generator per event.
+  Example: *counter_based_rng = true*.
+  Default: False
+
 cross_correlation:
   When used in Conditional Spectrum calculation is the name of a cross
   correlation class (i.e. "BakerJayaram2008").
@@ -277,6 +291,13 @@ extreme_gmv:
   Example: *extreme_gmv = 5.0*
   Default: {'default': numpy.inf} i.e. no values are extreme
 
+float32_poes:
+  When set, the PoEs are passed to the rate accumulators in single precision,
+  halving the memory required by the largest arrays in the classical tasks;
+  the accumulation is still performed in double precision.
+  Example: *float32_poes = true*.
+  Default: False
+
 floating_x_step:
   Float, used in rupture generation for kite faults. indicates the fraction
   of fault length used to float ruptures along strike by the given float
@@ -330,7 +351,9 @@ ground_motion_correlation_model:
   Default: None
 
 ground_motion_correlation_params:
-  To be used together with ground_motion_correlation_model.
+  To be used together with ground_motion_correlation_model. For JB2009
+  you can also set "method" to "vecchia" (approximate but viable for large
+  site collections) and "num_neighbors" (default 30).
   Example: *ground_motion_correlation_params = {"vs30_clustering": False}*.
   Default: empty dictionary
 
@@ -518,6 +541,24 @@ mean:
   Example: *mean = false*.
   Default: True
 
+mean_std_cache:
+  Cache the mean and standard deviations computed by the GSIMs in the
+  workers; if the directory `mean_std_cache` is set in openquake.cfg, the
+  cache is also stored there and reused by later calculations, removing
+  the least recently used entries when the directory exceeds
+  mean_std_cache_disk_mb. The number of context rows found in the cache
+  or computed is visible in `oq show performance` as "mean_std cache hits"
+  and "mean_std cache misses".
+  Example: *mean_std_cache = true*.
+  Default: False
+
+mean_std_cache_level:
+  Rounding of the context parameters used as keys of the mean_std_cache:
+  -1 means no rounding (exact results) while 0, 1, 2 mean increasingly
+  coarse roundings (more cache hits, approximated results).
+  Example: *mean_std_cache_level = 1*.
+  Default: -1
+
 minimum_asset_loss:
   Used in risk calculations. If set, losses smaller than the
   *minimum_asset_loss* are consider zeros.
@@ -812,6 +853,14 @@ steps_per_interval:
   Example: *steps_per_interval = 4*.
   Default: 1
 
+stream_risk_by_event:
+  Used in risk calculations. If set, aggrisk and aggcurves are computed in
+  parallel, with tasks reading the risk_by_event table block by block and
+  keeping only the rows of a partition of the agg_ids, or of a slice of
+  events for the total aggregation, without keeping it all in memory.
+  Example: *stream_risk_by_event = true*.
+  Default: False
+
 tectonic_region_type:
    Used to specify a tectonic region type.
    Example: *tectonic_region_type = Active Shallow Crust*.
@@ -857,6 +906,13 @@ vs30_tolerance:
   Example: *vs30_tolerance = 20*.
   Default: 0
 
+vulnerability_lookup_size:
+  Used in risk calculations. If positive, the vulnerability functions are
+  interpolated with a lookup table of the given size, uniformly spaced in
+  log(IML), instead of the exact linear interpolation.
+  Example: *vulnerability_lookup_size = 1000*.
+  Default: 0
+
 width_of_mfd_bin:
   Used to specify the width of the Magnitude Frequency Distribution.
   Example: *width_of_mfd_bin = 0.2*.
@@ -1007,6 +1063,7 @@ class OqParam(valid.ParamSet):
     conditional_loss_poes = valid.Param(valid.probabilities, [])
     continuous_fragility_discretization = valid.Param(valid.positiveint, 20)
     countries = valid.Param(valid.namelist, ())
+    counter_based_rng = valid.Param(valid.boolean, False)
     cross_correlation = valid.Param(valid.utf8_not_empty, 'yes')
     cholesky_limit = valid.Param(valid.positiveint, 10_000)
     correlation_cutoff = valid.Param(valid.positivefloat, 1E-12)
@@ -1021,6 +1078,7 @@ class OqParam(valid.ParamSet):
     discrete_damage_distribution = valid.Param(valid.boolean, False)
     distance_bin_width = valid.Param(valid.positivefloat)
     mag_bin_width = valid.Param(valid.positivefloat, 1.)
+    float32_poes = valid.Param(valid.boolean, False)
     floating_x_step = valid.Param(valid.positivefloat, 0)
     floating_y_step = valid.Param(valid.positivefloat, 0)
     ignore_encoding_errors = valid.Param(valid.boolean, False)
@@ -1029,6 +1087,7 @@ class OqParam(valid.ParamSet):
     export_dir = valid.Param(valid.utf8, '.')
     exports = valid.Param(valid.export_formats, ())
     extreme_gmv = valid.Param(valid.floatdict, {'default': numpy.inf})
+    gmf_by_site = valid.Param(valid.boolean, False)
     gmf_max_gb = valid.Param(valid.positivefloat, .1)
     ground_motion_correlation_model = valid.Param(
         valid.NoneOr(valid.Choice(*GROUND_MOTION_CORRELATION_MODELS)), None)
@@ -1070,8 +1129,11 @@ class OqParam(valid.ParamSet):
     max_potential_paths = valid.Param(valid.positiveint, 15_000)
     max_sites_disagg = valid.Param(valid.positiveint, 10)
     mean_hazard_curves = mean = valid.Param(valid.boolean, True)
+    mean_std_cache = valid.Param(valid.boolean, False)
+    mean_std_cache_level = valid.Param(int, -1)
     mosaic_model = valid.Param(valid.three_letters, '')
     std = valid.Param(valid.boolean, False)
+    stream_risk_by_event = valid.Param(valid.boolean, False)
     minimum_distance = valid.Param(valid.positivefloat, 0)
     minimum_engine_version = valid.Param(valid.version, None)
     minimum_intensity = valid.Param(valid.floatdict, {})  # IMT -> minIML
@@ -1146,6 +1208,7 @@ class OqParam(valid.ParamSet):
     uniform_hazard_spectra = valid.Param(valid.boolean, False)
     use_rates = valid.Param(valid.boolean, False)
     vs30_tolerance = valid.Param(int, 0)
+    vulnerability_lookup_size = valid.Param(valid.positiveint, 0)
     width_of_mfd_bin = valid.Param(valid.positivefloat, None)
     with_betw_ratio = valid.Param(valid.positivefloat, None)
 
@@ -1974,6 +2037,12 @@ class OqParam(valid.ParamSet):
             return self.ps_grid_spacing == 0
         return True
 
+    def is_valid_mean_std_cache_level(self):
+        """
+        mean_std_cache_level must be -1, 0, 1 or 2
+        """
+        return self.mean_std_cache_level in (-1, 0, 1, 2)
+
     def is_valid_concurrent_tasks(self):
         """
         At most you can use 30_000 tasks
@@ -1,6 +1,8 @@
+import os
 import unittest
 import numpy
-from openquake.baselib import general
+from openquake.baselib import general, hdf5
+from openquake.commonlib.calc import store_gmf_by_site, read_gmf_by_site
 from openquake.hazardlib.sourceconverter import SourceConverter
 from openquake.hazardlib.map_array import compute_hazard_maps
 
@@ -64,3 +66,27 @@ class HazardMapsTestCase(unittest.TestCase):
         ]
         actual = compute_hazard_maps(numpy.array(curves), imls, poes)
         aaae(expected, actual.T)
+
+
+class GmfBySiteTestCase(unittest.TestCase):
+    def test(self):
+        rng = numpy.random.default_rng(42)
+        E, N = 50, 20
+        eid = numpy.repeat(numpy.arange(E, dtype=numpy.uint32), N)
+        sid = numpy.tile(numpy.arange(N, dtype=numpy.uint32), E)
+        ok = rng.random(E * N) < .7  # discard 30% of the GMFs
+        pga = rng.random(ok.sum()).astype(numpy.float32)
+        with hdf5.File.temporary() as h5:
+            h5.create_df('gmf_data', [
+                ('sid', sid[ok]), ('eid', eid[ok]), ('PGA', pga)])
+            sbs = store_gmf_by_site(h5, maxrows=97)  # many chunks
+            expected = h5.read_df('gmf_data')
+            numpy.testing.assert_equal(
+                sbs['sid'], numpy.unique(expected.sid))
+            for sids in ([3], [0, 7, 19], [25]):
+                df = read_gmf_by_site(h5, sids).reset_index(drop=True)
+                exp = expected[numpy.isin(expected.sid, sids)]
+                exp = exp.sort_values('sid', kind='stable')
+                numpy.testing.assert_equal(df.to_numpy(), exp.to_numpy())
+            fname = h5.path
+        os.remove(fname)
@@ -33,6 +33,7 @@ from openquake.commonlib import readinput, datastore
 from openquake.qa_tests_data.logictree import case_02, case_15, case_21
 from openquake.qa_tests_data.classical import case_34, case_65
 from openquake.qa_tests_data.event_based import case_16
+from openquake.qa_tests_data.scenario import case_16 as case_16s
 from openquake.qa_tests_data.event_based_risk import case_2, case_caracas
 from openquake.qa_tests_data import mosaic
 
@@ -416,6 +417,30 @@ POLYGON((78.0 31.5, 89.5 31.5, 89.5 25.5, 78.0 25.5, 78.0 31.5))'''
         self.assertIn('''\
 Found case-duplicated fields [['ID', 'id']] in ''', str(ctx.exception))
 
+    def test_empty_csv(self):
+        # an exposure file with the header only
+        tmp = tempfile.mkdtemp()
+        with open(os.path.join(DATADIR, 'exposure.xml')) as f:
+            xml = f.read()
+        with open(os.path.join(tmp, 'exposure.xml'), 'w') as f:
+            f.write(xml)
+        with open(os.path.join(tmp, 'exposure.csv'), 'w') as f:
+            f.write('id,lon,lat,taxonomy,number,structural\n')
+        with self.assertRaises(InvalidFile) as ctx:
+            asset.Exposure.read_all([os.path.join(tmp, 'exposure.xml')])
+        self.assertIn('exposure.csv is empty', str(ctx.exception))
+
+    def test_read_in_blocks(self):
+        # reading the CSV file in parallel blocks must not change the assets
+        fname = os.path.join(os.path.dirname(case_16s.__file__),
+                             'Example_Exposure.xml')
+        exp = asset.Exposure.read_all([fname])
+        with mock.patch.object(asset, 'CSV_BLOCKSIZE', 50_000):
+            exp_blocks = asset.Exposure.read_all([fname])
+        self.assertEqual(exp_blocks.tagcol.taxonomy, exp.tagcol.taxonomy)
+        pandas.testing.assert_frame_equal(
+            pandas.DataFrame(exp_blocks.assets), pandas.DataFrame(exp.assets))
+
     def test_percent_in_description(self):
         job_ini = general.gettemp('''\
 [general]
@@ -553,6 +553,28 @@ def get_me_ta_ph(cmaker, sdata, observed_imts, target_imts,
     return me, ta, ph
 
 
+def get_cholesky(tau, phi, cutoff):
+    """
+    Compute the Cholesky factors of the conditioned covariance matrices
+    tau + phi, used to sample the conditioned GMFs.
+    NB: to save memory tau is overwritten with the factors
+
+    :param tau: between-event covariances of shape (G, M, N, N)
+    :param phi: within-event covariances of shape (G, M, N, N)
+    :param cutoff: added to the diagonal to remove negative eigenvalues
+    :returns: the lower triangular factors, of shape (G, M, N, N)
+    """
+    G, M, N, _ = tau.shape
+    diag = numpy.arange(N)
+    for g in range(G):
+        for m in range(M):
+            cov = tau[g, m]
+            cov += phi[g, m]
+            cov[diag, diag] += cutoff
+            cov[:] = numpy.linalg.cholesky(cov)
+    return tau
+
+
 # tested in openquake/hazardlib/tests/calc/conditioned_gmfs_test.py
 def get_mean_covs(
         rupture, cmaker, station_sitecol, station_data, observed_imt_strs,
@@ -336,7 +336,7 @@ class GmfComputer(object):
                 with mmon:
                     ms = self.cmaker.get_4MN([self.ctx], gs)
             else:  # conditioned
-                ms = (mean_stds[0][g], mean_stds[1][g], mean_stds[2][g])
+                ms = tuple(arr[g] for arr in mean_stds)
             with cmon:
                 E = len(idxs)
                 result = numpy.zeros(
@@ -370,20 +370,19 @@ class GmfComputer(object):
             return self.strip_zeros(data)
 
     def _compute(self, mean_stds, m, imt, gsim, intra_eps, idxs, rng=None):
-        if len(mean_stds) == 3:  # conditioned GMFs
-            # mea, tau, phi with shapes (N,1), (N,N), (N,N)
-            mu_Y, cov_WY_WY, cov_BY_BY = mean_stds
+        if len(mean_stds) == 2:  # conditioned GMFs
+            # mea and Cholesky factor of the covariance, see get_cholesky,
+            # with shapes (N,1), (N,N)
+            mu_Y, chol = mean_stds
             E = len(idxs)
-            eps = self.cmaker.oq.correlation_cutoff
             if self.cmaker.truncation_level <= 1E-9:
                 gmf = exp(mu_Y, imt.string != "MMI")
                 gmf = gmf.repeat(E, axis=1)
             else:
-                # add a cutoff to remove negative eigenvalues
-                cov_Y_Y = cov_WY_WY + cov_BY_BY + numpy.eye(len(cov_WY_WY)) * eps
-                arr = rng.multivariate_normal(
-                    mu_Y.flatten(), cov_Y_Y, size=E,
-                    check_valid="raise", tol=1e-5, method="cholesky")
+                # all the E draws with a single matrix product, the same
+                # as rng.multivariate_normal(..., method="cholesky")
+                arr = mu_Y.flatten() + rng.standard_normal(
+                    (E, len(chol))) @ chol.T
                 gmf = exp(arr, imt != "MMI").T
             return gmf  # shapes (N, E)
 
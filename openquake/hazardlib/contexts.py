@@ -19,7 +19,12 @@
 import os
 import abc
 import copy
+import glob
 import time
+import uuid
+import hashlib
+import inspect
+import functools
 import logging
 import warnings
 import itertools
@@ -29,7 +34,7 @@ import numpy
 import shapely
 from scipy.interpolate import interp1d
 
-from openquake.baselib import config
+from openquake.baselib import config, __version__
 from openquake.baselib.general import (
     AccumDict, DictArray, RecordBuilder, split_in_slices, block_splitter,
     sqrscale)
@@ -155,6 +160,25 @@ def is_modifiable(gsim):
     return hasattr(gsim, 'gmpe') and hasattr(gsim, 'params')
 
 
+def single_mag(gsim):
+    """
+    :returns:
+        True for table-based GSIMs (or GSIMs wrapping them) which
+        require a context with a single magnitude
+    """
+    if hasattr(gsim, 'gmpe_table'):
+        return True
+    for val in vars(gsim).values():
+        if isinstance(val, dict):
+            val = list(val.values())
+        elif not isinstance(val, (list, tuple)):
+            val = [val]
+        for obj in val:
+            if hasattr(obj, 'compute') and single_mag(obj):
+                return True
+    return False
+
+
 def concat(ctxs):
     """
     Concatenate context arrays.
@@ -282,6 +306,237 @@ def kround2(ctx, kfields):
 
 kround = {0: kround0, 1: kround1, 2: kround2}
 
+# context fields not used by the GSIMs, i.e. not part of the cache keys
+NOKEY_FIELDS = {'src_id', 'rup_id', 'sids', 'occurrence_rate', 'probs_occur'}
+
+
+def kround_exact(ctx, kfields):
+    """
+    No rounding
+    """
+    out = numpy.zeros(len(ctx), [(k, ctx.dtype[k]) for k in kfields])
+    for kfield in kfields:
+        out[kfield] = ctx[kfield]
+    return out
+
+
+@functools.lru_cache()
+def _source_md5(cls):
+    # md5 of the source files of the class and of its base classes
+    md5 = hashlib.md5()
+    for klass in cls.__mro__:
+        try:
+            fname = inspect.getsourcefile(klass)
+        except TypeError:  # builtin class like object
+            continue
+        if fname:
+            with open(fname, 'rb') as f:
+                md5.update(f.read())
+    return md5.hexdigest()
+
+
+def gsim_fingerprint(gsim):
+    """
+    :param gsim: a GSIM instance
+    :returns: a string which changes when the engine version, the code or
+              the coefficient tables of the GSIM, or its table files change
+    """
+    parts = [__version__, _source_md5(type(gsim))]
+    for val in vars(gsim).values():
+        for v in (val if isinstance(val, (list, tuple)) else [val]):
+            if hasattr(v, 'compute') and hasattr(
+                    v, 'REQUIRES_SITES_PARAMETERS'):  # underlying GSIM
+                parts.append(gsim_fingerprint(v))
+            elif isinstance(v, str) and os.path.isfile(v):  # table file
+                st = os.stat(v)
+                parts.append('%s:%d:%d' % (v, st.st_size, st.st_mtime_ns))
+    return ' '.join(parts)
+
+
+class MeanStdCache(object):
+    """
+    LRU cache of the mean and standard deviations computed by the GSIMs,
+    living in the workers. There is an entry for each (GSIM, IMTs,
+    rounding level, context fields), containing the sorted keys of the
+    context rows (possibly rounded with the `kround` functions) and the
+    associated arrays of shape (4, M). If a `cachedir` is given, the newly
+    computed values are saved there by `.flush()`, to be reused by other
+    workers and by later calculations, in a file per entry; if the files
+    exceed `maxdisk` bytes the least recently used ones are removed.
+    """
+    def __init__(self, maxbytes, cachedir='', maxdisk=0):
+        self.maxbytes = maxbytes
+        self.cachedir = cachedir
+        self.maxdisk = maxdisk
+        self.nbytes = 0
+        self.dic = collections.OrderedDict()  # key -> (skeys, values)
+        self.new = AccumDict(accum=[])  # key -> [(skeys, values), ...]
+        self.fingerprints = {}  # (GSIM class, repr) -> fingerprint
+
+    def get(self, cmaker, ctxs, gsim):
+        """
+        :param cmaker: a ContextMaker with a .mean_std_cache_level
+        :param ctxs: a list of context arrays with N elements in total
+        :param gsim: a GSIM instance
+        :returns: an array of shape (4, M, N)
+        """
+        ctx = numpy.concatenate(ctxs).view(numpy.recarray) if len(
+            ctxs) > 1 else ctxs[0]
+        kfields = [f for f in ctx.dtype.names
+                   if f not in NOKEY_FIELDS and ctx.dtype[f].kind != 'O']
+        level = cmaker.mean_std_cache_level
+        karr = kround.get(level, kround_exact)(ctx, kfields)
+        # the fingerprint avoids reusing values stored on disk by
+        # a different version of the engine or of the GSIM
+        fkey = type(gsim), repr(gsim)
+        try:
+            fingerprint = self.fingerprints[fkey]
+        except KeyError:
+            fingerprint = self.fingerprints[fkey] = gsim_fingerprint(gsim)
+        key = hashlib.md5(repr((
+            fkey[1], fingerprint,
+            [imt.string for imt in cmaker.imts], level,
+            karr.dtype.descr, cmaker.horiz_comp)).encode('utf8')).hexdigest()
+        skeys = karr.view('S%d' % karr.dtype.itemsize)
+        uniq, first, inv = numpy.unique(
+            skeys, return_index=True, return_inverse=True)
+        out = numpy.zeros((len(uniq), 4, len(cmaker.imts)))
+        hit = numpy.zeros(len(uniq), bool)
+        if key in self.dic or self._load(key):
+            self.dic.move_to_end(key)
+            ckeys, cvalues = self.dic[key]
+            idx = numpy.searchsorted(ckeys, uniq).clip(max=len(ckeys)-1)
+            hit = ckeys[idx] == uniq
+            out[hit] = cvalues[idx[hit]]
+        miss = ~hit
+        if miss.any():
+            out[miss] = values = self._compute(
+                cmaker, ctx, karr, first[miss], gsim)
+            self.add(key, uniq[miss], values)
+            if self.cachedir:
+                self.new[key].append((uniq[miss], values))
+        # the monitors are used as counters of the context rows
+        cmaker.hit_mon.counts += hit.sum()
+        cmaker.miss_mon.counts += miss.sum()
+        return out[inv].transpose(1, 2, 0)
+
+    def _compute(self, cmaker, ctx, karr, idxs, gsim):
+        # compute the mean and stddevs of the given rows of the context,
+        # replacing the context parameters with the rounded ones
+        rows = ctx[idxs]
+        for kfield in karr.dtype.names:
+            rows[kfield] = karr[kfield][idxs]
+        order = numpy.argsort(rows.mag, kind='stable')
+        rows = rows[order]
+        if single_mag(gsim):
+            rows = split_array(rows, U32(numpy.round(rows.mag * 100)))
+        else:
+            rows = [rows]
+        values = numpy.empty((len(idxs), 4, len(cmaker.imts)))
+        values[order] = cmaker._get_4MN(rows, gsim).transpose(2, 0, 1)
+        return values
+
+    def _load(self, key):
+        # read the values saved by .flush(), if any
+        if not self.cachedir:
+            return False
+        fname = os.path.join(self.cachedir, key + '.npz')
+        try:
+            with numpy.load(fname) as npz:
+                skeys, values = npz['skeys'], npz['values']
+            os.utime(fname)  # the access time used for the eviction
+        except FileNotFoundError:
+            return False
+        self.add(key, skeys, values)
+        return key in self.dic
+
+    def add(self, key, skeys, values):
+        """
+        Add the values to the cache, discarding the least recently used
+        entries if the cache becomes too large
+        """
+        if key in self.dic:
+            oldkeys, oldvalues = self.dic.pop(key)
+            self.nbytes -= oldkeys.nbytes + oldvalues.nbytes
+            skeys = numpy.concatenate([oldkeys, skeys])
+            values = numpy.concatenate([oldvalues, values])
+        skeys, idxs = numpy.unique(skeys, return_index=True)
+        values = values[idxs]
+        nbytes = skeys.nbytes + values.nbytes
+        if nbytes > self.maxbytes:  # too large to cache
+            return
+        while self.dic and self.nbytes + nbytes > self.maxbytes:
+            _, (k, v) = self.dic.popitem(last=False)
+            self.nbytes -= k.nbytes + v.nbytes
+        self.dic[key] = skeys, values
+        self.nbytes += nbytes
+
+    def flush(self):
+        """
+        Save the newly computed values in the cache directory, if any,
+        by merging them with the values already there
+        """
+        for key, pairs in self.new.items():
+            skeys = [p[0] for p in pairs]
+            values = [p[1] for p in pairs]
+            fname = os.path.join(self.cachedir, key + '.npz')
+            try:
+                with numpy.load(fname) as npz:
+                    skeys.append(npz['skeys'])
+                    values.append(npz['values'])
+            except FileNotFoundError:
+                pass
+            skeys, idxs = numpy.unique(
+                numpy.concatenate(skeys), return_index=True)
+            values = numpy.concatenate(values)[idxs]
+            # NB: if two workers merge the same entry at the same time
+            # the values of one of them are lost, which is harmless
+            tmp = '%s.%s.tmp' % (fname, uuid.uuid4().hex)
+            os.makedirs(self.cachedir, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                numpy.savez(f, skeys=skeys, values=values)
+            os.replace(tmp, fname)  # atomic
+        if self.new and self.maxdisk:
+            self.evict()
+        self.new.clear()
+
+    def evict(self):
+        """
+        Remove the least recently used files of the cache directory
+        until their total size is below maxdisk
+        """
+        stats = []
+        for fname in glob.glob(os.path.join(self.cachedir, '*.npz')):
+            try:
+                st = os.stat(fname)
+            except FileNotFoundError:  # removed by another worker
+                continue
+            stats.append((st.st_mtime, st.st_size, fname))
+        size = sum(st[1] for st in stats)
+        for _mtime, nbytes, fname in sorted(stats):
+            if size <= self.maxdisk:
+                break
+            try:
+                os.remove(fname)
+            except FileNotFoundError:
+                pass
+            size -= nbytes
+
+    def clear(self):
+        """
+        Empty the cache
+        """
+        self.dic.clear()
+        self.new.clear()
+        self.nbytes = 0
+
+
+# global in each worker process
+ms_cache = MeanStdCache(
+    float(config.memory.get('mean_std_cache_mb', 200)) * TWO20,
+    config.directory.get('mean_std_cache', ''),
+    float(config.memory.get('mean_std_cache_disk_mb', 0)) * TWO20)
+
 
 class FarAwayRupture(Exception):
     """Raised if the rupture is outside the maximum distance for all sites"""
@@ -610,6 +865,9 @@ class ContextMaker(object):
         elif not hasattr(self, 'imtls'):
             raise KeyError('Missing imtls in ContextMaker!')
         self.cache_distances = param.get('cache_distances', False)
+        self.float32_poes = param.get('float32_poes', False)
+        self.mean_std_cache = param.get('mean_std_cache', False)
+        self.mean_std_cache_level = param.get('mean_std_cache_level', -1)
         self.max_sites_disagg = param.get('max_sites_disagg', 10)
         self.time_per_task = param.get('time_per_task', 60)
         self.collapse_level = int(param.get('collapse_level', -1))
@@ -696,6 +954,9 @@ class ContextMaker(object):
         self.ir_mon = monitor('iter_ruptures', measuremem=False)
         self.sec_mon = monitor('building dparam', measuremem=True)
         self.delta_mon = monitor('getting delta_rates', measuremem=False)
+        # counters of the context rows found in the mean_std cache or not
+        self.hit_mon = monitor('mean_std cache hits', measuremem=False)
+        self.miss_mon = monitor('mean_std cache misses', measuremem=False)
         self.task_no = getattr(monitor, 'task_no', 0)
         self.out_no = getattr(monitor, 'out_no', self.task_no)
         self.cfactor = numpy.zeros(2)
@@ -788,6 +1049,13 @@ class ContextMaker(object):
         """
         return sum(len(rlzs) for rlzs in self.gsims.values())
 
+    @property
+    def split_by_mag(self):
+        """
+        :returns: True if some GSIM requires contexts with a single magnitude
+        """
+        return any(single_mag(gsim) for gsim in self.gsims)
+
     def new_ctx(self, size):
         """
         :returns: a recarray of the given size full of zeros
@@ -1148,7 +1416,7 @@ class ContextMaker(object):
 
         # split large context arrays to avoid filling the CPU cache
         with self.gmf_mon:
-            # split_by_mag=False because already contains a single mag
+            # split_by_mag=False because already split in gen_poes
             mean_stdt = self.get_mean_stds([ctx], split_by_mag=False)
 
         if len(ctx) < 1000:
@@ -1180,13 +1448,24 @@ class ContextMaker(object):
         :yields: poes, mea_sig, ctxt with poes of shape (N, L, G)
         """
         ctx.mag = numpy.round(ctx.mag, 3)
-        for mag in numpy.unique(ctx.mag):
-            ctxt = ctx[ctx.mag == mag]
-            self.cfactor += [len(ctxt), 1]
+        # sort by magnitude once; the stable sort preserves the order
+        # of the ruptures with the same magnitude
+        ctx = ctx[numpy.argsort(ctx.mag, kind='stable')]
+        _mags, starts = numpy.unique(ctx.mag, return_index=True)
+        stops = numpy.append(starts[1:], len(ctx))
+        for start, stop in zip(starts, stops):
+            self.cfactor += [stop - start, 1]
+        if self.split_by_mag:  # table-based GSIMs, one call per magnitude
+            ctxs = [ctx[start:stop] for start, stop in zip(starts, stops)]
+        else:  # a single call per GSIM for all magnitudes
+            ctxs = [ctx]
+        for ctxt in ctxs:
             for poes, mea, sig, slc in self._gen_poes(ctxt):
-                # NB: using directly 64 bit poes would be slower without reason
-                # since with astype(F64) the numbers are identical
-                yield poes.astype(F64), mea, sig, ctxt[slc]
+                if not self.float32_poes:
+                    # NB: using directly 64 bit poes would be slower without
+                    # reason since with astype(F64) the numbers are identical
+                    poes = poes.astype(F64)
+                yield poes, mea, sig, ctxt[slc]
 
     # documented but not used in the engine
     def get_pmap(self, ctxs, tom=None, rup_mutex={}):
@@ -1225,8 +1504,7 @@ class ContextMaker(object):
             if rup_mutex:
                 pmap.update_mutex(poes, ctxt, self.tom.time_span, rup_mutex)
             elif self.cluster:
-                for poe, sidx in zip(poes, pmap.sidx[ctxt.sids]):
-                    pmap.array[sidx] *= 1. - poe
+                pmap.update_cluster(poes, ctxt)
             else:
                 pmap.update_indep(poes, ctxt, self.tom.time_span)
 
@@ -1258,6 +1536,12 @@ class ContextMaker(object):
         """
         Called by the GmfComputer
         """
+        # NB: the NSHMP2014 adjustments are not cached
+        if self.mean_std_cache and not hasattr(gsim, 'weights_signs'):
+            return ms_cache.get(self, ctxs, gsim)
+        return self._get_4MN(ctxs, gsim)
+
+    def _get_4MN(self, ctxs, gsim):
         N = sum(len(ctx) for ctx in ctxs)
         M = len(self.imts)
         out = numpy.zeros((4, M, N))
@@ -1622,6 +1906,8 @@ class PmapMaker(object):
                     pmapclu.array += pnemap.array**nocc * prob_n_occ
             pnemap.array[:] = pmapclu.array
 
+        if self.cmaker.mean_std_cache:
+            ms_cache.flush()
         dic['rmap'] = pnemap.to_rates()
         dic['rmap'].gid = self.cmaker.gid
         dic['cfactor'] = self.cmaker.cfactor
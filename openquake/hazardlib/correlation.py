@@ -19,6 +19,10 @@ spatially-distributed ground-shaking intensities.
 """
 import abc
 import numpy
+from scipy.spatial import cKDTree
+from openquake.baselib.performance import compile
+from openquake.hazardlib.geo.geodetic import (
+    geodetic_distance, spherical_to_cartesian)
 
 
 class BaseCorrelationModel(metaclass=abc.ABCMeta):
@@ -67,9 +71,10 @@ class BaseCorrelationModel(metaclass=abc.ABCMeta):
         N = len(sites.complete)
         n = len(sites)
         if n < N:  # filtered site collection
-            res = numpy.zeros((N, residuals.shape[1]))
-            res[sites.sids] = residuals
-            return (corma @ res)[sites.sids, :]  # shape (n, s)
+            # the residuals at the other sites are zero, so only the
+            # rows and columns of the filtered sites contribute
+            sids = sites.sids
+            return corma[numpy.ix_(sids, sids)] @ residuals  # shape (n, s)
         else:  # complete site collection
             return corma @ residuals  # shape (N, s)
 
@@ -84,14 +89,46 @@ class JB2009CorrelationModel(BaseCorrelationModel):
         Boolean value to indicate whether "Case 1" or "Case 2" from page 1700
         should be applied. ``True`` value means that Vs 30 values show or are
         expected to show clustering ("Case 2"), ``False`` means otherwise.
+    :param method:
+        "cholesky" (default) to use the exact Cholesky factor of the
+        correlation matrix of the complete site collection, or "vecchia"
+        to use a Vecchia approximation, conditioning each site only on its
+        nearest neighbors, which is viable also for large site collections
+    :param num_neighbors:
+        number of neighbors used in the Vecchia approximation
     """
-    def __init__(self, vs30_clustering):
+    def __init__(self, vs30_clustering, method='cholesky', num_neighbors=30):
+        if method not in ('cholesky', 'vecchia'):
+            raise ValueError('Unknown correlation method %r' % method)
         self.vs30_clustering = vs30_clustering
+        self.method = method
+        self.num_neighbors = num_neighbors
         self.cache = {}  # imt -> correlation model
 
     def _get_correlation_matrix(self, sites, imt):
         return jbcorrelation(sites, imt, self.vs30_clustering)
 
+    def apply_correlation(self, sites, imt, residuals, stddev_intra=0):
+        """
+        Apply correlation to randomly sampled residuals, see
+        :meth:`BaseCorrelationModel.apply_correlation`. With the "vecchia"
+        method the factor is cached for the last site collection per IMT.
+        """
+        if self.method == 'cholesky':
+            return super().apply_correlation(
+                sites, imt, residuals, stddev_intra)
+        key = sites.sids.tobytes()
+        try:
+            skey, factor = self.cache[imt]
+        except KeyError:
+            skey = None
+        if skey != key:
+            factor = vecchia_factor(
+                sites.lons, sites.lats, self.num_neighbors,
+                lambda dist: jbcorrelation(dist, imt, self.vs30_clustering))
+            self.cache[imt] = key, factor
+        return _vecchia_apply(*factor, numpy.asarray(residuals, float))
+
     def get_lower_triangle_correlation_matrix(self, sites, imt):
         """
         Get lower-triangle matrix as a result of Cholesky-decomposition
@@ -149,6 +186,72 @@ def jbcorrelation(sites_or_distances, imt, vs30_clustering=False):
     return numpy.exp((- 3.0 / b) * distances)
 
 
+def vecchia_factor(lons, lats, num_neighbors, corr_func, chunksize=10_000):
+    """
+    Build the Vecchia approximation of a spatial correlation matrix, in
+    which each site, in a given ordering, is conditioned only on its
+    nearest preceding neighbors.
+
+    :param lons: longitudes of the sites
+    :param lats: latitudes of the sites
+    :param num_neighbors: maximum number of neighbors per site
+    :param corr_func: function from distances in km to correlations
+    :param chunksize: number of sites processed at once
+    :returns: the ordering and arrays of shape (n, m), (n, m) and n
+              containing neighbors, coefficients and standard deviations
+    """
+    n = len(lons)
+    m = max(min(num_neighbors, n - 1), 1)
+    order = numpy.lexsort((lats, lons))
+    rank = numpy.empty(n, numpy.int64)
+    rank[order] = numpy.arange(n)
+    k = min(n, 4 * m + 1)  # candidate neighbors, including the site itself
+    _, idx = cKDTree(spherical_to_cartesian(lons, lats)).query(
+        spherical_to_cartesian(lons, lats), k)
+    idx = idx.reshape(n, k)
+    prev = rank[idx] < rank[:, None]
+    # keep the closest preceding neighbors
+    pos = numpy.argsort(~prev, axis=1, kind='stable')[:, :m]
+    nbrs = numpy.take_along_axis(idx, pos, 1)
+    valid = numpy.take_along_axis(prev, pos, 1)
+    if nbrs.shape[1] < m:  # less than m+1 sites
+        nbrs = numpy.pad(nbrs, ((0, 0), (0, m - nbrs.shape[1])))
+        valid = numpy.pad(valid, ((0, 0), (0, m - valid.shape[1])))
+    coeffs = numpy.zeros((n, m))
+    sd = numpy.ones(n)
+    eye = numpy.eye(m, dtype=bool)
+    for start in range(0, n, chunksize):
+        slc = slice(start, start + chunksize)
+        nb, ok = nbrs[slc], valid[slc]
+        cin = corr_func(geodetic_distance(
+            lons[slc, None], lats[slc, None], lons[nb], lats[nb]))
+        cnn = corr_func(geodetic_distance(
+            lons[nb][:, :, None], lats[nb][:, :, None],
+            lons[nb][:, None, :], lats[nb][:, None, :]))
+        # the missing neighbors are replaced by independent dummy sites
+        cin[~ok] = 0.
+        pair = ok[:, :, None] & ok[:, None, :]
+        cnn[~pair] = 0.
+        cnn[:, eye] = 1.
+        coeffs[slc] = numpy.linalg.solve(cnn, cin[:, :, None])[:, :, 0]
+        sd[slc] = numpy.sqrt(
+            numpy.clip(1. - (cin * coeffs[slc]).sum(axis=1), 0., None))
+    return order, nbrs, coeffs, sd
+
+
+@compile("float64[:, :](int64[:], int64[:, :], float64[:, :], float64[:], "
+         "float64[:, :])")
+def _vecchia_apply(order, nbrs, coeffs, sd, residuals):
+    # correlate the residuals site by site, in the Vecchia ordering
+    out = numpy.zeros_like(residuals)
+    for i in order:
+        out[i] = sd[i] * residuals[i]
+        for j, c in zip(nbrs[i], coeffs[i]):
+            if c != 0.:
+                out[i] += c * out[j]
+    return out
+
+
 class HM2018CorrelationModel(BaseCorrelationModel):
     """
     "Uncertainty in intraevent spatial correlation of elastic pseudo-
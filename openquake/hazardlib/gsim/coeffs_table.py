@@ -132,6 +132,13 @@ class CoeffsTable(object):
     ...           imt.PGA(): {"a": 0.1, "b": 1.0},
     ...           imt.PGV(): {"a": 0.5, "b": 10.0}}
     >>> ct = CoeffsTable.fromdict(coeffs)
+
+    The coefficients for many IMTs can be extracted at once as a composite
+    array with the coefficient names as columns, which is cached:
+
+    >>> arr = ct.get_array([imt.PGA(), imt.SA(0.1), imt.SA(0.5)])
+    >>> arr['a']
+    array([0.1       , 1.        , 2.39794001])
     """
 
     @classmethod
@@ -149,6 +156,7 @@ class CoeffsTable(object):
             if isinstance(imt, str):
                 imt = from_string(imt)
             self._coeffs[imt] = self.rb(**dic) 
+        self._arrays = {}
         self.logratio = logratio
         self.opt = opt
         return self
@@ -162,6 +170,7 @@ class CoeffsTable(object):
 
     def __init__(self, table, **kwargs):
         self._coeffs = {}  # cache
+        self._arrays = {}  # cache used in .get_array
         self.opt = kwargs.pop('opt', 0)
         self.logratio = kwargs.pop('logratio', True)
         sa_damping = kwargs.pop('sa_damping', None)
@@ -175,6 +184,7 @@ class CoeffsTable(object):
             # regular array, if you want a composite one use .to_array()
             self.cmtx = np.array([self._coeffs[imts[i]].tolist() for i in idxs])
             self.periods = periods[idxs]
+            self._fit = None  # interpolator built at the first cache miss
 
     def _setup_table_from_str(self, table, sa_damping):
         """
@@ -252,8 +262,9 @@ class CoeffsTable(object):
             pass
 
         if self.opt == 0:
+            sa_coeffs = self.sa_coeffs  # build the dictionary only once
             max_below = min_above = None
-            for unscaled_imt in self.sa_coeffs:
+            for unscaled_imt in sa_coeffs:
                 if unscaled_imt.damping != getattr(imt, 'damping', None):
                     pass
                 elif unscaled_imt.period > imt.period:
@@ -276,8 +287,8 @@ class CoeffsTable(object):
             else:  # in the ACME project
                 ratio = ((imt.period - max_below.period) /
                          (min_above.period - max_below.period))
-            below = self.sa_coeffs[max_below]
-            above = self.sa_coeffs[min_above]
+            below = sa_coeffs[max_below]
+            above = sa_coeffs[min_above]
             lst = [(above[n] - below[n]) * ratio + below[n]
                    for n in self.rb.names]
             self._coeffs[imt] = c = self.rb(*lst)
@@ -285,12 +296,35 @@ class CoeffsTable(object):
         elif self.opt == 1:
             if imt.period < self.periods[0] or imt.period > self.periods[-1]:
                 raise KeyError(imt)
-            fit = scipy.interpolate.interp1d(np.log10(self.periods), self.cmtx,
-                                             axis=0, kind='cubic')
-            vals = fit(np.log10(imt.period))
+            if self._fit is None:
+                self._fit = scipy.interpolate.interp1d(
+                    np.log10(self.periods), self.cmtx, axis=0, kind='cubic')
+            vals = self._fit(np.log10(imt.period))
             self._coeffs[imt] = c = self.rb(*vals)
         return c
 
+    def get_array(self, imts):
+        """
+        Extract the coefficients for all the given IMTs at once, so that
+        a GSIM can perform computations vectorized over the IMTs, i.e.
+        `arr['a'][:, None] * ctx.mag` is an array of shape (M, N).
+        The result is cached by IMTs, so the interpolation is performed
+        only once per table and set of IMTs.
+
+        :param imts: a sequence of M IMTs (or IMT strings)
+        :returns: a composite array of M records with the coefficients
+        :raises KeyError: if an IMT is not available in the table
+        """
+        imts = tuple(from_string(imt) if isinstance(imt, str) else imt
+                     for imt in imts)
+        try:
+            return self._arrays[imts]
+        except KeyError:
+            pass
+        arr = np.array([self[imt] for imt in imts], self.rb.dtype)
+        self._arrays[imts] = arr
+        return arr
+
     def update_coeff(self, coeff_name, value_by_imt):
         """
         Update a coefficient in the table.
@@ -298,6 +332,7 @@ class CoeffsTable(object):
         :param coeff_name: name of the coefficient
         :param value_by_imt: dictionary imt -> coeff_value
         """
+        self._arrays.clear()
         for imt, coeff_value in value_by_imt.items():
             self._coeffs[imt][coeff_name] = coeff_value
 
@@ -24,7 +24,6 @@ import pandas
 import numba
 from openquake.baselib.general import cached_property, humansize
 from openquake.baselib.performance import compile
-from openquake.hazardlib.tom import get_pnes
 
 U16 = numpy.uint16
 U32 = numpy.uint32
@@ -201,55 +200,102 @@ def get_lvl(hcurve, imls, poe):
 # ############################# probability maps ##############################
 
 t = numba.types
-sig_i = t.void(t.float32[:, :, :],                     # pmap
-               t.float64[:, :, :],                     # poes
-               t.float64[:],                           # rates
-               t.float64[:, :],                        # probs_occur
-               t.uint32[:],                            # sids
-               t.float64)                              # itime
-
-sig_m = t.void(t.float32[:, :, :],                     # pmap
-               t.float64[:, :, :],                     # poes
-               t.float64[:],                           # rates
-               t.float64[:, :],                        # probs_occur
-               t.float64[:],                           # weights
-               t.uint32[:],                            # sids
-               t.float64)                              # itime
+# the PoEs can be float32 when the parameter `float32_poes` is set;
+# the accumulation is performed in float64 in any case; the site indices
+# are gathered inside the kernels to avoid allocating temporary arrays
+sig_i = [t.void(t.float32[:, :, :],                    # pmap
+                poes[:, :, :],                         # poes
+                t.float64[:],                          # rates
+                t.float64[:, :],                       # probs_occur
+                t.uint32[:],                           # sidx
+                t.uint32[:],                           # sids
+                t.float64)                             # itime
+         for poes in (t.float64, t.float32)]
+
+sig_m = [t.void(t.float32[:, :, :],                    # pmap
+                poes[:, :, :],                         # poes
+                t.float64[:],                          # rates
+                t.float64[:, :],                       # probs_occur
+                t.float64[:],                          # weights
+                t.uint32[:],                           # sidx
+                t.uint32[:],                           # sids
+                t.float64)                             # itime
+         for poes in (t.float64, t.float32)]
+
+sig_c = [t.void(t.float32[:, :, :],                    # pmap
+                poes[:, :, :],                         # poes
+                t.uint32[:],                           # sidx
+                t.uint32[:])                           # sids
+         for poes in (t.float64, t.float32)]
+
+
+@compile("float64(float64, float64[:], float64, float64)")
+def get_pne(rate, probs, poe, itime):
+    """
+    Scalar version of :func:`openquake.hazardlib.tom.get_pnes`
+    """
+    if itime == 0.:  # FatedTOM
+        return 1. - poe
+    elif len(probs) == 0:  # poissonian
+        return numpy.exp(- rate * itime * poe)
+    pne = probs[0]
+    for p, prob in enumerate(probs[1:], 1):
+        pne += prob * (1. - poe) ** p
+    return min(max(pne, 0.), 1.)
 
 
 @compile(sig_i)
-def update_pmap_i(arr, poes, rates, probs_occur, sidxs, itime):
-    _N, _L, G = arr.shape
-    for poe, rate, probs, sidx in zip(poes, rates, probs_occur, sidxs):
-        no_probs = len(probs) == 0
-        for g in range(G):
-            if no_probs:
-                arr[sidx, :, g] *= numpy.exp(-rate * poe[:, g] * itime)
-            else:  # nonparametric rupture
-                arr[sidx, :, g] *= get_pnes(rate, probs, poe[:, g], itime)
+def update_pmap_i(arr, poes, rates, probs_occur, sidx, sids, itime):
+    _N, L, G = arr.shape
+    for poe, rate, probs, sid in zip(poes, rates, probs_occur, sids):
+        idx = sidx[sid]
+        if len(probs) == 0:
+            for li in range(L):
+                for g in range(G):
+                    arr[idx, li, g] *= numpy.exp(-rate * poe[li, g] * itime)
+        else:  # nonparametric rupture
+            for li in range(L):
+                for g in range(G):
+                    arr[idx, li, g] *= get_pne(
+                        rate, probs, poe[li, g], itime)
 
 
 @compile(sig_i)
-def update_pmap_r(arr, poes, rates, probs_occur, sidxs, itime):
-    _N, _L, G = arr.shape
-    for poe, rate, probs, sidx in zip(poes, rates, probs_occur, sidxs):
+def update_pmap_r(arr, poes, rates, probs_occur, sidx, sids, itime):
+    _N, L, G = arr.shape
+    for poe, rate, probs, sid in zip(poes, rates, probs_occur, sids):
+        idx = sidx[sid]
         if len(probs) == 0:
-            for g in range(G):
-                arr[sidx, :, g] += rate * poe[:, g] * itime
+            for li in range(L):
+                for g in range(G):
+                    arr[idx, li, g] += rate * poe[li, g] * itime
         else:  # nonparametric rupture
-            for g in range(G):
-                arr[sidx, :, g] += - numpy.log(
-                    get_pnes(rate, probs, poe[:, g], itime))
+            for li in range(L):
+                for g in range(G):
+                    arr[idx, li, g] -= numpy.log(
+                        get_pne(rate, probs, poe[li, g], itime))
 
 
 @compile(sig_m)
-def update_pmap_m(arr, poes, rates, probs_occur, weights, sidxs, itime):
-    _N, _L, G = arr.shape
-    for poe, rate, probs, w, sidx in zip(
-            poes, rates, probs_occur, weights, sidxs):
-        for g in range(G):
-            arr[sidx, :, g] += (1. - get_pnes(
-                rate, probs, poe[:, g], itime)) * w
+def update_pmap_m(arr, poes, rates, probs_occur, weights, sidx, sids, itime):
+    _N, L, G = arr.shape
+    for poe, rate, probs, w, sid in zip(
+            poes, rates, probs_occur, weights, sids):
+        idx = sidx[sid]
+        for li in range(L):
+            for g in range(G):
+                arr[idx, li, g] += (
+                    1. - get_pne(rate, probs, poe[li, g], itime)) * w
+
+
+@compile(sig_c)
+def update_pmap_c(arr, poes, sidx, sids):
+    _N, L, G = arr.shape
+    for poe, sid in zip(poes, sids):
+        idx = sidx[sid]
+        for li in range(L):
+            for g in range(G):
+                arr[idx, li, g] *= 1. - poe[li, g]
 
 
 def fix_probs_occur(probs_occur):
@@ -431,13 +477,12 @@ class MapArray(object):
         Update probabilities for independent ruptures
         """
         rates = ctxt.occurrence_rate
-        sidxs = self.sidx[ctxt.sids]
         if self.rates:
             update_pmap_r(self.array, poes, rates, ctxt.probs_occur,
-                          sidxs, itime)
+                          self.sidx, ctxt.sids, itime)
         else:
             update_pmap_i(self.array, poes, rates, ctxt.probs_occur,
-                          sidxs, itime)
+                          self.sidx, ctxt.sids, itime)
 
     def update_mutex(self, poes, ctxt, itime, mutex_weight):
         """
@@ -445,12 +490,17 @@ class MapArray(object):
         """
         rates = ctxt.occurrence_rate
         probs_occur = fix_probs_occur(ctxt.probs_occur)
-        sidxs = self.sidx[ctxt.sids]
         weights = numpy.array([
             mutex_weight[src_id, rup_id]
             for src_id, rup_id in zip(ctxt.src_id, ctxt.rup_id)])
         update_pmap_m(self.array, poes, rates, probs_occur, weights,
-                      sidxs, itime)
+                      self.sidx, ctxt.sids, itime)
+
+    def update_cluster(self, poes, ctxt):
+        """
+        Update probabilities for ruptures in a cluster
+        """
+        update_pmap_c(self.array, poes, self.sidx, ctxt.sids)
 
     def __invert__(self):
         return self.new(1. - self.array)
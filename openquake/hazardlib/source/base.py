@@ -99,7 +99,17 @@ def poisson_sample(src, eff_num_ses, seed):
                     src.mags[i], src.rakes[i], src.tectonic_region_type,
                     hypo, sfc, src.occur_rates[i], tom)
                 yield rup, rupids[i], num_occ
-        else:  # simple or complex fault
+        elif hasattr(src, 'iter_rupture_blocks'):  # simple or complex fault
+            # sample the occurrences on the rates, build only the
+            # ruptures occurring at least once
+            start = 0
+            for rates, build in src.iter_rupture_blocks():
+                occurs = rng.poisson(rates * tom.time_span * eff_num_ses)
+                for i in occurs.nonzero()[0]:
+                    if start + i < len(rupids):
+                        yield build(i), rupids[start + i], occurs[i]
+                start += len(rates)
+        else:
             ruptures = list(src.iter_ruptures())
             rates = numpy.array([rup.occurrence_rate for rup in ruptures])
             occurs = rng.poisson(rates * tom.time_span * eff_num_ses)
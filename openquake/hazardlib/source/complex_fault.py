@@ -183,6 +183,19 @@ class ComplexFaultSource(ParametricSeismicSource):
         on the whole fault surface.
         """
         step = kwargs.get('step', 1)
+        for _rates, build in self.iter_rupture_blocks(step):
+            for i in range(len(_rates)):
+                yield build(i)
+
+    def iter_rupture_blocks(self, step=1):
+        """
+        :param step: used to reduce the number of ruptures (default 1)
+        :yields:
+            for each magnitude, a pair (rates, build) where rates is an
+            array with the occurrence rates of the ruptures and build(i)
+            builds the i-th rupture; the rates are computed without
+            building the surfaces
+        """
         whole_fault_surface = ComplexFaultSurface.from_fault_data(
             self.edges, self.rupture_mesh_spacing)
         if step > 1:  # do the expensive check only in preclassical
@@ -198,8 +211,12 @@ class ComplexFaultSource(ParametricSeismicSource):
             rupture_slices = _float_ruptures(
                 rupture_area, rupture_length, cell_area, cell_length)
             occurrence_rate = mag_occ_rate / float(len(rupture_slices))
-            for rupture_slice in rupture_slices[::step**2]:
-                mesh = whole_fault_mesh[rupture_slice]
+            rupture_slices = rupture_slices[::step**2]
+
+            def build(i, mag=mag, mag_occ_rate=mag_occ_rate,
+                      occurrence_rate=occurrence_rate,
+                      rupture_slices=rupture_slices):
+                mesh = whole_fault_mesh[rupture_slices[i]]
                 # XXX: use surface centroid as rupture's hypocenter
                 # XXX: instead of point with middle index
                 hypocenter = mesh.get_middle_point()
@@ -212,7 +229,9 @@ class ComplexFaultSource(ParametricSeismicSource):
                     mag, self.rake, self.tectonic_region_type, hypocenter,
                     surface, occurrence_rate, self.temporal_occurrence_model)
                 rup.mag_occ_rate = mag_occ_rate
-                yield rup
+                return rup
+
+            yield numpy.full(len(rupture_slices), occurrence_rate), build
 
     def count_ruptures(self):
         """
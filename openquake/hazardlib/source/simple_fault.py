@@ -19,6 +19,7 @@ Module :mod:`openquake.hazardlib.source.simple_fault` defines
 """
 import copy
 import math
+import numpy
 from openquake.baselib.python3compat import round
 from openquake.hazardlib import mfd
 from openquake.hazardlib.source.base import ParametricSeismicSource
@@ -142,6 +143,19 @@ class SimpleFaultSource(ParametricSeismicSource):
         divided by the number of ruptures that can be placed in a fault.
         """
         step = kwargs.get('step', 1)
+        for _rates, build in self.iter_rupture_blocks(step):
+            for i in range(len(_rates)):
+                yield build(i)
+
+    def iter_rupture_blocks(self, step=1):
+        """
+        :param step: used to reduce the number of ruptures (default 1)
+        :yields:
+            for each magnitude, a pair (rates, build) where rates is an
+            array with the occurrence rates of the ruptures and build(i)
+            builds the i-th rupture; the rates are computed without
+            building the surfaces
+        """
         whole_fault_surface = SimpleFaultSurface.from_fault_data(
             self.fault_trace, self.upper_seismogenic_depth,
             self.lower_seismogenic_depth, self.dip, self.rupture_mesh_spacing)
@@ -149,6 +163,13 @@ class SimpleFaultSource(ParametricSeismicSource):
         mesh_rows, mesh_cols = whole_fault_mesh.shape
         fault_length = float((mesh_cols - 1) * self.rupture_mesh_spacing)
         fault_width = float((mesh_rows - 1) * self.rupture_mesh_spacing)
+        if not len(self.hypo_list) and not len(self.slip_list):
+            hypo_slips = [None]
+        else:
+            hypo_slips = [(hypo, slip) for hypo in self.hypo_list
+                          for slip in self.slip_list]
+            hypo_weights = numpy.array([hs[0][2] for hs in hypo_slips])
+            slip_weights = numpy.array([hs[1][1] for hs in hypo_slips])
 
         for mag, mag_occ_rate in self.get_annual_occurrence_rates()[::step]:
             rup_cols, rup_rows = self._get_rupture_dimensions(
@@ -157,36 +178,40 @@ class SimpleFaultSource(ParametricSeismicSource):
             num_rup_along_width = mesh_rows - rup_rows + 1
             num_rup = num_rup_along_length * num_rup_along_width
             occurrence_rate = mag_occ_rate / float(num_rup)
-            for first_row in range(num_rup_along_width)[::step]:
-                for first_col in range(num_rup_along_length)[::step]:
-                    mesh = whole_fault_mesh[first_row: first_row + rup_rows,
-                                            first_col: first_col + rup_cols]
-
-                    if not len(self.hypo_list) and not len(self.slip_list):
-
-                        hypocenter = mesh.get_middle_point()
-                        occurrence_rate_hypo = occurrence_rate
-                        surface = SimpleFaultSurface(mesh)
-
-                        yield ParametricProbabilisticRupture(
-                            mag, self.rake, self.tectonic_region_type,
-                            hypocenter, surface, occurrence_rate_hypo,
-                            self.temporal_occurrence_model)
-                    else:
-                        for hypo in self.hypo_list:
-                            for slip in self.slip_list:
-                                surface = SimpleFaultSurface(mesh)
-                                hypocenter = surface.get_hypo_location(
-                                    self.rupture_mesh_spacing, hypo[:2])
-                                occurrence_rate_hypo = occurrence_rate * \
-                                    hypo[2] * slip[1]
-                                rupture_slip_direction = slip[0]
-
-                                yield ParametricProbabilisticRupture(
-                                    mag, self.rake, self.tectonic_region_type,
-                                    hypocenter, surface, occurrence_rate_hypo,
-                                    self.temporal_occurrence_model,
-                                    rupture_slip_direction)
+            first_rows = range(num_rup_along_width)[::step]
+            first_cols = range(num_rup_along_length)[::step]
+            if hypo_slips == [None]:
+                rates = numpy.full(len(first_rows) * len(first_cols),
+                                   occurrence_rate)
+            else:  # multiply by the hypocenter and slip weights
+                rates = numpy.tile(
+                    occurrence_rate * hypo_weights * slip_weights,
+                    len(first_rows) * len(first_cols))
+
+            def build(i, mag=mag, occurrence_rate=occurrence_rate,
+                      first_rows=first_rows, first_cols=first_cols,
+                      rup_rows=rup_rows, rup_cols=rup_cols):
+                k, h = divmod(i, len(hypo_slips))
+                r, c = divmod(k, len(first_cols))
+                first_row, first_col = first_rows[r], first_cols[c]
+                mesh = whole_fault_mesh[first_row: first_row + rup_rows,
+                                        first_col: first_col + rup_cols]
+                surface = SimpleFaultSurface(mesh)
+                if hypo_slips[h] is None:
+                    return ParametricProbabilisticRupture(
+                        mag, self.rake, self.tectonic_region_type,
+                        mesh.get_middle_point(), surface, occurrence_rate,
+                        self.temporal_occurrence_model)
+                hypo, slip = hypo_slips[h]
+                hypocenter = surface.get_hypo_location(
+                    self.rupture_mesh_spacing, hypo[:2])
+                occurrence_rate_hypo = occurrence_rate * hypo[2] * slip[1]
+                return ParametricProbabilisticRupture(
+                    mag, self.rake, self.tectonic_region_type,
+                    hypocenter, surface, occurrence_rate_hypo,
+                    self.temporal_occurrence_model, slip[0])
+
+            yield rates, build
 
     def get_fault_surface_area(self):
         """
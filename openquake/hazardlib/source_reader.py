@@ -31,7 +31,9 @@ from openquake.hazardlib.valid import basename, fragmentno
 from openquake.hazardlib.lt import apply_uncertainties
 
 U16 = numpy.uint16
+U32 = numpy.uint32
 TWO16 = 2 ** 16  # 65,536
+TWO20 = 2 ** 20  # 1,048,576
 TWO24 = 2 ** 24  # 16,777,216
 TWO30 = 2 ** 30  # 1,073,741,24
 TWO32 = 2 ** 32  # 4,294,967,296
@@ -507,6 +509,54 @@ def split_by_tom(sources):
     return general.groupby(sources, key).values()
 
 
+def estimate_task_mb(nsites, L, G, M):
+    """
+    Memory model of a classical task, used to determine the tiles.
+
+    :param nsites: number of sites in the tile
+    :param L: total number of intensity measure levels
+    :param G: number of GSIMs of the source group
+    :param M: number of intensity measure types
+    :returns: the estimated peak memory of the task in MB
+    """
+    # the float32 rates, the copy made by .remove_zeros() and the
+    # 12 bytes per rate of the array built by .to_array()
+    rates = nsites * L * G * (4 + 4 + 12)
+    # mean and stddevs (4, G, M, n) for a block of n contexts, where n is
+    # limited by PmapMaker.maxsize, plus the PoEs for a slice of the block
+    maxsize = 8 * TWO20 // (M * G)
+    ctxs = maxsize * (4 * G * M * 8 + 2 * M * G)
+    return (rates + ctxs) / TWO20
+
+
+def get_tiles(N, L, G, M, max_mb, memory_model=False):
+    """
+    :param memory_model: if True, use the memory model estimate_task_mb,
+        otherwise consider only the size of the float32 rates
+    :returns: the number of tiles (float) required to stay below max_mb
+    """
+    if not memory_model:
+        return G * (L * N * 4 / TWO20) / max_mb
+    fixed = estimate_task_mb(0, L, G, M)
+    per_site = estimate_task_mb(1, L, G, M) - fixed
+    # if the fixed part is too large the tasks will use more than max_mb
+    return N * per_site / max(max_mb - fixed, max_mb / 2)
+
+
+def get_max_task_mb():
+    """
+    :returns:
+        a pair (max_mb, memory_model); max_mb is config.memory.pmap_max_mb,
+        unless config.memory.task_mem_fraction is set: then it is that
+        fraction of the memory available per core on the workers and the
+        tiles are determined with the memory model
+    """
+    if config.memory.task_mem_fraction:
+        frac = float(config.memory.task_mem_fraction)
+        return parallel.available_gb() * 1024 * frac, True
+    return float(config.memory.pmap_max_mb), False
+
+
 def _get_csm(full_lt, groups, event_based):
     # 1. extract a single source from multiple sources with the same ID
     # 2. regroup the sources in non-atomic groups by TRT
@@ -714,14 +764,17 @@ class CompositeSourceModel:
                      format(int(tot_weight), int(max_weight), len(srcs)))
         return max_weight
 
-    def split(self, cmakers, sitecol, max_weight, num_chunks=1, tiling=False):
+    def split(self, cmakers, sitecol, max_weight, num_chunks=1, tiling=False,
+              max_task_mb=None):
         """
+        :param max_task_mb: pair (max_mb, memory_model), by default
+                            determined with get_max_task_mb()
         :yields: (cmaker, tilegetters, blocks, splits) for each source group
         """
         N = len(sitecol)
         oq = cmakers[0].oq
-        max_mb = float(config.memory.pmap_max_mb)
-        mb_per_gsim = oq.imtls.size * N * 4 / 1024**2
+        L, M = oq.imtls.size, len(oq.imtls)
+        max_mb, memory_model = max_task_mb or get_max_task_mb()
         # send heavy groups first
         grp_ids = numpy.argsort([sg.weight for sg in self.src_groups])[::-1]
         for cmaker in cmakers[grp_ids]:
@@ -731,8 +784,8 @@ class CompositeSourceModel:
                 # happens in LogicTreeTestCase::test_case_08 since the
                 # point sources are far away as determined in preclassical
                 continue
-            G = len(cmaker.gsims)
-            splits = G * mb_per_gsim / max_mb
+            splits = get_tiles(
+                N, L, len(cmaker.gsims), M, max_mb, memory_model)
             hint = sg.weight / max_weight
             if sg.atomic or tiling:
                 blocks = [None]
@@ -762,7 +815,9 @@ class CompositeSourceModel:
         size = sum(len(val) for val in arr)
         logging.info(f'Storing {general.humansize(size)} '
                      'of CompositeSourceModel')
-        return arr, {}
+        # the checksums are used by the workers to cache the source groups
+        checksums = numpy.array([zlib.adler32(a) for a in arr[:G]], U32)
+        return arr, {'checksums': checksums}
 
     # tested in case_36
     def __fromh5__(self, arr, attrs):
@@ -26,7 +26,8 @@ import unittest
 import numpy
 
 from openquake.hazardlib.contexts import simple_cmaker
-from openquake.hazardlib.calc.conditioned_gmfs import get_mean_covs
+from openquake.hazardlib.calc.conditioned_gmfs import (
+    get_mean_covs, get_cholesky)
 from openquake.hazardlib.tests.calc import \
     _conditioned_gmfs_test_data as test_data
 
@@ -314,6 +315,27 @@ class SetUSGSTestCase(unittest.TestCase):
                           case_name)
 
 
+class GetCholeskyTestCase(unittest.TestCase):
+    def test(self):
+        # the draws with the precomputed factors are the same as the
+        # ones of multivariate_normal
+        rng = numpy.random.default_rng(42)
+        G, M, N, E = 2, 3, 20, 10
+        A = rng.random((G, M, N, N))
+        tau = .1 * A @ A.transpose(0, 1, 3, 2)
+        phi = numpy.eye(N) * .2 + tau
+        cov = tau + phi + numpy.eye(N) * 1E-12
+        mu = rng.random(N)
+        chol = get_cholesky(tau.copy(), phi, 1E-12)
+        for g in range(G):
+            for m in range(M):
+                exp = numpy.random.default_rng(g).multivariate_normal(
+                    mu, cov[g, m], size=E, method="cholesky")
+                got = mu + numpy.random.default_rng(g).standard_normal(
+                    (E, N)) @ chol[g, m].T
+                numpy.testing.assert_array_equal(got, exp)
+
+
 # Functions useful for debugging purposes. Recreates the plots on
 # https://usgs.github.io/shakemap/manual4_0/tg_verification.html
 # Original code is from the ShakeMap plotting modules
@@ -17,6 +17,10 @@
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import sys
+import time
+import tempfile
+import importlib
 import unittest
 import numpy
 
@@ -25,7 +29,8 @@ from openquake.hazardlib import site
 from openquake.hazardlib.pmf import PMF
 from openquake.hazardlib.const import TRT
 from openquake.hazardlib.tom import PoissonTOM
-from openquake.hazardlib.contexts import Effect, ContextMaker, get_distances
+from openquake.hazardlib.contexts import (
+    Effect, ContextMaker, MeanStdCache, get_distances)
 from openquake.hazardlib import valid
 from openquake.hazardlib.geo.surface import SimpleFaultSurface as SFS
 from openquake.hazardlib.source.multi_fault import save_and_split
@@ -363,3 +368,111 @@ class PlanarDistancesTestCase(unittest.TestCase):
         # test att_curves which are functions N-distances -> (G, M, N) arrays
         mea, sig, tau, phi = cm.get_att_curves(s, msr, mag)
         aac(mea([100., 200.]), [[[-6.21035514, -7.8108702]]])  # shp (1, 1, 2)
+
+
+class MeanStdCacheTestCase(unittest.TestCase):
+    def test(self):
+        s = site.Site(Point(0, 0), vs30=760,
+                      vs30measured=False, z1pt0=20, z2pt5=30)
+        rup = get_planar(s, WC1994(), 5., 1., 0., 90., 45,
+                         TRT.ACTIVE_SHALLOW_CRUST)
+        [gsim] = gsims = [AbrahamsonEtAl2014()]
+        cm = ContextMaker(TRT.ACTIVE_SHALLOW_CRUST, gsims,
+                          dict(imtls={'PGA': [], 'SA(1.0)': []}))
+        ctx = cm.from_planar(rup, hdist=100, step=5)
+        N = len(ctx)
+        expected = cm._get_4MN([ctx], gsim)  # shape (4, M, N)
+
+        cachedir = tempfile.mkdtemp()
+        cache = MeanStdCache(1E6, cachedir)
+        aac(cache.get(cm, [ctx], gsim), expected)
+        self.assertEqual(cm.miss_mon.counts, N)
+        aac(cache.get(cm, [ctx], gsim), expected)
+        self.assertEqual(cm.hit_mon.counts, N)
+
+        # reading the values saved on disk from a new cache
+        cache.flush()
+        cache2 = MeanStdCache(1E6, cachedir)
+        cm.init_monitoring(cm.monitor)
+        aac(cache2.get(cm, [ctx], gsim), expected)
+        self.assertEqual(cm.hit_mon.counts, N)
+        self.assertEqual(cm.miss_mon.counts, 0)
+
+        # rounding the context parameters
+        cm.mean_std_cache_level = 1
+        aac(cache2.get(cm, [ctx], gsim), expected, rtol=1E-2)
+
+        # a cache too small does not store anything
+        cache3 = MeanStdCache(1000)
+        aac(cache3.get(cm, [ctx], gsim), expected, rtol=1E-2)
+        self.assertEqual(cache3.nbytes, 0)
+
+    def test_disk(self):
+        s = site.Site(Point(0, 0), vs30=760,
+                      vs30measured=False, z1pt0=20, z2pt5=30)
+        rup = get_planar(s, WC1994(), 5., 1., 0., 90., 45,
+                         TRT.ACTIVE_SHALLOW_CRUST)
+        [gsim] = gsims = [AbrahamsonEtAl2014()]
+        cm = ContextMaker(TRT.ACTIVE_SHALLOW_CRUST, gsims,
+                          dict(imtls={'PGA': []}))
+        ctx = cm.from_planar(rup, hdist=100, step=5)
+        cachedir = tempfile.mkdtemp()
+
+        # the values computed by two tasks are merged in a single file
+        for ctxs in ([ctx[:10]], [ctx]):
+            cache = MeanStdCache(1E6, cachedir)
+            cache.get(cm, ctxs, gsim)
+            cache.flush()
+        [fname] = os.listdir(cachedir)
+        with numpy.load(os.path.join(cachedir, fname)) as npz:
+            self.assertEqual(len(npz['skeys']), len(ctx))
+
+        # the least recently used files are removed
+        size = os.path.getsize(os.path.join(cachedir, fname))
+        cm.mean_std_cache_level = 1  # another entry
+        cache = MeanStdCache(1E6, cachedir, maxdisk=size * 1.5)
+        cache.get(cm, [ctx], gsim)
+        time.sleep(.01)  # make sure the modification times differ
+        cache.flush()
+        [fname2] = os.listdir(cachedir)
+        self.assertNotEqual(fname2, fname)
+
+    def test_changed_gsim(self):
+        # a GSIM with the same name but different code must miss the cache
+        s = site.Site(Point(0, 0), vs30=760,
+                      vs30measured=False, z1pt0=20, z2pt5=30)
+        rup = get_planar(s, WC1994(), 5., 1., 0., 90., 45,
+                         TRT.ACTIVE_SHALLOW_CRUST)
+        tmpdir = tempfile.mkdtemp()
+        code = '''import numpy
+from openquake.hazardlib.gsim.abrahamson_2014 import (
+    AbrahamsonEtAl2014)
+
+class ChangingGMPE(AbrahamsonEtAl2014):
+    def compute(self, ctx: numpy.recarray, imts, mean, sig, tau, phi):
+        super().compute(ctx, imts, mean, sig, tau, phi)
+        mean += %s
+'''
+        fname = os.path.join(tmpdir, 'changing_gmpe.py')
+        cachedir = tempfile.mkdtemp()
+        sys.path.insert(0, tmpdir)
+        try:
+            means = []
+            for delta in ('0.', '.1'):
+                with open(fname, 'w') as f:
+                    f.write(code % delta)
+                sys.modules.pop('changing_gmpe', None)
+                importlib.invalidate_caches()
+                gsim = importlib.import_module('changing_gmpe').ChangingGMPE()
+                cm = ContextMaker(TRT.ACTIVE_SHALLOW_CRUST, [gsim],
+                                  dict(imtls={'PGA': []}))
+                ctx = cm.from_planar(rup, hdist=100, step=5)
+                cache = MeanStdCache(1E6, cachedir)  # shared on disk
+                means.append(cache.get(cm, [ctx], gsim)[0])
+                cache.flush()
+                self.assertEqual(cm.hit_mon.counts, 0)
+                self.assertEqual(cm.miss_mon.counts, len(ctx))
+        finally:
+            sys.path.remove(tmpdir)
+            sys.modules.pop('changing_gmpe', None)
+        aac(means[1] - means[0], .1)
@@ -148,6 +148,48 @@ class JB2009ApplyCorrelationTestCase(unittest.TestCase):
              decimal=6)
 
 
+class JB2009VecchiaTestCase(unittest.TestCase):
+    # a 20x20 grid of sites spaced by ~2 km
+    lons, lats = numpy.meshgrid(numpy.arange(20) * .02, numpy.arange(20) * .02)
+    SITECOL = SiteCollection([Site(Point(lon, lat), 760, 100, 5)
+                              for lon, lat in zip(lons.flat, lats.flat)])
+
+    def get_cov(self, cormo, sites):
+        # covariance implied by the correlation model
+        res = cormo.apply_correlation(sites, SA(0.3), numpy.eye(len(sites)))
+        return res @ res.T
+
+    def test_exact(self):
+        # with all the preceding sites as neighbors the approximation is exact
+        cormo = JB2009CorrelationModel(False, 'vecchia', num_neighbors=399)
+        exp = JB2009CorrelationModel(False)._get_correlation_matrix(
+            self.SITECOL, SA(0.3))
+        aaae(self.get_cov(cormo, self.SITECOL), exp)
+
+    def test_accuracy(self):
+        dense = JB2009CorrelationModel(False)
+        exp = self.get_cov(dense, self.SITECOL)
+        # the error decreases with the number of neighbors
+        for m, maxerr in [(5, .08), (10, .03), (30, .006)]:
+            cormo = JB2009CorrelationModel(False, 'vecchia', num_neighbors=m)
+            cov = self.get_cov(cormo, self.SITECOL)
+            self.assertLess(numpy.abs(cov - exp).max(), maxerr)
+
+    def test_filtered_sitecol(self):
+        # the vecchia method uses the correlation of the filtered sites
+        sids = numpy.arange(0, 400, 3)
+        filtered = self.SITECOL.filtered(sids)
+        cormo = JB2009CorrelationModel(False, 'vecchia', num_neighbors=132)
+        exp = JB2009CorrelationModel(False)._get_correlation_matrix(
+            filtered, SA(0.3))
+        aaae(self.get_cov(cormo, filtered), exp)
+        self.assertEqual(len(cormo.cache), 1)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            JB2009CorrelationModel(False, 'sparse')
+
+
 class HM2018CorrelationMatrixTestCase(unittest.TestCase):
     SITECOL = SiteCollection([Site(Point(2, -40), 1, 1, 1),
                               Site(Point(2, -40.1), 1, 1, 1),
@@ -20,7 +20,7 @@ import unittest
 import toml
 import numpy as np
 from openquake.hazardlib.gsim.coeffs_table import CoeffsTable
-from openquake.hazardlib.imt import SA
+from openquake.hazardlib.imt import PGA, SA
 
 
 class TestGetCoefficient(unittest.TestCase):
@@ -85,3 +85,15 @@ a3 = 0.9
         expected_pof = np.array([0.1, 0.5, 1., 10.0,])
         np.testing.assert_array_equal(pof, expected_pof)
         np.testing.assert_array_equal(cff, expected)
+
+    def test_get_array(self):
+        imts = [PGA(), SA(0.01), SA(0.02)]
+        arr = self.ctab.get_array(imts)
+        for rec, imt in zip(arr, imts):
+            np.testing.assert_array_equal(list(rec), list(self.ctab[imt]))
+        # the array is cached; the IMTs can be passed as strings too
+        self.assertIs(self.ctab.get_array(['PGA', 'SA(0.01)', 'SA(0.02)']),
+                      arr)
+        # the cache is invalidated when the coefficients are updated
+        self.ctab |= CoeffsTable.fromtoml('["SA(0.01)"]\na1 = 0.11')
+        self.assertEqual(self.ctab.get_array(imts)['a1'][1], 0.11)
@@ -26,7 +26,7 @@ import pandas
 import fiona
 from shapely import geometry, prepare, contains_xy
 
-from openquake.baselib import hdf5, general, config
+from openquake.baselib import hdf5, general, config, parallel
 from openquake.baselib.node import Node, context
 from openquake.baselib.python3compat import encode, decode
 from openquake.hazardlib import valid, nrml, geo, InvalidFile
@@ -45,6 +45,7 @@ OCC_FIELDS = ('day', 'night', 'transit')
 ANR_FIELDS = {'area', 'number', 'residents'}
 VAL_FIELDS = {'structural', 'nonstructural', 'contents',
               'business_interruption'}
+CSV_BLOCKSIZE = 100 * 1024 ** 2  # exposure files are read in blocks of 100 MB
 
 
 def to_mmi(value):
@@ -212,8 +213,8 @@ class TagCollection(object):
         :param assets_df: DataFrame of assets
         :returns: indices associated to the tag, from 1 to num_tags
         """
-        vals = assets_df[tagname].to_numpy()
-        uniq, inv = numpy.unique(vals, return_inverse=True)
+        # hash-based, much faster than numpy.unique on object arrays
+        inv, uniq = pandas.factorize(assets_df[tagname].to_numpy(), sort=True)
         dic = {u: i for i, u in enumerate(uniq, 1)}
         getattr(self, tagname + '_idx').update(dic)
         getattr(self, tagname).extend(uniq)
@@ -856,6 +857,24 @@ def check_exposure_for_infr_conn_analysis(df, fname):
             f' the value "TAZ" and either "source" or "demand".')
 
 
+def read_csv_block(fname, block, conv, rename, oqfields, errors,
+                   monitor=None):
+    """
+    Read a block of lines of an exposure CSV file
+
+    :returns: a list with a triple (fname, block start, DataFrame)
+    """
+    df = hdf5.read_csv(fname, conv, rename, errors=errors, index='id',
+                       block=block)
+    asset = os.environ.get('OQ_DEBUG_ASSET')
+    if asset:
+        df = df[df.index == asset]
+    add_dupl_fields(df, oqfields)
+    df['lon'] = numpy.round(df.lon, 5)
+    df['lat'] = numpy.round(df.lat, 5)
+    return [(fname, block[0] if block else 0, df)]
+
+
 def read_exp_df(fname, calculation_mode='', ignore_missing_costs=(),
                 check_dupl=True, asset_prefix='',
                 tagcol=None, errors=None, infr_conn_analysis=False,
@@ -1191,17 +1210,35 @@ class Exposure(object):
             rename[f] = 'value-' + f
         for f in OCC_FIELDS:
             rename[f] = 'occupants_' + f
+        allargs = []
+        for fname in self.datafiles:
+            # a file without data lines has no blocks: it is read in full,
+            # so that the empty DataFrame is returned and checked later
+            blocks = (hdf5.csv_blocks(fname, CSV_BLOCKSIZE)
+                      if fname.endswith('.csv') else [])
+            for block in blocks or [None]:
+                allargs.append((fname, block, conv, rename, oqfields, errors))
+        if not allargs:
+            raise InvalidFile('%s: no asset files' % self.datafiles)
+        t0 = time.time()
+        if len(allargs) > 1:  # read the blocks in parallel
+            triples = parallel.Starmap(read_csv_block, allargs).reduce(acc=[])
+            parallel.Starmap.shutdown()  # save memory
+        else:
+            triples = read_csv_block(*allargs[0])
+        # NB: the blocks are not stored incrementally, since the assets
+        # are needed in memory anyway to build the AssetCollection; the
+        # blocks of a file are released as soon as they are concatenated
+        blocks_by_file = general.AccumDict(accum=[])
+        for fname, start, df in sorted(triples, key=lambda tri: tri[1]):
+            blocks_by_file[fname].append(df)  # sorted by block
+        del triples
         for fname in self.datafiles:
-            t0 = time.time()
-            df = hdf5.read_csv(fname, conv, rename, errors=errors, index='id')
-            asset = os.environ.get('OQ_DEBUG_ASSET')
-            if asset:
-                df = df[df.index == asset]
-                if len(df) == 0:
-                    continue
-            add_dupl_fields(df, oqfields)
-            df['lon'] = numpy.round(df.lon, 5)
-            df['lat'] = numpy.round(df.lat, 5)
+            blocks = blocks_by_file.pop(fname)
+            df = blocks[0] if len(blocks) == 1 else pandas.concat(blocks)
+            del blocks
+            if os.environ.get('OQ_DEBUG_ASSET') and len(df) == 0:
+                continue
             sa = float(os.environ.get('OQ_SAMPLE_ASSETS', 0))
             if sa:
                 df = general.random_filter(df, sa)
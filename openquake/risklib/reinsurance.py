@@ -21,7 +21,7 @@ import logging
 import pandas as pd
 import numpy as np
 from openquake.baselib import hdf5
-from openquake.baselib.general import BASE183, fast_agg2, gen_slices
+from openquake.baselib.general import BASE183, gen_slices
 from openquake.baselib.performance import compile, Monitor
 from openquake.baselib.writers import scientificformat
 from openquake.hazardlib import nrml, InvalidFile
@@ -281,50 +281,63 @@ def apply_treaty(cession, retention, deduc, capacity):
                 cession[i] = overmax
 
 
-def claim_to_cessions(claim, policy, treaty_df):
+@compile(["(float64[:],float64[:],boolean[:],float64,float64)",
+          "(float64[:],float32[:],boolean[:],float64,float64)"])
+def apply_wxlr(cession, retention, flags, deduc, capacity):
+    # like apply_treaty, but only on the rows with flags[i] True
+    for i in range(len(retention)):
+        if flags[i]:
+            ret = retention[i]
+            overmax = ret - deduc
+            if ret > deduc:
+                if overmax > capacity:
+                    retention[i] = deduc + overmax - capacity
+                    cession[i] = capacity
+                else:
+                    retention[i] = deduc
+                    cession[i] = overmax
+
+
+def build_policy_grps(policy_df, treaty_df):
     """
-    :param claim: an array of claims
-    :param policy: a dictionary corresponding to a specific policy
-    :param treaty_df: dataframe with treaties
-
-    Converts an array of claims into a dictionary of arrays.
+    :param policy_df: policy DataFrame
+    :param treaty_df: treaty DataFrame
+    :returns: an array with the policy_grp of each policy
     """
-    # proportional cessions
-    cols = treaty_df[treaty_df.type == 'prop'].id
-    fractions = [policy[col] for col in cols]
-    assert sum(fractions) <= 1
-    out = {'retention': claim * (1. - sum(fractions)), 'claim': claim}
-    for col, frac in zip(cols, fractions):
-        out[col] = claim * frac
+    keys = np.array([list(treaty_df.code)] * len(policy_df), dtype='U1')
+    for c, (col, typ) in enumerate(zip(treaty_df.id, treaty_df.type)):
+        if typ == 'catxl':
+            keys[policy_df[col].to_numpy() == 0, c] = '.'
+    return np.array([''.join(key) for key in keys])
 
-    # wxlr cessions, totally independent from the overspill
-    wxl = treaty_df[treaty_df.type == 'wxlr']
-    for col, deduc, limit in zip(wxl.id, wxl.deductible, wxl.limit):
-        out[col] = np.zeros(len(claim))
-        if policy[col]:
-            apply_treaty(out[col], out['retention'], deduc, limit - deduc)
 
-    return {k: np.round(v, 6) for k, v in out.items()}
+def line(row, fmt='%d'):
+    return ''.join(scientificformat(val, fmt).rjust(11) for val in row)
 
 
-def build_policy_grp(policy, treaty_df):
+def apply_layer(data, tr, idx, overdict):
     """
-    :param policy: policy dictionary
-    :param treaty_df: treaty DataFrame
-    :returns: the policy_grp for the given policy
+    Apply a catxl or prop treaty to a matrix of cessions of shape (E, 2+T),
+    by changing the retention and cession columns and possibly storing
+    the overspill in the overdict
     """
-    cols = treaty_df.id.to_numpy()
-    codes = treaty_df.code.to_numpy()
-    types = treaty_df.type.to_numpy()
-    key = list(codes)
-    for c, col in enumerate(cols):
-        if types[c] == 'catxl' and policy[col] == 0:
-            key[c] = '.'
-    return ''.join(key)
-
-
-def line(row, fmt='%d'):
-    return ''.join(scientificformat(val, fmt).rjust(11) for val in row)
+    ret = data[:, idx['retention']]
+    cession = data[:, idx[tr.name]]
+    capacity = tr.limit - tr.deductible
+    has_over = False
+    if tr.type == 'catxl':
+        overspill = ret - tr.deductible - capacity
+        has_over = (overspill > 0).any()
+        apply_treaty(cession, ret, tr.deductible, capacity)
+    elif tr.type == 'prop':
+        overspill = cession - capacity
+        over = overspill > 0
+        has_over = over.any()
+        if has_over:
+            ret[over] += cession[over] - tr.limit
+            cession[over] = tr.limit
+    if has_over:
+        overdict['over_' + tr.name] = np.maximum(overspill, 0)
 
 
 def clever_agg(ukeys, datalist, treaty_df, idx, overdict, eids):
@@ -335,48 +348,34 @@ def clever_agg(ukeys, datalist, treaty_df, idx, overdict, eids):
     :param idx: a dictionary treaty.code -> cession index
     :param overdic: a dictionary treaty.code -> overspill array
 
-    Recursively compute cessions and retentions for each treaty.
+    Compute cessions and retentions for each treaty, one layer at the time,
+    by aggregating the policy groups having the same key after each layer.
     Populate the cession dictionary and returns the final retention.
     """
-    if DEBUG:
-        print()
-        print(line(['event_id', 'policy_grp'] + list(idx)))
-        rows = []
+    while not (len(ukeys) == 1 and ukeys[0] == ''):
+        if DEBUG:
+            print()
+            print(line(['event_id', 'policy_grp'] + list(idx)))
+            rows = []
+            for key, data in zip(ukeys, datalist):
+                # printing the losses
+                for eid, row in zip(eids, data):
+                    rows.append([eid, key] + list(row))
+            for row in sorted(rows):
+                print(line(row))
+        newkeys = []
         for key, data in zip(ukeys, datalist):
-            # printing the losses
-            for eid, row in zip(eids, data):
-                rows.append([eid, key] + list(row))
-        for row in sorted(rows):
-            print(line(row))
-    if len(ukeys) == 1 and ukeys[0] == '':
-        return datalist[0]
-    newkeys, newdatalist = [], []
-    for key, data in zip(ukeys, datalist):
-        code = key[0]
-        newkey = key[1:]
-        if code != '.':
-            tr = treaty_df.loc[code]
-            ret = data[:, idx['retention']]
-            cession = data[:, idx[code]]
-            capacity = tr.limit - tr.deductible
-            has_over = False
-            if tr.type == 'catxl':
-                overspill = ret - tr.deductible - capacity
-                has_over = (overspill > 0).any()
-                apply_treaty(cession, ret, tr.deductible, capacity)
-            elif tr.type == 'prop':
-                overspill = cession - capacity
-                over = overspill > 0
-                has_over = (overspill > 0).any()
-                if has_over:
-                    ret[over] += cession[over] - tr.limit
-                    cession[over] = tr.limit
-            if has_over:
-                overdict['over_' + code] = np.maximum(overspill, 0)
-        newkeys.append(newkey)
-        newdatalist.append(data)
-    keys, sums = fast_agg2(newkeys, np.array(newdatalist))
-    return clever_agg(keys, sums, treaty_df, idx, overdict, eids)
+            code = key[0]
+            if code != '.':
+                apply_layer(data, treaty_df.loc[code], idx, overdict)
+            newkeys.append(key[1:])
+        # sum the matrices of the groups with the same key
+        ukeys, inv = np.unique(newkeys, return_inverse=True)
+        sums = np.zeros((len(ukeys),) + datalist[0].shape)
+        for i, data in zip(inv, datalist):
+            sums[i] += data
+        datalist = sums
+    return datalist[0]
 
 
 # tested in reinsurance_test.py
@@ -391,18 +390,64 @@ def by_policy(rbe, pol_dict, treaty_df):
     :returns:
         DataFrame of reinsurance losses by event ID and policy ID
     '''
-    out = {}
-    df = rbe[rbe.agg_id == pol_dict['policy'] - 1]
-    losses = df.loss.to_numpy()
-    ded, lim = pol_dict['deductible'], pol_dict['liability']
+    return by_policies(rbe, pd.DataFrame([pol_dict]), treaty_df)
+
+
+def by_policies(rbe, policy_df, treaty_df):
+    '''
+    :param DataFrame rbe:
+        losses aggregated by policy (agg_id) and event_id
+    :param DataFrame policy_df:
+        Policy parameters, with policy_df.policy integers >= 1
+    :param DataFrame treaty_df:
+        All treaties
+    :returns:
+        DataFrame of reinsurance losses by event ID and policy ID
+    '''
+    policies = policy_df.policy.to_numpy().astype(int)
+    agg_ids = rbe.agg_id.to_numpy()
+    # rows of rbe associated to the policies, ordered by policy
+    pidx = np.full(max(policies.max(), agg_ids.max(initial=0) + 1), -1)
+    pidx[policies - 1] = np.arange(len(policies))
+    pidx = pidx[agg_ids]
+    rows = np.where(pidx >= 0)[0]
+    rows = rows[np.argsort(pidx[rows], kind='stable')]
+    pidx = pidx[rows]
+    losses = rbe.loss.to_numpy()[rows]
+    ded = policy_df.deductible.to_numpy()[pidx].astype(losses.dtype)
+    lim = policy_df.liability.to_numpy()[pidx].astype(losses.dtype)
     claim = scientific.insured_losses(losses, ded, lim)
-    out['event_id'] = df.event_id.to_numpy()
-    out['policy_id'] = np.array([pol_dict['policy']] * len(df), int)
-    out.update(claim_to_cessions(claim, pol_dict, treaty_df))
+    out = {'event_id': rbe.event_id.to_numpy()[rows],
+           'policy_id': policies[pidx]}
+
+    # proportional cessions
+    cols = treaty_df[treaty_df.type == 'prop'].id
+    fractions = np.zeros((len(policies), len(cols)))
+    for c, col in enumerate(cols):
+        fractions[:, c] = policy_df[col].to_numpy()
+    assert (fractions.sum(axis=1) <= 1).all()
+    # float32 claims must stay float32, as when multiplying by a scalar
+    dt = np.result_type(claim.dtype, np.float32)
+    out['retention'] = claim * (1. - fractions.sum(axis=1)[pidx]).astype(dt)
+    out['claim'] = claim
+    for c, col in enumerate(cols):
+        out[col] = claim * fractions[pidx, c].astype(dt)
+
+    # wxlr cessions, totally independent from the overspill
+    wxl = treaty_df[treaty_df.type == 'wxlr']
+    for col, deduc, limit in zip(wxl.id, wxl.deductible, wxl.limit):
+        out[col] = np.zeros(len(claim))
+        flags = policy_df[col].to_numpy()[pidx] != 0
+        apply_wxlr(out[col], out['retention'], flags, deduc, limit - deduc)
+    for col in out:
+        if col not in ('event_id', 'policy_id'):
+            out[col] = np.round(out[col], 6)
+
     nonzero = out['claim'] > 0  # discard zero claims
     rbp = pd.DataFrame({k: out[k][nonzero] for k in out})
     # ex: event_id, policy_id, retention, claim, surplus, quota_shared, wxlr
-    rbp['policy_grp'] = build_policy_grp(pol_dict, treaty_df)
+    grps = build_policy_grps(policy_df, treaty_df)
+    rbp['policy_grp'] = grps[pidx[nonzero]]
     return rbp
 
 
@@ -411,32 +456,33 @@ def by_event(rbp, treaty_df, mon=Monitor()):
     with mon('processing reinsurance by policy', measuremem=True):
         # this is very fast
         tdf = treaty_df.set_index('code')
-        inpcols = ['eid', 'claim'] + [t.id for _, t in tdf.iterrows()
-                                      if t.type != 'catxl']
+        inpcols = ['claim'] + [t.id for _, t in tdf.iterrows()
+                               if t.type != 'catxl']
         outcols = ['retention', 'claim'] + list(tdf.index)
         idx = {col: i for i, col in enumerate(outcols)}
         eids, idxs = np.unique(rbp.event_id.to_numpy(), return_inverse=True)
-        rbp['eid'] = idxs
-        E = len(eids)
+        # factorize is much faster than np.unique for strings
+        gidxs, keys = pd.factorize(rbp.policy_grp, sort=True)
+        E, G = len(eids), len(keys)
         dic = dict(event_id=eids)
-        keys, datalist = [], []
-        for key, grp in rbp.groupby('policy_grp'):
-            logging.info('Processing policy group %r with %d rows',
-                         key, len(grp))
-            data = np.zeros((E, len(outcols)))
-            gb = grp[inpcols].groupby('eid').sum()
-            for i, col in enumerate(inpcols):
-                if i > 0:  # claim, noncat1, ...
-                    data[gb.index, i] = gb[col].to_numpy()
-            data[:, 0] = data[:, 1]  # retention = claim - noncats
-            for c in range(2, len(outcols)):
-                data[:, 0] -= data[:, c]
-            keys.append(key)
-            datalist.append(data)
-        del rbp['eid'], rbp['policy_grp']
+        # aggregate the cessions by policy group and event in a single pass;
+        # NB: the sums are in float64, so the results can differ in the last
+        # digits from the ones obtained by summing the float32 losses
+        data = np.zeros((G, E, len(outcols)))
+        for i, col in enumerate(inpcols, 1):  # claim, noncat1, ...
+            data[:, :, i] = np.bincount(
+                gidxs * E + idxs, rbp[col].to_numpy(), G * E).reshape(G, E)
+        data[:, :, 0] = data[:, :, 1]  # retention = claim - noncats
+        for c in range(2, len(outcols)):
+            data[:, :, 0] -= data[:, :, c]
+        for key, cnt in zip(keys, np.bincount(gidxs)):
+            logging.info('Processing policy group %r with %d rows', key, cnt)
+        keys, datalist = list(keys), data
+        del rbp['policy_grp']
 
     with mon('reinsurance by event', measuremem=True):
-        # this is fast
+        # this is fast: the catxl layers and the overspills are vectorized
+        # on the events, with a Python loop only on the policy groups
         overspill = {}
         res = clever_agg(keys, datalist, tdf, idx, overspill, eids)
 
@@ -457,8 +503,9 @@ def reins_by_policy(dstore, policy_df, treaty_df, loss_id, monitor):
     """
     Task function called by post_risk
     """
+    if len(policy_df) == 0:  # no policies in this block
+        return
     rbe_mon = monitor('reading risk_by_event')
-    policies = [dict(policy) for _, policy in policy_df.iterrows()]
     dfs = []
     with dstore:
         nrows = len(dstore['risk_by_event/agg_id'])
@@ -466,7 +513,6 @@ def reins_by_policy(dstore, policy_df, treaty_df, loss_id, monitor):
             with rbe_mon:
                 rbe_df = dstore.read_df(
                     'risk_by_event', sel={'loss_id': loss_id}, slc=slc)
-            for policy in policies:
-                dfs.append(by_policy(rbe_df, policy, treaty_df))
+            dfs.append(by_policies(rbe_df, policy_df, treaty_df))
     if dfs:
         yield pd.concat(dfs)
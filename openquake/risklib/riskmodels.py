@@ -18,6 +18,7 @@
 import re
 import json
 import copy
+import logging
 import functools
 import collections
 import numpy
@@ -389,7 +390,8 @@ class RiskModel(object):
         damage = scientific.classical_damage(
             ffl, imls, poes, investigation_time=self.investigation_time,
             risk_investigation_time=rtime,
-            steps_per_interval=self.steps_per_interval)
+            steps_per_interval=self.steps_per_interval,
+            cache=getattr(self.compositemodel, 'ffcache', None))
         damages = numpy.array([a['value-number'] * damage
                                for a in assets.to_records()])
         return damages
@@ -408,8 +410,11 @@ class RiskModel(object):
             val = assets['value-' + loss_type].to_numpy()
         asset_df = pandas.DataFrame(dict(aid=assets.index, val=val), sid)
         vf = self.risk_functions[peril][loss_type]
+        # independent random numbers for each peril and loss type
+        idx = (scientific.PERILID[peril] * len(scientific.LOSSTYPE) +
+               scientific.LOSSID[loss_type])
         return vf(asset_df, gmf_df, imt, rndgen,
-                  self.minimum_asset_loss.get(loss_type, 0.))
+                  self.minimum_asset_loss.get(loss_type, 0.), idx)
 
     scenario = ebrisk = scenario_risk = event_based_risk
 
@@ -432,6 +437,8 @@ class RiskModel(object):
         else:
             raise NameError(f'Missing {imt} in gmf_data')
         ffs = self.risk_functions[peril][loss_type]
+        # no FragilityCache here: the GMVs change with the site and the
+        # cache hits are too rare to pay for the keys
         damages = scientific.scenario_damage(ffs, gmvs).T
         return numpy.array([damages] * len(assets))
 
@@ -739,19 +746,29 @@ class CompositeRiskModel(collections.abc.Mapping):
         self.loss_types = sorted(ltypes)
         self.riskids = set()
         self.distributions = set()
+        self.ffcache = scientific.FragilityCache()  # used in classical_damage
+        lut_errors = []
         for riskid, rm in self._riskmodels.items():
             self.riskids.add(riskid)
             rm.compositemodel = self
-            for lt, rf in rm.risk_functions.items():
-                if hasattr(rf, 'distribution_name'):
-                    self.distributions.add(rf.distribution_name)
-                if hasattr(rf, 'init'):  # vulnerability function
-                    if oq.ignore_covs:
-                        rf.covs = numpy.zeros_like(rf.covs)
-                    rf.init()
-                # save the number of nonzero coefficients of variation
-                if hasattr(rf, 'covs') and rf.covs.any():
-                    self.covs += 1
+            for peril, dic in rm.risk_functions.items():
+                for lt, rf in dic.items():
+                    if hasattr(rf, 'distribution_name'):
+                        self.distributions.add(rf.distribution_name)
+                    if hasattr(rf, 'init'):  # vulnerability function
+                        if oq.ignore_covs:
+                            rf.covs = numpy.zeros_like(rf.covs)
+                        rf.init()
+                        if (oq.vulnerability_lookup_size and
+                                rf.distribution_name != 'PM'):
+                            lut_errors.append(
+                                rf.build_lut(oq.vulnerability_lookup_size))
+                    # save the number of nonzero coefficients of variation
+                    if hasattr(rf, 'covs') and rf.covs.any():
+                        self.covs += 1
+        if lut_errors:
+            logging.info('Built %d vulnerability lookup tables, '
+                         'max error=%.2E', len(lut_errors), max(lut_errors))
         self.curve_params = self.make_curve_params()
 
         # possibly set oq.minimum_intensity
@@ -29,8 +29,9 @@ from functools import lru_cache
 import numpy
 import pandas
 from numpy.testing import assert_equal
-from scipy import interpolate, stats
+from scipy import interpolate, stats, special
 from openquake.baselib import hdf5, general
+from openquake.baselib.performance import compile
 
 F64 = numpy.float64
 F32 = numpy.float32
@@ -76,6 +77,7 @@ affectedpop injured
 
 TOTLOSSES = [lt for lt in LOSSTYPE if '+' in lt]
 LOSSID = {lt: i for i, lt in enumerate(LOSSTYPE)}
+PERILID = {peril: i for i, peril in enumerate(PERILTYPE)}
 
 
 def _reduce(nested_dic):
@@ -131,11 +133,35 @@ def fine_graining(points, steps):
     return numpy.concatenate([ls, [points[-1]]])
 
 
+@compile("float64[:, :](float64[:], float64, float64, float64[:, :])")
+def lut_interp(gmvs, logmin, dlog, table):
+    """
+    Interpolate a table uniform in log(IML) with direct index arithmetic.
+
+    :param gmvs: G ground motion values in the range of the table
+    :param logmin: logarithm of the first IML of the table
+    :param dlog: logarithmic step of the table
+    :param table: array of shape (S, C) with the values on the grid
+    :returns: array of shape (G, C)
+    """
+    S, C = table.shape
+    out = numpy.empty((len(gmvs), C))
+    for g, gmv in enumerate(gmvs):
+        t = (numpy.log(gmv) - logmin) / dlog
+        idx = min(max(int(t), 0), S - 2)
+        frac = min(max(t - idx, 0.), 1.)
+        for c in range(C):
+            out[g, c] = table[idx, c] + frac * (
+                table[idx + 1, c] - table[idx, c])
+    return out
+
+
 # sampling functions
 class Sampler(object):
-    def __init__(self, distname, rng, lratios=(), cols=None):
+    def __init__(self, distname, rng, lratios=(), cols=None, idx=0):
         self.distname = distname
         self.rng = rng
+        self.idx = idx  # used by the counter-based generator
         self.arange = numpy.arange(len(lratios))  # for the PM distribution
         self.lratios = lratios  # for the PM distribution
         self.cols = cols  # for the PM distribution
@@ -152,13 +178,15 @@ class Sampler(object):
         means = df['mean'].to_numpy()
         covs = df['cov'].to_numpy()
         eids = df['eid'].to_numpy()
-        return self.rng.lognormal(eids, means, covs)
+        return self.rng.lognormal(
+            eids, means, covs, df['aid'].to_numpy(), self.idx)
 
     def sampleBT(self, df):
         means = df['mean'].to_numpy()
         covs = df['cov'].to_numpy()
         eids = df['eid'].to_numpy()
-        return self.rng.beta(eids, means, covs)
+        return self.rng.beta(
+            eids, means, covs, df['aid'].to_numpy(), self.idx)
 
     def samplePM(self, df):
         eids = df['eid'].to_numpy()
@@ -174,6 +202,7 @@ class Sampler(object):
                     seed=self.rng.master_seed + eid).rvs())
         return self.lratios[pmf]
 
+
 #
 # Input models
 #
@@ -183,6 +212,7 @@ class VulnerabilityFunction(object):
     dtype = numpy.dtype([('iml', F64), ('loss_ratio', F64), ('cov', F64)])
     seed = None  # to be overridden
     kind = 'vulnerability'
+    _lut = None  # (logmin, dlog, table) set by .build_lut
 
     def __init__(self, vf_id, imt, imls, mean_loss_ratios, covs=None,
                  distribution="LN"):
@@ -257,6 +287,50 @@ class VulnerabilityFunction(object):
         self._mlr_i1d = interpolate.interp1d(self.imls, self.mean_loss_ratios)
         self._covs_i1d = interpolate.interp1d(self.imls, self.covs)
 
+    @property
+    def lut(self):
+        """
+        The lookup table built by .build_lut, or None; it is not
+        serialized to JSON since it is rebuilt when reading the model
+        """
+        return self._lut
+
+    def build_lut(self, size):
+        """
+        Build a lookup table with `size` points uniformly spaced in
+        log(IML), to be used in `.interpolate` instead of the exact
+        interpolation. It is not built if the first IML is zero.
+
+        :param size: the number of points in the table
+        :returns: the maximum absolute error on the mean loss ratios and covs
+        """
+        if self.imls[0] <= 0 or size < 2:
+            self._lut = None
+            return 0.
+        logs = numpy.linspace(
+            numpy.log(self.imls[0]), numpy.log(self.imls[-1]), size)
+        imls = numpy.clip(numpy.exp(logs), self.imls[0], self.imls[-1])
+        table = numpy.zeros((size, 2))
+        table[:, 0] = numpy.interp(imls, self.imls, self.mean_loss_ratios)
+        table[:, 1] = numpy.interp(imls, self.imls, self.covs)
+        dlog = (logs[-1] - logs[0]) / (size - 1) or 1.
+        self._lut = (logs[0], dlog, table)
+        return self.lut_error()
+
+    def lut_error(self, num=10_000):
+        """
+        :param num: the number of IMLs where to perform the check
+        :returns: the maximum absolute error on the mean loss ratios and covs
+        """
+        if self.lut is None:
+            return 0.
+        imls = numpy.geomspace(self.imls[0], self.imls[-1], num)
+        imls = numpy.concatenate([imls, self.imls])
+        exact = numpy.array([
+            numpy.interp(imls, self.imls, self.mean_loss_ratios),
+            numpy.interp(imls, self.imls, self.covs)]).T
+        return numpy.abs(lut_interp(imls, *self.lut) - exact).max()
+
     def interpolate(self, gmf_df, col):
         """
         :param gmf_df:
@@ -273,8 +347,13 @@ class VulnerabilityFunction(object):
             gmvs, [gmvs > self.imls[-1]], [self.imls[-1], lambda x: x])
         ok = gmvs_curve >= self.imls[0]  # indices over the minimum
         curve_ok = gmvs_curve[ok]
-        dic['mean'][ok] = self._mlr_i1d(curve_ok)
-        dic['cov'][ok] = self._cov_for(curve_ok)
+        if self.lut is not None:  # fast lane
+            mean_cov = lut_interp(curve_ok.astype(F64), *self.lut)
+            dic['mean'][ok] = mean_cov[:, 0]
+            dic['cov'][ok] = mean_cov[:, 1]
+        else:
+            dic['mean'][ok] = self._mlr_i1d(curve_ok)
+            dic['cov'][ok] = self._cov_for(curve_ok)
         return pandas.DataFrame(dic, gmf_df.sid)
 
     def survival(self, loss_ratio, mean, stddev):
@@ -299,12 +378,14 @@ class VulnerabilityFunction(object):
         else:
             raise NotImplementedError(self.distribution_name)
 
-    def __call__(self, asset_df, gmf_df, col, rng=None, minloss=0):
+    def __call__(self, asset_df, gmf_df, col, rng=None, minloss=0, idx=0):
         """
         :param asset_df: a DataFrame with A assets
         :param gmf_df: a DataFrame of GMFs for the given assets
         :param col: GMF column associated to the IMT (i.e. "gmv_0")
         :param rng: a MultiEventRNG or None
+        :param minloss: losses below this value are discarded
+        :param idx: index of the random numbers, i.e. of the loss type
         :returns: a DataFrame with columns eid, aid, loss
         """
         if asset_df is None:  # in the tests
@@ -317,7 +398,7 @@ class VulnerabilityFunction(object):
             lratios = ()
             cols = None
         df = ratio_df.join(asset_df, how='inner')
-        sampler = Sampler(self.distribution_name, rng, lratios, cols)
+        sampler = Sampler(self.distribution_name, rng, lratios, cols, idx)
         covs = not hasattr(self, 'covs') or self.covs.any()
         losses = sampler.get_losses(df, covs)
         ok = losses > minloss
@@ -393,7 +474,7 @@ class VulnerabilityFunction(object):
 
     def __getstate__(self):
         return (self.id, self.imt, self.imls, self.mean_loss_ratios,
-                self.covs, self.distribution_name, self.retro)
+                self.covs, self.distribution_name, self.retro, self.lut)
 
     def __setstate__(self, state):
         self.id = state[0]
@@ -403,6 +484,8 @@ class VulnerabilityFunction(object):
         self.covs = state[4]
         self.distribution_name = state[5]
         self.retro = state[6]
+        if len(state) > 7:  # the lookup table is shipped to the workers
+            self._lut = state[7]
         self.init()
 
     def _check_vulnerability_data(self, imls, loss_ratios, covs, distribution):
@@ -807,6 +890,78 @@ def _alpha_beta(mean, stddev):
     return c * mean ** 2, c * (mean - mean ** 2)
 
 
+# Philox4x32-10 by Salmon et al. (2011), "Parallel Random Numbers: As Easy
+# as 1, 2, 3"; all the arithmetic is done on uint64 to avoid overflows
+PHILOX_M0 = numpy.uint64(0xD2511F53)
+PHILOX_M1 = numpy.uint64(0xCD9E8D57)
+PHILOX_W0 = numpy.uint64(0x9E3779B9)
+PHILOX_W1 = numpy.uint64(0xBB67AE85)
+MASK32 = numpy.uint64(0xFFFFFFFF)
+SHIFT32 = numpy.uint64(32)
+
+
+@compile("UniTuple(uint64, 4)(uint64, uint64, uint64, uint64, "
+         "uint64, uint64)")
+def philox4x32(c0, c1, c2, c3, k0, k1):
+    """
+    :returns: 4 random 32 bit integers for the given counter and key
+    """
+    for _ in range(10):
+        p0 = PHILOX_M0 * c0
+        p1 = PHILOX_M1 * c2
+        c0, c1, c2, c3 = ((p1 >> SHIFT32) ^ c1 ^ k0, p1 & MASK32,
+                          (p0 >> SHIFT32) ^ c3 ^ k1, p0 & MASK32)
+        k0 = (k0 + PHILOX_W0) & MASK32
+        k1 = (k1 + PHILOX_W1) & MASK32
+    return c0, c1, c2, c3
+
+
+@compile("float64(uint64, uint64, uint64, uint64, uint64)")
+def philox_uniform(seed, eid, aid, idx, stream):
+    """
+    :returns: a random number in the open interval (0, 1), depending
+              only on the seed, the event, the asset, the index and the stream
+    """
+    x0, x1, _, _ = philox4x32(eid, aid, idx, stream, seed & MASK32,
+                              (seed >> SHIFT32) & MASK32)
+    # 53 random bits, shifted by half a unit to exclude 0
+    return ((x0 >> numpy.uint64(5)) * 67108864. +
+            (x1 >> numpy.uint64(6)) + .5) / 9007199254740992.
+
+
+@compile("float64[:](uint64, uint32[:], uint32[:], uint32[:], uint64)")
+def philox_uniforms(seed, eids, aids, idxs, stream):
+    """
+    Vectorized version of :func:`philox_uniform`
+    """
+    out = numpy.empty(len(eids))
+    for i in range(len(eids)):
+        out[i] = philox_uniform(seed, eids[i], aids[i], idxs[i], stream)
+    return out
+
+
+@compile("void(uint64, uint32[:], uint32[:], float64[:, :, :], uint32[:], "
+         "uint32[:, :, :])")
+def philox_dmg_dist(seed, eids, aids, fractions, numbers, ddd):
+    """
+    Populate the discrete damage distribution `ddd` of shape (A, E, D)
+    by assigning a damage state to each building of each asset
+    """
+    A, E, D = fractions.shape
+    for a in range(A):
+        for e in range(E):
+            frac = fractions[a, e]
+            tot = frac.sum()
+            for k in range(numbers[a]):
+                u = philox_uniform(seed, eids[e], aids[a], k, 2) * tot
+                d = 0
+                cum = frac[0]
+                while u >= cum and d < D - 1:
+                    d += 1
+                    cum += frac[d]
+                ddd[a, e, d] += 1
+
+
 class MultiEventRNG(object):
     """
     An object ``MultiEventRNG(master_seed, eids, asset_correlation=0)``
@@ -826,11 +981,32 @@ class MultiEventRNG(object):
     >>> fractions = numpy.array([[[.8, .1, .1]]])
     >>> rng.discrete_dmg_dist([0], fractions, [10])
     array([[[8, 2, 0]]], dtype=uint32)
-    """
-    def __init__(self, master_seed, eids, asset_correlation=0):
+
+    With ``counter_based=True`` the numbers are generated with a stateless
+    Philox generator keyed by (master_seed, eid, aid, idx), so that they do
+    not depend on the order of the calls nor on how the events and the
+    assets are split across tasks, and they are generated in a vectorized
+    way; the index `idx` (i.e. the loss type) gives independent numbers
+    for the same event and asset:
+
+    >>> rng = MultiEventRNG(42, [0, 1, 2], counter_based=True)
+    >>> aids = numpy.array([0, 1, 2])
+    >>> rng.lognormal(eids, means, covs, aids)
+    array([0.62259428, 0.44524078, 0.50276804])
+    >>> rng.lognormal(eids[::-1], means, covs, aids[::-1])
+    array([0.50276804, 0.44524078, 0.62259428])
+    >>> rng.lognormal(eids, means, covs, aids, idx=1)
+    array([0.44441265, 0.56261777, 0.48248331])
+    """
+    def __init__(self, master_seed, eids, asset_correlation=0,
+                 counter_based=False):
         self.master_seed = master_seed
         self.asset_correlation = asset_correlation
+        self.counter_based = counter_based
+        self.eids = U32(eids)
         self.rng = {}
+        if counter_based:
+            return
         for eid in eids:
             # NB: int below is necessary for totally mysterious reasons:
             # a calculation on cluster1 #41904 failed with a floating
@@ -847,25 +1023,45 @@ class MultiEventRNG(object):
                 return eps
         return self.rng[eid].normal()
 
-    def lognormal(self, eids, means, covs):
+    def _uniforms(self, eids, aids, idx, stream):
+        # uniform numbers for the given event and asset IDs and index;
+        # when the asset IDs are missing the row indices are used
+        eids = U32(eids)
+        if self.asset_correlation:
+            aids = numpy.zeros(len(eids), U32)
+        elif aids is None:
+            aids = numpy.arange(len(eids), dtype=U32)
+        idxs = numpy.full(len(eids), idx, U32)
+        return philox_uniforms(U64(self.master_seed), eids, U32(aids),
+                               idxs, U64(stream))
+
+    def lognormal(self, eids, means, covs, aids=None, idx=0):
         """
         :param eids: event IDs
         :param means: array of floats in the range 0..1
         :param covs: array of floats with the same shape
+        :param aids: asset IDs (used only if counter_based is set)
+        :param idx: index of the numbers (used only if counter_based is set)
         :returns: array of floats
         """
-        corrcache = {}
-        eps = numpy.array([self._get_eps(eid, corrcache) for eid in eids])
+        if self.counter_based:
+            eps = special.ndtri(self._uniforms(eids, aids, idx, 0))
+        else:
+            corrcache = {}
+            eps = numpy.array(
+                [self._get_eps(eid, corrcache) for eid in eids])
         sigma = numpy.sqrt(numpy.log(1 + covs ** 2))
         div = numpy.sqrt(1 + covs ** 2)
         return means * numpy.exp(eps * sigma) / div
 
     # NB: asset correlation is ignored
-    def beta(self, eids, means, covs):
+    def beta(self, eids, means, covs, aids=None, idx=0):
         """
         :param eids: event IDs
         :param means: array of floats in the range 0..1
         :param covs: array of floats with the same shape
+        :param aids: asset IDs (used only if counter_based is set)
+        :param idx: index of the numbers (used only if counter_based is set)
         :returns: array of floats following the beta distribution
 
         This function works properly even when some or all of the stddevs
@@ -879,31 +1075,52 @@ class MultiEventRNG(object):
         res = numpy.array(means)
         ok = (means != 0) & (covs != 0)  # nonsingular values
         alpha, beta = _alpha_beta(means[ok], means[ok] * covs[ok])
+        if self.counter_based:
+            if aids is not None:
+                aids = numpy.asarray(aids)[ok]
+            # inverse transform sampling
+            res[ok] = special.betaincinv(
+                alpha, beta, self._uniforms(eids[ok], aids, idx, 1))
+            return res
         res[ok] = [self.rng[eid].beta(alpha[i], beta[i])
                    for i, eid in enumerate(eids[ok])]
         return res
 
-    def discrete_dmg_dist(self, eids, fractions, numbers):
+    def discrete_dmg_dist(self, eids, fractions, numbers, aids=None):
         """
-        Converting fractions into discrete damage distributions using bincount
-        and random.choice.
+        Converting fractions into discrete damage distributions by
+        assigning a damage state to each building; all the assets are
+        processed together, event by event.
 
         :param eids: E event IDs
         :param fractions: array of shape (A, E, D)
         :param numbers: A asset numbers
+        :param aids: A asset IDs (used only if counter_based is set)
         :returns: array of integers of shape (A, E, D)
         """
         A, E, D = fractions.shape
         assert len(eids) == E, (len(eids), E)
         assert len(numbers) == A, (len(eids), A)
         ddd = numpy.zeros(fractions.shape, U32)
+        if self.counter_based:
+            if aids is None:
+                aids = numpy.arange(A)
+            philox_dmg_dist(U64(self.master_seed), U32(eids), U32(aids),
+                            F64(fractions), U32(numbers), ddd)
+            return ddd
+        # asset index for each building
+        aidx = numpy.repeat(numpy.arange(A), numbers)
         for e, eid in enumerate(eids):
-            choice = self.rng[eid].choice
-            for a, n in enumerate(numbers):
-                frac = fractions[a, e]  # shape D
-                states = choice(D, n, p=frac/frac.sum())  # n states
-                # ex. [0, 0, 0, 1, 0, 0, 0, 1, 0, 0], 8 times 0, 2 times 1
-                ddd[a, e] = numpy.bincount(states, minlength=D)
+            frac = fractions[:, e]  # shape (A, D)
+            # same numbers as calling self.rng[eid].choice(D, n, p) for each
+            # asset, since choice consumes one uniform number per building
+            # and applies a searchsorted on the normalized cumulative sum
+            cdf = F64(frac / frac.sum(axis=1)[:, None]).cumsum(axis=1)
+            cdf /= cdf[:, -1:]
+            uniform = self.rng[eid].random(len(aidx))
+            states = (cdf[aidx] <= uniform[:, None]).sum(axis=1)
+            ddd[:, e] = numpy.bincount(
+                aidx * D + states, minlength=A * D).reshape(A, D)
         return ddd
 
     def boolean_dist(self, probs, num_sims):
@@ -916,8 +1133,15 @@ class MultiEventRNG(object):
         >>> dist.sum(axis=1)  # around 10% and 20% respectively
         array([12., 17.,  0.])
         """
-        E = len(self.rng)
+        E = len(self.eids)
         assert len(probs) == E, (len(probs), E)
+        if self.counter_based:
+            S = num_sims
+            idxs = numpy.tile(numpy.arange(S, dtype=U32), E)
+            u = philox_uniforms(
+                U64(self.master_seed), numpy.repeat(self.eids, S),
+                numpy.zeros(E * S, U32), idxs, U64(3)).reshape(E, S)
+            return F64(u < numpy.array(probs)[:, None])
         booldist = numpy.zeros((E, num_sims))
         for e, eid, prob in zip(range(E), self.rng, probs):
             if prob > 0:
@@ -938,6 +1162,61 @@ CurveParams = collections.namedtuple(
 # Scenario Damage
 #
 
+def _ffkey(ff):
+    # parameters identifying a fragility function
+    if isinstance(ff, FragilityFunctionContinuous):
+        return (ff.mean, ff.stddev, ff.minIML, ff.maxIML, ff.no_damage_limit)
+    return (tuple(ff.imls), tuple(ff.poes), ff.no_damage_limit)
+
+
+class FragilityCache(dict):
+    """
+    Cache of the PoEs of lists of fragility functions, keyed by the
+    parameters of the functions and by the intensity measure levels.
+    It is shared by the loss types and the risk IDs and it is emptied
+    when its size exceeds `maxbytes`. It is never pickled.
+
+    >>> cache = FragilityCache()
+    >>> ffs = [FragilityFunctionContinuous('slight', .2, .1, 0, 0)]
+    >>> imls = numpy.array([.1, .2, .3])
+    >>> cache.get_poes(ffs, imls) is cache.get_poes(ffs, imls.copy())
+    True
+    >>> cache.hits, cache.misses
+    (1, 1)
+    """
+    def __init__(self, maxbytes=10 * 1024 ** 2):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_poes(self, fragility_functions, imls):
+        """
+        :param fragility_functions: a list of D - 1 fragility functions
+        :param imls: an array of E intensity measure levels
+        :returns: an array of (D - 1, E) PoEs
+        """
+        imls = numpy.asarray(imls)
+        key = (tuple(_ffkey(ff) for ff in fragility_functions),
+               imls.dtype.str, imls.tobytes())
+        try:
+            poes = self[key]
+        except KeyError:
+            self.misses += 1
+            poes = numpy.array([ff(imls) for ff in fragility_functions])
+            if self.nbytes + poes.nbytes > self.maxbytes:
+                self.clear()
+                self.nbytes = 0
+            self[key] = poes
+            self.nbytes += poes.nbytes + imls.nbytes
+        else:
+            self.hits += 1
+        return poes
+
+    def __reduce__(self):
+        return self.__class__, (self.maxbytes,)
+
+
 def scenario_damage(fragility_functions, gmvs):
     """
     :param fragility_functions: a list of D - 1 fragility functions
@@ -981,7 +1260,7 @@ def probability_of_exceedance(afoe, t_risk):
 def classical_damage(
         fragility_functions, hazard_imls, hazard_poes,
         investigation_time, risk_investigation_time,
-        steps_per_interval=1):
+        steps_per_interval=1, cache=None):
     """
     :param fragility_functions:
         a list of fragility functions for each damage state
@@ -995,6 +1274,8 @@ def classical_damage(
         risk investigation time
     :param steps_per_interval:
         steps per interval
+    :param cache:
+        a FragilityCache instance or None
     :returns:
         an array of D probabilities of occurrence where D is the numbers
         of damage states.
@@ -1015,9 +1296,13 @@ def classical_damage(
     afoes = annual_frequency_of_exceedence(poes, investigation_time)
     afoos = pairwise_diff(
         pairwise_mean([afoes[0]] + list(afoes) + [afoes[-1]]))
+    if cache is None:
+        ffpoes = [ff(imls) for ff in fragility_functions]
+    else:
+        ffpoes = cache.get_poes(fragility_functions, imls)
     poes_per_dmgstate = []
-    for ff in fragility_functions:
-        fx = afoos @ ff(imls)
+    for ffpoe in ffpoes:
+        fx = afoos @ ffpoe
         poe_per_dmgstate = 1. - numpy.exp(-fx * risk_investigation_time)
         poes_per_dmgstate.append(poe_per_dmgstate)
     poos = pairwise_diff([1] + poes_per_dmgstate + [0])
@@ -1738,14 +2023,10 @@ class RiskComputer(dict):
             for li, lt in enumerate(self.loss_types):
                 fractions = out[lt]  # shape (A, E, Dc)
                 if rng is None:
-                    for a in range(A):
-                        dd5[p, a, :, li, :D] = fractions[a] * number[a]
+                    dd5[p, :, :, li, :D] = fractions * number[:, None, None]
                 else:
-                    # this is a performance distaster; for instance
-                    # the Messina test in oq-risk-tests becomes 12x
-                    # slower even if it has only 25_736 assets
                     dd5[p, :, :, li, :D] = rng.discrete_dmg_dist(
-                        gmf_df.eid, fractions, number)
+                        gmf_df.eid, fractions, number, adf.index)
 
         if crm:
             csqs = crm.get_consequences()
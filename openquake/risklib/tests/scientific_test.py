@@ -532,6 +532,15 @@ class ClassicalDamageTestCase(unittest.TestCase):
             investigation_time, risk_investigation_time)
         aac(poos, [0.56652127, 0.12513401, 0.1709355, 0.06555033, 0.07185889])
 
+        # sharing the fragility PoEs gives the same results
+        cache = scientific.FragilityCache()
+        for _ in range(2):
+            cpoos = scientific.classical_damage(
+                fragility_functions, hazard_imls, hazard_poes,
+                investigation_time, risk_investigation_time, cache=cache)
+            numpy.testing.assert_equal(cpoos, poos)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
 
 class LossesByEventTestCase(unittest.TestCase):
     def test_convergency(self):
@@ -795,3 +804,116 @@ class RiskComputerTestCase(unittest.TestCase):
         dd1 = dd5[0, 0, 1, 0, 1:]
         aac(dd0, [10, 8, 4, 0])
         aac(dd1, [31, 14, 3, 0], atol=1e-8)
+
+
+def discrete_dmg_dist_loop(rng, eids, fractions, numbers):
+    # the implementation of MultiEventRNG.discrete_dmg_dist used before
+    # the vectorization, with a loop on events and assets
+    A, E, D = fractions.shape
+    ddd = numpy.zeros(fractions.shape, numpy.uint32)
+    for e, eid in enumerate(eids):
+        choice = rng.rng[eid].choice
+        for a, n in enumerate(numbers):
+            frac = fractions[a, e]
+            states = choice(D, n, p=frac/frac.sum())
+            ddd[a, e] = numpy.bincount(states, minlength=D)
+    return ddd
+
+
+class DiscreteDmgDistTestCase(unittest.TestCase):
+    def setUp(self):
+        A, E, D = 500, 20, 5
+        gen = numpy.random.default_rng(42)
+        self.eids = numpy.arange(E) * 7
+        fractions = gen.uniform(size=(A, E, D)).astype(numpy.float32)
+        self.fractions = fractions / fractions.sum(axis=2)[:, :, None]
+        self.numbers = gen.integers(0, 30, A).astype(numpy.uint32)
+
+    def test_same_as_loop(self):
+        rng1 = scientific.MultiEventRNG(42, self.eids)
+        rng2 = scientific.MultiEventRNG(42, self.eids)
+        numpy.testing.assert_equal(
+            rng1.discrete_dmg_dist(self.eids, self.fractions, self.numbers),
+            discrete_dmg_dist_loop(
+                rng2, self.eids, self.fractions, self.numbers))
+
+    def test_counter_based(self):
+        rng = scientific.MultiEventRNG(42, self.eids, counter_based=True)
+        aids = numpy.arange(len(self.numbers))
+        ddd = rng.discrete_dmg_dist(
+            self.eids, self.fractions, self.numbers, aids)
+        numpy.testing.assert_equal(ddd.sum(axis=2).T, [self.numbers] * 20)
+        # independent from the splitting in blocks of assets
+        ddd1 = rng.discrete_dmg_dist(
+            self.eids, self.fractions[:100], self.numbers[:100], aids[:100])
+        numpy.testing.assert_equal(ddd[:100], ddd1)
+        # the average is close to the expected damage distribution
+        avg = ddd.sum(axis=(0, 1)) / self.numbers.sum() / 20
+        aac(avg, self.fractions.mean(axis=(0, 1)), atol=.02)
+
+
+class PhiloxTestCase(unittest.TestCase):
+    def test_known_answers(self):
+        # the philox4x32-10 known answer tests of the Random123 library
+        ones = [0xffffffff] * 6
+        pi = [0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344,
+              0xa4093822, 0x299f31d0]
+        for inp, expected in [
+                ([0] * 6, [0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8]),
+                (ones, [0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd]),
+                (pi, [0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1])]:
+            out = scientific.philox4x32(*map(numpy.uint64, inp))
+            self.assertEqual(list(out), expected)
+
+    def test_independent_loss_types(self):
+        rng = scientific.MultiEventRNG(42, range(1000), counter_based=True)
+        eids = numpy.arange(1000)
+        means = numpy.full(1000, .5)
+        covs = numpy.full(1000, .3)
+        aids = numpy.zeros(1000)
+        ln0 = rng.lognormal(eids, means, covs, aids, idx=0)
+        ln1 = rng.lognormal(eids, means, covs, aids, idx=1)
+        self.assertLess(abs(numpy.corrcoef(ln0, ln1)[0, 1]), .1)
+        bt0 = rng.beta(eids, means, covs, aids, idx=0)
+        bt1 = rng.beta(eids, means, covs, aids, idx=1)
+        self.assertLess(abs(numpy.corrcoef(bt0, bt1)[0, 1]), .1)
+        # the same index gives the same numbers
+        aac(rng.lognormal(eids, means, covs, aids, idx=1), ln1)
+
+
+class VulnerabilityLookupTestCase(unittest.TestCase):
+    def setUp(self):
+        gen = numpy.random.default_rng(42)
+        imls = numpy.geomspace(.01, 3., 30)
+        mlrs = numpy.sort(gen.uniform(0, 1, 30))
+        covs = gen.uniform(0, .5, 30)
+        self.vf = scientific.VulnerabilityFunction(
+            'vf', 'PGA', imls, mlrs, covs)
+        self.vf.init()
+        N = 1_000_000
+        self.gmf_df = pandas.DataFrame(dict(
+            eid=numpy.arange(N), sid=numpy.zeros(N),
+            PGA=numpy.exp(gen.normal(-1.5, 1., N))))
+
+    def test_accuracy(self):
+        exact = self.vf.interpolate(self.gmf_df, 'PGA')
+        err = self.vf.build_lut(10_000)
+        self.assertLess(err, 1E-3)
+        approx = self.vf.interpolate(self.gmf_df, 'PGA')
+        aac(approx['mean'], exact['mean'], atol=err)
+        aac(approx['cov'], exact['cov'], atol=err)
+        # the error decreases with the size of the table
+        self.assertGreater(self.vf.build_lut(100), err)
+
+    def test_pickle(self):
+        self.vf.build_lut(1000)
+        vf = pickle.loads(pickle.dumps(self.vf))
+        self.assertEqual(vf.lut[0], self.vf.lut[0])
+        aac(vf.lut[2], self.vf.lut[2])
+
+    def test_zero_iml(self):
+        vf = scientific.VulnerabilityFunction(
+            'vf', 'PGA', [0, .1, .2], [0, .1, .2], [0, .1, .2])
+        vf.init()
+        self.assertEqual(vf.build_lut(100), 0)
+        self.assertIsNone(vf.lut)
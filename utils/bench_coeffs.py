@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2025, GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+import copy
+import time
+from openquake.baselib import sap
+from openquake.hazardlib import imt as imt_module
+from openquake.hazardlib.gsim.coeffs_table import CoeffsTable
+from openquake.hazardlib.gsim.abrahamson_2014 import AbrahamsonEtAl2014
+from openquake.hazardlib.gsim.boore_2014 import BooreEtAl2014
+from openquake.hazardlib.gsim.campbell_bozorgnia_2014 import (
+    CampbellBozorgnia2014)
+from openquake.hazardlib.gsim.chiou_youngs_2014 import ChiouYoungs2014
+from openquake.hazardlib.gsim.idriss_2014 import Idriss2014
+from openquake.calculators.views import text_table
+
+NGA_WEST2 = [AbrahamsonEtAl2014, BooreEtAl2014, CampbellBozorgnia2014,
+             ChiouYoungs2014, Idriss2014]
+
+
+def timeit(func, table, imts, repeat):
+    t0 = time.time()
+    for _ in range(repeat):
+        func(table, imts)
+    return (time.time() - t0) / repeat * 1E6  # microseconds
+
+
+def by_imt(table, imts):
+    # the usual way to access the coefficients inside GSIM.compute
+    return [table[imt] for imt in imts]
+
+
+def bulk(table, imts):
+    return table.get_array(imts)
+
+
+def main(num_periods: int = 20, repeat: int = 1000):
+    """
+    Compare the extraction of the coefficients IMT by IMT with the bulk
+    extraction of CoeffsTable.get_array for the NGA-West2 GSIMs, both
+    the first time (interpolation) and the following times (cache)
+    """
+    periods = [.01 * 1.3 ** i for i in range(num_periods)]
+    imts = [imt_module.PGA()] + [imt_module.SA(p) for p in periods]
+    rows = []
+    for cls in NGA_WEST2:
+        table = cls.COEFFS
+        assert isinstance(table, CoeffsTable), table
+        first_by_imt = timeit(by_imt, copy.deepcopy(table), imts, 1)
+        first_bulk = timeit(bulk, copy.deepcopy(table), imts, 1)
+        t_by_imt = timeit(by_imt, table, imts, repeat)
+        t_bulk = timeit(bulk, table, imts, repeat)
+        rows.append((cls.__name__, len(imts), first_by_imt, first_bulk,
+                     t_by_imt, t_bulk, t_by_imt / t_bulk))
+    print(text_table(rows, ['gsim', 'M', 'first_by_imt_us', 'first_bulk_us',
+                            'by_imt_us', 'bulk_us', 'speedup'], ext='org'))
+
+
+main.num_periods = 'number of SA periods'
+main.repeat = 'number of repetitions'
+
+if __name__ == '__main__':
+    sap.run(main)
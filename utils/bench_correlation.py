@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2025, GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+import time
+import numpy
+from openquake.baselib import sap
+from openquake.hazardlib.imt import SA
+from openquake.hazardlib.site import SiteCollection
+from openquake.hazardlib.correlation import JB2009CorrelationModel
+from openquake.calculators.views import text_table
+
+
+def get_sitecol(num_sites, spacing):
+    # a square grid of sites with the given spacing in degrees
+    n = int(numpy.ceil(numpy.sqrt(num_sites)))
+    lons, lats = numpy.meshgrid(numpy.arange(n) * spacing,
+                                numpy.arange(n) * spacing)
+    return SiteCollection.from_points(
+        lons.flatten()[:num_sites], lats.flatten()[:num_sites])
+
+
+def bench(cormo, sitecol, eps):
+    t0 = time.time()
+    res = cormo.apply_correlation(sitecol, SA(0.3), eps)
+    return time.time() - t0, res
+
+
+def main(num_events: int = 100, num_neighbors: int = 30,
+         max_dense: int = 10_000, spacing: float = .02):
+    """
+    Compare the time spent in correlating the residuals with the exact
+    Cholesky factor and with the Vecchia approximation, for site
+    collections of increasing size; the accuracy of the approximation
+    is checked in hazardlib/tests/correlation_test.py
+    """
+    rng = numpy.random.default_rng(42)
+    rows = []
+    for num_sites in (1000, 2000, 5000, 10_000, 20_000, 50_000):
+        sitecol = get_sitecol(num_sites, spacing)
+        eps = rng.normal(size=(num_sites, num_events))
+        vecchia = JB2009CorrelationModel(False, 'vecchia', num_neighbors)
+        t_vec, res = bench(vecchia, sitecol, eps)
+        t_cached, _ = bench(vecchia, sitecol, eps)
+        if num_sites <= max_dense:
+            t_dense, _ = bench(JB2009CorrelationModel(False), sitecol, eps)
+        else:  # the dense matrix would use too much memory
+            t_dense = numpy.nan
+        rows.append((num_sites, t_dense, t_vec, t_cached, t_dense / t_vec))
+    print(text_table(rows, ['sites', 'cholesky_time', 'vecchia_time',
+                            'vecchia_cached', 'speedup'], ext='org'))
+
+
+main.num_events = 'number of residuals per site'
+main.num_neighbors = 'number of neighbors of the Vecchia approximation'
+main.max_dense = 'maximum number of sites for the Cholesky method'
+main.spacing = 'spacing of the grid of sites in degrees'
+
+if __name__ == '__main__':
+    sap.run(main)
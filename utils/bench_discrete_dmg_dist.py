@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2025, GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+import time
+import numpy
+from openquake.baselib import sap
+from openquake.risklib.scientific import MultiEventRNG
+from openquake.calculators.views import text_table
+
+
+def discrete_dmg_dist_loop(rng, eids, fractions, numbers):
+    # the implementation used before the vectorization, with a loop
+    # on events and assets
+    A, E, D = fractions.shape
+    ddd = numpy.zeros(fractions.shape, numpy.uint32)
+    for e, eid in enumerate(eids):
+        choice = rng.rng[eid].choice
+        for a, n in enumerate(numbers):
+            frac = fractions[a, e]
+            states = choice(D, n, p=frac/frac.sum())
+            ddd[a, e] = numpy.bincount(states, minlength=D)
+    return ddd
+
+
+def main(num_assets: int = 500, num_events: int = 20, num_states: int = 5):
+    """
+    Compare the number of (asset, event) pairs per second processed by
+    the loop implementation of discrete_dmg_dist and by the vectorized
+    ones (with and without counter based random numbers)
+    """
+    A, E, D = num_assets, num_events, num_states
+    gen = numpy.random.default_rng(42)
+    eids = numpy.arange(E) * 7
+    fractions = gen.uniform(size=(A, E, D)).astype(numpy.float32)
+    fractions /= fractions.sum(axis=2)[:, :, None]
+    numbers = gen.integers(0, 30, A).astype(numpy.uint32)
+    rows = []
+    for name in ('loop', 'vectorized', 'counter_based'):
+        rng = MultiEventRNG(42, eids, counter_based=name == 'counter_based')
+        t0 = time.time()
+        if name == 'loop':
+            discrete_dmg_dist_loop(rng, eids, fractions, numbers)
+        else:
+            rng.discrete_dmg_dist(eids, fractions, numbers)
+        dt = time.time() - t0
+        rows.append((name, dt, A * E / dt))
+    print(text_table(rows, ['implementation', 'time', 'asset_events_per_sec'],
+                     ext='org'))
+
+
+main.num_assets = 'number of assets'
+main.num_events = 'number of events'
+main.num_states = 'number of damage states, including no_damage'
+
+if __name__ == '__main__':
+    sap.run(main)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2025, GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+import time
+import logging
+import numpy
+from openquake.baselib import sap
+from openquake.hazardlib.contexts import get_cmakers
+from openquake.commonlib import readinput
+from openquake.calculators.views import text_table
+
+
+def loop_by_mag(cmaker, ctx):
+    # the algorithm used before the vectorization on the magnitudes
+    ctx.mag = numpy.round(ctx.mag, 3)
+    for mag in numpy.unique(ctx.mag):
+        ctxt = ctx[ctx.mag == mag]
+        for poes, mea, sig, slc in cmaker._gen_poes(ctxt):
+            yield poes.astype(numpy.float64), mea, sig, ctxt[slc]
+
+
+def bench(gen, cmaker, ctxs, repeat):
+    t0 = time.time()
+    for _ in range(repeat):
+        poes = [p for ctx in ctxs for p, _, _, _ in gen(cmaker, ctx)]
+    return (time.time() - t0) / repeat, numpy.concatenate(poes)
+
+
+def main(job_ini, repeat: int = 3):
+    """
+    Compare the vectorized ContextMaker.gen_poes with the loop by magnitude
+    on the given calculation. Use it as
+
+    $ python bench_gen_poes.py demos/hazard/AreaSourceClassicalPSHA/job.ini
+    """
+    logging.basicConfig(level=logging.INFO)
+    oq = readinput.get_oqparam(job_ini)
+    csm = readinput.get_composite_source_model(oq)
+    sitecol = readinput.get_site_collection(oq)
+    oq.mags_by_trt = csm.get_mags_by_trt(oq.maximum_distance)
+    cmakers = get_cmakers(csm.src_groups, csm.full_lt, oq)
+    rows = []
+    for cmaker, sg in zip(cmakers, csm.src_groups):
+        srcs = [s for src in sg for s in src]
+        ctxs = cmaker.from_srcs(srcs, sitecol)
+        if not ctxs:
+            continue
+        t_old, old = bench(loop_by_mag, cmaker, ctxs, repeat)
+        t_new, new = bench(cmaker.__class__.gen_poes, cmaker, ctxs, repeat)
+        nmags = sum(len(numpy.unique(ctx.mag)) for ctx in ctxs)
+        rows.append((cmaker.grp_id, sum(len(ctx) for ctx in ctxs), nmags,
+                     cmaker.split_by_mag, t_old, t_new, t_old / t_new,
+                     numpy.abs(old - new).max()))
+    print(text_table(rows, ['grp_id', 'num_ctxs', 'num_mags', 'split_by_mag',
+                            'loop_time', 'vect_time', 'speedup', 'max_diff'],
+                     ext='org'))
+
+
+main.job_ini = 'path to a job.ini file'
+main.repeat = 'number of repetitions'
+
+if __name__ == '__main__':
+    sap.run(main)
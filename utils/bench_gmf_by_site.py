@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2025, GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import time
+import numpy
+from openquake.baselib import sap, hdf5, general
+from openquake.commonlib.calc import store_gmf_by_site, read_gmf_by_site
+from openquake.calculators.views import text_table
+
+U32 = numpy.uint32
+F32 = numpy.float32
+
+
+def create_gmf_data(h5, num_sites, num_events, num_imts, frac, rng):
+    # event-ordered GMFs, with a fraction `frac` of the sites per event
+    cols = ['sid', 'eid'] + ['gmv_%d' % m for m in range(num_imts)]
+    h5.create_df('gmf_data', [(col, U32 if col in 'sid eid' else F32)
+                              for col in cols])
+    for slc in general.gen_slices(0, num_events, 1000):
+        eids = numpy.arange(slc.start, slc.stop, dtype=U32)
+        sid = numpy.tile(numpy.arange(num_sites, dtype=U32), len(eids))
+        eid = numpy.repeat(eids, num_sites)
+        ok = rng.random(len(sid)) < frac
+        hdf5.extend(h5['gmf_data/sid'], sid[ok])
+        hdf5.extend(h5['gmf_data/eid'], eid[ok])
+        for col in cols[2:]:
+            hdf5.extend(h5['gmf_data/' + col],
+                        rng.random(ok.sum()).astype(F32))
+
+
+def main(num_sites: int = 20_000, num_events: int = 1000,
+         num_imts: int = 3, frac: float = .5, maxrows: int = 2_000_000):
+    """
+    Compare the time spent in reading the GMFs of a few sites by scanning
+    gmf_data and by using the copy sorted by site (gmf_by_site)
+    """
+    rng = numpy.random.default_rng(42)
+    with hdf5.File.temporary() as h5:
+        t0 = time.time()
+        create_gmf_data(h5, num_sites, num_events, num_imts, frac, rng)
+        size = len(h5['gmf_data/sid'])
+        print('Created {:_d} rows in {:.1f}s'.format(size, time.time() - t0))
+        t0 = time.time()
+        store_gmf_by_site(h5, maxrows)
+        print('Stored gmf_by_site in {:.1f}s'.format(time.time() - t0))
+        rows = []
+        for nsites in (1, 10, 100, 1000):
+            sids = rng.choice(num_sites, nsites, replace=False)
+            t0 = time.time()
+            df = h5.read_df('gmf_data')
+            old = df[numpy.isin(df.sid.to_numpy(), sids)]
+            t_old = time.time() - t0
+            t0 = time.time()
+            new = read_gmf_by_site(h5, sids)
+            t_new = time.time() - t0
+            assert len(old) == len(new)
+            rows.append((nsites, len(new), t_old, t_new, t_old / t_new))
+        fname = h5.path
+    os.remove(fname)
+    print(text_table(rows, ['sites', 'rows', 'scan_time', 'by_site_time',
+                            'speedup'], ext='org'))
+
+
+main.num_sites = 'number of sites'
+main.num_events = 'number of events'
+main.num_imts = 'number of IMTs'
+main.frac = 'fraction of the sites affected by each event'
+main.maxrows = 'number of rows kept in memory by store_gmf_by_site'
+
+if __name__ == '__main__':
+    sap.run(main)
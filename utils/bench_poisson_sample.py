@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2025, GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import time
+import numpy
+from openquake.baselib import sap
+from openquake.hazardlib import nrml, sourceconverter
+from openquake.hazardlib.source.base import poisson_sample
+from openquake.calculators.views import text_table
+
+DEMOS = os.path.join(os.path.dirname(__file__), '..', 'demos', 'hazard')
+MODELS = ['SimpleFaultSourceClassicalPSHA', 'ComplexFaultSourceClassicalPSHA',
+          'LogicTreeCase1ClassicalPSHA', 'Disaggregation']
+
+
+def old_poisson_sample(src, eff_num_ses, seed):
+    # the implementation building all the ruptures before sampling
+    rng = numpy.random.default_rng(seed)
+    tom = src.temporal_occurrence_model
+    rupids = src.offset + numpy.arange(src.num_ruptures)
+    ruptures = list(src.iter_ruptures())
+    rates = numpy.array([rup.occurrence_rate for rup in ruptures])
+    occurs = rng.poisson(rates * tom.time_span * eff_num_ses)
+    for rup, rupid, num_occ in zip(ruptures, rupids, occurs):
+        if num_occ:
+            yield rup, rupid, num_occ
+
+
+def get_fault_sources():
+    conv = sourceconverter.SourceConverter(50., 2., 5., 0.1, 10.)
+    for model in MODELS:
+        dirname = os.path.join(DEMOS, model)
+        for fname in sorted(os.listdir(dirname)):
+            if (fname.startswith('source_model') and fname.endswith('.xml')
+                    and 'logic_tree' not in fname):
+                for grp in nrml.to_python(os.path.join(dirname, fname), conv):
+                    for src in grp:
+                        if src.code in b'SC':  # simple and complex faults
+                            src.num_ruptures = src.count_ruptures()
+                            yield model, src
+
+
+def main(years: int = 100_000):
+    """
+    Compare the time spent in sampling the ruptures of the fault sources
+    of the demos by building all the ruptures and by building only the
+    ruptures occurring in the stochastic event set
+    """
+    rows = []
+    for model, src in get_fault_sources():
+        eff_num_ses = years / src.temporal_occurrence_model.time_span
+        t0 = time.time()
+        old = list(old_poisson_sample(src, eff_num_ses, 42))
+        t_old = time.time() - t0
+        t0 = time.time()
+        new = list(poisson_sample(src, eff_num_ses, 42))
+        t_new = time.time() - t0
+        assert [r[1:] for r in old] == [r[1:] for r in new]
+        rows.append((model, src.source_id, src.num_ruptures, len(new),
+                     t_old, t_new, t_old / t_new))
+    print(text_table(rows, ['model', 'source', 'num_ruptures', 'occurring',
+                            'old_time', 'new_time', 'speedup'], ext='org'))
+
+
+main.years = 'effective investigation time of the stochastic event set'
+
+if __name__ == '__main__':
+    sap.run(main)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2025, GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+import time
+import numpy
+import pandas
+from openquake.baselib import sap
+from openquake.calculators.event_based_risk import SiteIndex
+from openquake.calculators.views import text_table
+
+U32 = numpy.uint32
+
+
+def by_isin(df, assets):
+    # the filtering used in gen_outputs before the SiteIndex
+    sids = df.sid.to_numpy()
+    nrows = 0
+    for _taxo, adf in assets.groupby('taxonomy'):
+        nrows += len(df[numpy.isin(sids, adf.site_id.unique())])
+    return nrows
+
+
+def by_index(df, assets):
+    sidx = SiteIndex(df.sid.to_numpy())
+    nrows = 0
+    for _taxo, adf in assets.groupby('taxonomy'):
+        nrows += len(df.iloc[sidx.get_rows(adf.site_id.unique())])
+    return nrows
+
+
+def main(num_sites: int = 10_000, num_events: int = 200,
+         num_assets: int = 100_000, num_taxonomies: int = 600):
+    """
+    Compare the GMF filtering in gen_outputs done with numpy.isin for
+    each taxonomy with the filtering done with the CSR-style SiteIndex,
+    on a synthetic exposure with many taxonomies
+    """
+    rng = numpy.random.default_rng(42)
+    assets = pandas.DataFrame(dict(
+        site_id=rng.integers(0, num_sites, num_assets),
+        taxonomy=rng.integers(0, num_taxonomies, num_assets)))
+    rows = []
+    for frac in (.1, .5, 1.):
+        # GMFs above the minimum intensity only on a fraction of the sites
+        sites = rng.choice(num_sites, int(num_sites * frac), replace=False)
+        df = pandas.DataFrame(dict(
+            eid=numpy.repeat(numpy.arange(num_events, dtype=U32), len(sites)),
+            sid=numpy.tile(U32(sites), num_events)))
+        df['gmv_0'] = rng.uniform(0, 1, len(df))
+        t0 = time.time()
+        n_old = by_isin(df, assets)
+        t_old = time.time() - t0
+        t0 = time.time()
+        n_new = by_index(df, assets)
+        t_new = time.time() - t0
+        assert n_old == n_new, (n_old, n_new)
+        rows.append((len(df), num_taxonomies, t_old, t_new, t_old / t_new))
+    print(text_table(rows, ['gmf_rows', 'taxonomies', 'isin_time',
+                            'index_time', 'speedup'], ext='org'))
+
+
+main.num_sites = 'number of sites'
+main.num_events = 'number of events'
+main.num_assets = 'number of assets'
+main.num_taxonomies = 'number of taxonomies'
+
+if __name__ == '__main__':
+    sap.run(main)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2025, GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+import time
+import numpy
+from openquake.baselib import sap
+from openquake.baselib.performance import compile
+from openquake.hazardlib.tom import get_pnes
+from openquake.hazardlib.map_array import MapArray
+from openquake.calculators.views import text_table
+
+U32 = numpy.uint32
+F64 = numpy.float64
+
+
+# the kernels used before the fused ones, with the gather outside
+@compile("void(float32[:, :, :], float64[:, :, :], float64[:], "
+         "float64[:, :], uint32[:], float64)")
+def old_update_pmap_i(arr, poes, rates, probs_occur, sidxs, itime):
+    _N, L, G = arr.shape
+    for poe, rate, probs, sidx in zip(poes, rates, probs_occur, sidxs):
+        no_probs = len(probs) == 0
+        for g in range(G):
+            if no_probs:
+                for li in range(L):
+                    arr[sidx, li, g] *= numpy.exp(-rate * poe[li, g] * itime)
+            else:
+                arr[sidx, :, g] *= get_pnes(
+                    rate, probs, poe[:, g].astype(numpy.float64), itime)
+
+
+@compile("void(float32[:, :, :], float64[:, :, :], float64[:], "
+         "float64[:, :], float64[:], uint32[:], float64)")
+def old_update_pmap_m(arr, poes, rates, probs_occur, weights, sidxs, itime):
+    _N, _L, G = arr.shape
+    for poe, rate, probs, w, sidx in zip(
+            poes, rates, probs_occur, weights, sidxs):
+        for g in range(G):
+            arr[sidx, :, g] += (1. - get_pnes(
+                rate, probs, poe[:, g].astype(numpy.float64), itime)) * w
+
+
+def old_indep(pmap, poes, ctx, mutex_weight):
+    old_update_pmap_i(pmap.array, poes, ctx.occurrence_rate, ctx.probs_occur,
+                      pmap.sidx[ctx.sids], 1.)
+
+
+def new_indep(pmap, poes, ctx, mutex_weight):
+    pmap.update_indep(poes, ctx, 1.)
+
+
+def old_mutex(pmap, poes, ctx, mutex_weight):
+    weights = numpy.array([
+        mutex_weight[src_id, rup_id]
+        for src_id, rup_id in zip(ctx.src_id, ctx.rup_id)])
+    old_update_pmap_m(pmap.array, poes, ctx.occurrence_rate, ctx.probs_occur,
+                      weights, pmap.sidx[ctx.sids], 1.)
+
+
+def new_mutex(pmap, poes, ctx, mutex_weight):
+    pmap.update_mutex(poes, ctx, 1., mutex_weight)
+
+
+def old_cluster(pmap, poes, ctx, mutex_weight):
+    for poe, sidx in zip(poes, pmap.sidx[ctx.sids]):
+        pmap.array[sidx] *= 1. - poe
+
+
+def new_cluster(pmap, poes, ctx, mutex_weight):
+    pmap.update_cluster(poes, ctx)
+
+
+def make_ctx(N, C, P, rng):
+    dt = [('sids', U32), ('src_id', U32), ('rup_id', U32),
+          ('occurrence_rate', F64), ('weight', F64), ('probs_occur', (F64, P))]
+    ctx = numpy.zeros(C, dt).view(numpy.recarray)
+    ctx.sids = rng.integers(0, N, C)
+    ctx.rup_id = numpy.arange(C)
+    ctx.occurrence_rate = rng.uniform(1E-5, 1E-3, C)
+    ctx.weight = rng.uniform(0, 1, C)
+    if P:
+        ctx.probs_occur = rng.dirichlet(numpy.ones(P), C)
+    return ctx
+
+
+def bench(func, N, L, G, poes, ctx, fill):
+    pmap = MapArray(numpy.arange(N, dtype=U32), L, G).fill(fill)
+    dic = dict(zip(zip(ctx.src_id, ctx.rup_id), ctx.weight))
+    func(pmap, poes[:1], ctx[:1], dic)  # warmup
+    pmap.fill(fill)
+    t0 = time.time()
+    func(pmap, poes, ctx, dic)
+    return time.time() - t0, pmap.array
+
+
+def main(num_sites: int = 100_000, num_ctxs: int = 200_000,
+         num_levels: int = 20, num_gsims: int = 4):
+    """
+    Compare the time spent in updating the probability map with the
+    fused kernels and with the previous implementation, for independent
+    (poissonian and nonparametric), mutex and cluster ruptures
+    """
+    N, C, L, G = num_sites, num_ctxs, num_levels, num_gsims
+    rng = numpy.random.default_rng(42)
+    poes = rng.uniform(0, .1, (C, L, G))
+    rows = []
+    for case, old, new, P, fill in [
+            ('poissonian', old_indep, new_indep, 0, 1),
+            ('nonparametric', old_indep, new_indep, 3, 1),
+            ('mutex', old_mutex, new_mutex, 3, 0),
+            ('cluster', old_cluster, new_cluster, 0, 1)]:
+        ctx = make_ctx(N, C, P, rng)
+        t_old, arr_old = bench(old, N, L, G, poes, ctx, fill)
+        t_new, arr_new = bench(new, N, L, G, poes, ctx, fill)
+        rows.append((case, t_old, t_new, t_old / t_new,
+                     numpy.abs(arr_old - arr_new).max()))
+    print(text_table(rows, ['case', 'old_time', 'new_time', 'speedup',
+                            'max_diff'], ext='org'))
+
+
+main.num_sites = 'number of sites'
+main.num_ctxs = 'number of contexts'
+main.num_levels = 'number of intensity measure levels'
+main.num_gsims = 'number of GSIMs'
+
+if __name__ == '__main__':
+    sap.run(main)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2025, GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+import time
+import numpy
+import pandas
+from openquake.baselib import sap
+from openquake.risklib.scientific import VulnerabilityFunction
+from openquake.calculators.views import text_table
+
+
+def main(num_gmvs: int = 1_000_000, num_imls: int = 30):
+    """
+    Compare the number of GMVs per second interpolated by a vulnerability
+    function with and without the lookup table, for different table sizes
+    """
+    gen = numpy.random.default_rng(42)
+    imls = numpy.geomspace(.01, 3., num_imls)
+    mlrs = numpy.sort(gen.uniform(0, 1, num_imls))
+    covs = gen.uniform(0, .5, num_imls)
+    vf = VulnerabilityFunction('vf', 'PGA', imls, mlrs, covs)
+    vf.init()
+    gmf_df = pandas.DataFrame(dict(
+        eid=numpy.arange(num_gmvs), sid=numpy.zeros(num_gmvs),
+        PGA=numpy.exp(gen.normal(-1.5, 1., num_gmvs))))
+    rows = []
+    for size in (0, 100, 1000, 10_000):
+        err = vf.build_lut(size)
+        vf.interpolate(gmf_df[:10], 'PGA')  # warmup
+        t0 = time.time()
+        vf.interpolate(gmf_df, 'PGA')
+        dt = time.time() - t0
+        rows.append((size, err, dt, num_gmvs / dt))
+    print(text_table(rows, ['lookup_size', 'max_error', 'time',
+                            'gmvs_per_sec'], ext='org'))
+
+
+main.num_gmvs = 'number of ground motion values'
+main.num_imls = 'number of IMLs of the vulnerability function'
+
+if __name__ == '__main__':
+    sap.run(main)